@@ -1,10 +1,45 @@
 from django.contrib import admin
-from .models import Order, OrderItem, User
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.forms.models import BaseInlineFormSet
+from .models import InsufficientStock, Order, OrderItem, User
+
+
+# los items que va a tener la orden después de guardar y, antes de guardar nada, si hay stock para el cambio
+class OrderItemFormSet(BaseInlineFormSet):
+    # los items existentes que no se borran y los nuevos que se completaron
+    def saved_items(self):
+        return [
+            form.instance for form in self.forms
+            if not self._should_delete_form(form) and (form.instance.pk is not None or form.has_changed())
+        ]
+
+    def clean(self):
+        super().clean()
+        if any(self.errors):
+            return
+        order = self.instance
+        old_quantities = {}
+        if not order._state.adding:
+            stored, items = order.lock_for_update()
+            old_quantities = Order.reserved_quantities(stored.status, items)
+        new_quantities = Order.reserved_quantities(order.status, self.saved_items())
+        # aplicamos el cambio en un savepoint que se deshace, el stock se reserva en OrderAdmin.save_related
+        try:
+            with transaction.atomic():
+                Order.change_stock(old_quantities, new_quantities)
+                transaction.set_rollback(True)
+        except InsufficientStock as exc:
+            names = ', '.join(str(item.product) for item in self.saved_items() if item.product_id in exc.product_ids)
+            raise ValidationError(f'No hay stock suficiente para: {names}')
 
 
 # TabularInline: permite adjuntar objetos relacionados a otros objetos cuando los creamos de forma dinámica
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
+    formset = OrderItemFormSet
+    # el precio se toma del producto al guardar el item
+    readonly_fields = ('unit_price',)
 
 # OrderAdmin: mediante esta clase vamos a integrar los modelos de Order y OrderItem al admin de django
 class OrderAdmin(admin.ModelAdmin):
@@ -12,6 +47,40 @@ class OrderAdmin(admin.ModelAdmin):
     inlines = [
         OrderItemInline
     ]
+    # total_price e item_count se calculan a partir de los items, no se editan a mano
+    readonly_fields = ('total_price', 'item_count')
+
+    # cancelar, borrar o cambiar los items desde el admin reserva y libera stock igual que la API
+    # save_model guarda lo que retenía la orden antes del cambio, leído con bloqueo dentro de la transacción del admin
+    def save_model(self, request, obj, form, change):
+        obj.previous_stock = {}
+        if change:
+            stored, items = obj.lock_for_update()
+            obj.previous_stock = Order.reserved_quantities(stored.status, items)
+        super().save_model(request, obj, form, change)
+
+    # si se cambia el producto de un item se guarda con el precio actual del nuevo producto
+    def save_formset(self, request, form, formset, change):
+        for item_form in formset.forms:
+            if 'product' in item_form.changed_data:
+                item_form.instance.unit_price = None
+        super().save_formset(request, form, formset, change)
+
+    # save_related: se ejecuta después de guardar los inlines, dentro de la transacción del admin
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        order = form.instance
+        Order.change_stock(order.previous_stock, Order.reserved_quantities(order.status, order.items.all()))
+        order.recalculate_totals()
+
+    def delete_model(self, request, obj):
+        obj.delete_releasing_stock()
+
+    # la acción "eliminar seleccionados"
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            for order in queryset:
+                order.delete_releasing_stock()
 
 # admin.site.register: registra en el sitio de admin el modelo Order mediante la clase OrderAdmin
 admin.site.register(Order, OrderAdmin)
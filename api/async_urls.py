@@ -0,0 +1,14 @@
+from django.urls import path
+
+from . import async_views
+
+
+# las rutas de lectura de api/urls.py con las views async, con los mismos nombres
+# se agregan antes de api.urls en backend/async_urls.py, las demás rutas siguen siendo las sync
+urlpatterns = [
+    path('products/', async_views.AsyncProductListView.as_view(), name='product-list'),
+    path('products/info/', async_views.AsyncProductInfoView.as_view(), name='product-info'),
+    path('products/<int:product_id>/', async_views.AsyncProductDetailView.as_view(), name='product-detail'),
+    path('orders/', async_views.AsyncOrderListView.as_view(), name='order-list'),
+    path('orders/<uuid:pk>/', async_views.AsyncOrderDetailView.as_view(), name='order-detail'),
+]
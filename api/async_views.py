@@ -0,0 +1,281 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.http import StreamingHttpResponse
+from django.shortcuts import aget_object_or_404
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+from api.cache import (CatalogCacheMixin, acached_for_catalog_version, aget_catalog_version, get_response_cache,
+                       record)
+from api.conditional import ConditionalGetMixin, cached_conditional_response
+from api.models import Product
+from api.serializers import ProductSummarySerializer, fast_orders, fast_products, order_items
+from api.sparse import SparseFieldsMixin
+from api.views import OrderViewSet, ProductDetailAPIView, ProductInfoAPIView, ProductListCreateAPIView
+
+
+# variantes async de los GET de productos y ordenes, para servir con backend.asgi (ver backend/async_urls.py)
+# DRF no tiene views async: la view de DRF se usa igual para los permisos, la negociación, la paginación,
+# los errores y el renderer, pero las queries se hacen con el ORM async y el cache con su API async,
+# así un worker ASGI atiende otras requests mientras espera la DB o a un cliente lento
+# la API navegable, los demás formatos y los métodos que escriben se delegan en la view sync en un hilo
+class AsyncReadView(View):
+    # la view de DRF y, para los viewsets, las acciones de cada método como en el router
+    view_class = None
+    actions = None
+    view_initkwargs = {}
+    # la view sync de view_class, la arma as_view
+    sync_view = None
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        if cls.actions is not None:
+            sync_view = cls.view_class.as_view(cls.actions, **cls.view_initkwargs)
+        else:
+            sync_view = cls.view_class.as_view(**cls.view_initkwargs)
+        view = super().as_view(sync_view=sync_view, **initkwargs)
+        # igual que las views de DRF: query_budget, las métricas y el schema leen la view de DRF desde cls
+        view.cls = cls.view_class
+        view.initkwargs = cls.view_initkwargs
+        if cls.actions is not None:
+            view.actions = cls.actions
+        return csrf_exempt(view)
+
+    async def get(self, request, *args, **kwargs):
+        return await self.read(request, *args, **kwargs)
+
+    async def delegate(self, request, *args, **kwargs):
+        return await sync_to_async(self.sync_view)(request, *args, **kwargs)
+
+    post = put = patch = delete = options = delegate
+
+    # la respuesta de la view de DRF, el resultado de handle o el error
+    async def handle(self, view, request):
+        raise NotImplementedError
+
+    # los validadores de ConditionalGetMixin.get_validators con el ORM async
+    async def get_validators(self, view, request):
+        return None
+
+    # si la view sync arma esta respuesta de otra forma (por ej. sin FAST_SERIALIZATION)
+    def use_sync_view(self, view, request):
+        return request.accepted_renderer.format != 'json'
+
+    def build_view(self, request, *args, **kwargs):
+        view = self.view_class(**self.view_initkwargs)
+        if self.actions is not None:
+            view.action_map = {**self.actions}
+            view.action_map.setdefault('head', view.action_map['get'])
+            for method, action in view.action_map.items():
+                setattr(view, method, getattr(view, action))
+        view.args, view.kwargs = args, kwargs
+        view.headers = view.default_response_headers
+        view.request = view.initialize_request(request, *args, **kwargs)
+        return view
+
+    async def read(self, request, *args, **kwargs):
+        view = self.build_view(request, *args, **kwargs)
+        drf_request = view.request
+        try:
+            view.format_kwarg = view.get_format_suffix(**kwargs)
+            drf_request.accepted_renderer, drf_request.accepted_media_type = view.perform_content_negotiation(
+                drf_request
+            )
+        except Exception as exc:
+            return self.finalize(view, view.handle_exception(exc))
+        if self.use_sync_view(view, drf_request):
+            return await self.delegate(request, *args, **kwargs)
+
+        if not isinstance(view, CatalogCacheMixin) or not settings.CATALOG_CACHE['ENABLED']:
+            return await self.respond(view)
+        # igual que CatalogCacheMixin.dispatch con la API async del cache
+        cache = get_response_cache()
+        key = view.get_cache_key(request, await aget_catalog_version())
+        response = await cache.aget(key)
+        if response is not None:
+            record(hit=True)
+            response['X-Cache'] = 'HIT'
+            return cached_conditional_response(request, response)
+        record(hit=False)
+        response = await self.respond(view)
+        if response.status_code == 200 and isinstance(response, Response):
+            await cache.aset(key, response, timeout=settings.CATALOG_CACHE['TIMEOUT'])
+        response['X-Cache'] = 'MISS'
+        return response
+
+    # initial y handler de APIView.dispatch
+    async def respond(self, view):
+        request = view.request
+        try:
+            version, scheme = view.determine_version(request, *view.args, **view.kwargs)
+            request.version, request.versioning_scheme = version, scheme
+            await self.authenticate(request)
+            view.check_permissions(request)
+            view.check_throttles(request)
+            if isinstance(view, SparseFieldsMixin):
+                view.sparse_fields = view.get_sparse_fields(request)
+            if isinstance(view, ConditionalGetMixin):
+                view.etag = view.last_modified = None
+                view.check_conditional(request, await self.get_validators(view, request))
+            response = await self.handle(view, request)
+        except Exception as exc:
+            response = view.handle_exception(exc)
+        return self.finalize(view, response)
+
+    @staticmethod
+    def finalize(view, response):
+        response = view.finalize_response(view.request, response, *view.args, **view.kwargs)
+        if isinstance(response, Response):
+            response.render()
+        return response
+
+    # Request._authenticate sin consultas sync: la sesión con auser() y los JWT con aauthenticate
+    @staticmethod
+    async def authenticate(request):
+        for authenticator in request.authenticators:
+            try:
+                if hasattr(authenticator, 'aauthenticate'):
+                    user_auth_tuple = await authenticator.aauthenticate(request)
+                elif isinstance(authenticator, SessionAuthentication):
+                    user = await request._request.auser()
+                    user_auth_tuple = None
+                    if user and user.is_active:
+                        authenticator.enforce_csrf(request)
+                        user_auth_tuple = user, None
+                else:
+                    user_auth_tuple = await sync_to_async(authenticator.authenticate)(request)
+            except APIException:
+                request._not_authenticated()
+                raise
+            if user_auth_tuple is not None:
+                request._authenticator = authenticator
+                request.user, request.auth = user_auth_tuple
+                return
+        request._not_authenticated()
+
+
+async def acatalog_validators():
+    totals = await Product.objects.aaggregate(last_modified=Max('updated_at'))
+    return await aget_catalog_version(), totals['last_modified']
+
+
+class AsyncProductListView(AsyncReadView):
+    view_class = ProductListCreateAPIView
+
+    def use_sync_view(self, view, request):
+        return super().use_sync_view(view, request) or not settings.FAST_SERIALIZATION
+
+    async def get_validators(self, view, request):
+        return await acatalog_validators()
+
+    async def handle(self, view, request):
+        queryset = view.get_fast_queryset()
+        page = await view.paginator.apaginate_queryset(queryset, request, view=view)
+        data = fast_products(page, view.sparse_fields)
+        return view.get_paginated_response(data)
+
+
+class AsyncProductDetailView(AsyncReadView):
+    view_class = ProductDetailAPIView
+
+    async def get_validators(self, view, request):
+        updated_at = await view.get_queryset().filter(pk=view.kwargs[view.lookup_url_kwarg]).values_list(
+            'updated_at', flat=True
+        ).afirst()
+        if updated_at is None:
+            return None
+        return updated_at, updated_at
+
+    async def handle(self, view, request):
+        instance = await aget_object(view)
+        return Response(view.get_serializer(instance).data)
+
+
+class AsyncProductInfoView(AsyncReadView):
+    view_class = ProductInfoAPIView
+
+    async def get_validators(self, view, request):
+        return await acatalog_validators()
+
+    async def handle(self, view, request):
+        summary = await acached_for_catalog_version('summary', sync_to_async(Product.objects.summary))
+        summary = ProductSummarySerializer(summary).data
+        return StreamingHttpResponse(self.stream(summary), content_type='application/json')
+
+    # ProductInfoAPIView.stream con el ORM async
+    @staticmethod
+    async def stream(summary):
+        yield ProductInfoAPIView.stream_start(summary)
+        last_pk = None
+        separator = ''
+        while True:
+            products = [product async for product in ProductInfoAPIView.chunk_queryset(last_pk)]
+            if not products:
+                break
+            last_pk = products[-1].pk
+            yield separator + ProductInfoAPIView.render_chunk(products)
+            separator = ', '
+            if len(products) < settings.PRODUCT_INFO_CHUNK_SIZE:
+                break
+        yield ']}'
+
+
+class AsyncOrderListView(AsyncReadView):
+    view_class = OrderViewSet
+    actions = {'get': 'list', 'post': 'create'}
+    view_initkwargs = {'basename': 'order', 'detail': False}
+
+    def use_sync_view(self, view, request):
+        return super().use_sync_view(view, request) or not settings.FAST_SERIALIZATION
+
+    # las mismas keys que OrderViewSet.get_validators, el ETag es el mismo con las dos views
+    async def get_validators(self, view, request):
+        totals = await view.filter_queryset(view.get_queryset()).aaggregate(
+            last_modified=Max('updated_at'), count=Count('pk')
+        )
+        key = (request.user.pk, totals['count'], totals['last_modified'], await aget_catalog_version())
+        return key, totals['last_modified']
+
+    async def handle(self, view, request):
+        queryset = view.get_fast_queryset()
+        page = await view.paginator.apaginate_queryset(queryset, request, view=view)
+        items = order_items(page, view.sparse_fields)
+        if items is not None:
+            items = [item async for item in items]
+        return view.get_paginated_response(fast_orders(page, view.sparse_fields, items))
+
+
+class AsyncOrderDetailView(AsyncReadView):
+    view_class = OrderViewSet
+    actions = {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}
+    view_initkwargs = {'basename': 'order', 'detail': True}
+
+    async def get_validators(self, view, request):
+        qs = view.filter_queryset(view.get_queryset())
+        try:
+            updated_at = await qs.filter(pk=view.kwargs[view.lookup_field]).values_list(
+                'updated_at', flat=True
+            ).afirst()
+        except (TypeError, ValueError, ValidationError):
+            return None
+        if updated_at is None:
+            return None
+        return (request.user.pk, updated_at, await aget_catalog_version()), updated_at
+
+    async def handle(self, view, request):
+        instance = await aget_object(view)
+        return Response(view.get_serializer(instance).data)
+
+
+# GenericAPIView.get_object con aget
+async def aget_object(view):
+    queryset = view.filter_queryset(view.get_queryset())
+    lookup_url_kwarg = view.lookup_url_kwarg or view.lookup_field
+    instance = await aget_object_or_404(queryset, **{view.lookup_field: view.kwargs[lookup_url_kwarg]})
+    view.check_object_permissions(view.request, instance)
+    return instance
@@ -0,0 +1,101 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer as BaseTokenObtainPairSerializer
+from rest_framework_simplejwt.settings import api_settings
+
+from api.cache import aget_user_version, get_user_version
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    # JWTAuthentication hace un SELECT de api_user en cada request para armar el usuario del token
+    # acá el usuario se guarda en JWT_USER_CACHE['USERS'] (LRU en memoria con TIMEOUT) por id, jti y versión del
+    # usuario; User.save y User.delete cambian la versión, así un usuario desactivado o con otra contraseña
+    # vuelve a pasar por las validaciones de JWTAuthentication en la request siguiente
+    def get_user(self, validated_token):
+        config = settings.JWT_USER_CACHE
+        if not config['ENABLED']:
+            return super().get_user(validated_token)
+        user_id = self.get_user_id(validated_token)
+        cache = caches[config['USERS']]
+        key = self.get_cache_key(validated_token, user_id, get_user_version(user_id))
+        user = cache.get(key)
+        if user is None:
+            # solo se guardan los usuarios válidos, los errores (inactivo, inexistente) se vuelven a consultar
+            user = super().get_user(validated_token)
+            cache.set(key, user, timeout=config['TIMEOUT'])
+        return user
+
+    # authenticate y get_user con la API async del cache, para las views de api/async_views.py
+    # en un miss la consulta del usuario y sus validaciones son las de JWTAuthentication, en el hilo de la request
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        config = settings.JWT_USER_CACHE
+        if not config['ENABLED']:
+            return await sync_to_async(JWTAuthentication.get_user)(self, validated_token)
+        user_id = self.get_user_id(validated_token)
+        cache = caches[config['USERS']]
+        key = self.get_cache_key(validated_token, user_id, await aget_user_version(user_id))
+        user = await cache.aget(key)
+        if user is None:
+            user = await sync_to_async(JWTAuthentication.get_user)(self, validated_token)
+            await cache.aset(key, user, timeout=config['TIMEOUT'])
+        return user
+
+    @staticmethod
+    def get_user_id(validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+    @staticmethod
+    def get_cache_key(validated_token, user_id, version):
+        return f'auth:user:{user_id}:{validated_token.get(api_settings.JTI_CLAIM)}:{version}'
+
+
+class ReadOnlyClaimsJWTAuthentication(CachedJWTAuthentication):
+    # opcional para views de solo lectura: en GET, HEAD y OPTIONS el usuario es un TokenUser armado con los claims
+    # del token (id e is_staff), sin DB ni cache; en las escrituras se usa el usuario de CachedJWTAuthentication
+    # un cambio de permisos o una desactivación recién se ve en las lecturas cuando vence el access token
+    # la view solo puede usar request.user.pk, is_staff e is_authenticated
+    def authenticate(self, request):
+        self.read_only = request.method in SAFE_METHODS
+        return super().authenticate(request)
+
+    def get_user(self, validated_token):
+        if self.read_only:
+            if api_settings.USER_ID_CLAIM not in validated_token:
+                raise InvalidToken('Token contained no recognizable user identification')
+            return api_settings.TOKEN_USER_CLASS(validated_token)
+        return super().get_user(validated_token)
+
+    async def aauthenticate(self, request):
+        self.read_only = request.method in SAFE_METHODS
+        return await super().aauthenticate(request)
+
+    async def aget_user(self, validated_token):
+        if self.read_only:
+            return self.get_user(validated_token)
+        return await super().aget_user(validated_token)
+
+
+class TokenObtainPairSerializer(BaseTokenObtainPairSerializer):
+    # is_staff en el token para que TokenUser lo tenga sin consultar la DB
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['is_staff'] = user.is_staff
+        return token
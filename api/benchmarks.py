@@ -0,0 +1,700 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connections
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from rest_framework.pagination import Cursor
+
+from api.models import Order, OrderItem, Product, User
+from api.querybudget import inspect_queries
+
+# registro de escenarios que puede ejecutar el comando benchmark
+SCENARIOS = {}
+
+
+def scenario(name):
+    # decorador que registra la función en SCENARIOS con el nombre indicado
+    def decorator(func):
+        SCENARIOS[name] = func
+        return func
+    return decorator
+
+
+@contextmanager
+def temporary_database():
+    # trabajamos sobre una base de datos temporal para no tocar los datos reales
+    # setup_databases también apunta la réplica de lectura (TEST MIRROR) a la base temporal
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False, serialized_aliases=set())
+    try:
+        yield
+    finally:
+        # la réplica es otra conexión al mismo archivo, si queda abierta quedan el -wal y el -shm de la base temporal
+        connections.close_all()
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+
+
+def measure(func, repeat=5):
+    # ejecutamos func varias veces y devolvemos el tiempo medio en ms y las queries de la última ejecución
+    timings = []
+    for _ in range(repeat):
+        # en todas las conexiones, las lecturas de productos y ordenes van a la réplica (api.routers)
+        with inspect_queries() as inspector:
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+    return {
+        'ms': round(sum(timings) / len(timings), 2),
+        'queries': inspector.count,
+    }
+
+
+def seed_orders(orders, items_per_order=3, products=50, seed=0):
+    # genera productos, un usuario y orders con items en lotes, sin pasar por los serializers
+    rnd = random.Random(seed)
+    user, _ = User.objects.get_or_create(username='bench')
+    # los nombres son únicos, si los productos ya existen de un seed anterior se reutilizan
+    Product.objects.bulk_create(
+        (
+            Product(
+                name=f'Product {i}',
+                description='benchmark',
+                price=Decimal(rnd.randint(100, 50000)) / 100,
+                stock=rnd.randint(0, 100)
+            )
+            for i in range(products)
+        ),
+        ignore_conflicts=True
+    )
+    prices = dict(Product.objects.values_list('pk', 'price'))
+    product_ids = list(prices)
+    order_objs = Order.objects.bulk_create(Order(user=user) for _ in range(orders))
+    OrderItem.objects.bulk_create(
+        (
+            OrderItem(order=order, product_id=product_id, quantity=rnd.randint(1, 5), unit_price=prices[product_id])
+            for order in order_objs
+            for product_id in rnd.sample(product_ids, min(items_per_order, len(product_ids)))
+        ),
+        batch_size=1000
+    )
+    Order.objects.filter(pk__in=[order.pk for order in order_objs]).recalculate_totals()
+    return user
+
+
+@scenario('order_totals')
+def order_totals(scale):
+    # compara el total calculado en Python, el anotado con un aggregate y el guardado en la orden
+    seed_orders(scale)
+    cases = {
+        'python': lambda: [
+            sum(item.item_subtotal for item in order.items.all())
+            for order in Order.objects.prefetch_related('items__product')
+        ],
+        'annotated': lambda: [
+            order.computed_total_price for order in Order.objects.annotate_computed_totals()
+        ],
+        'stored': lambda: [order.total_price for order in Order.objects.all()],
+    }
+    rows = [{'case': label, 'orders': scale, **measure(run)} for label, run in cases.items()]
+    # cuántas veces más rápido que sumar en Python
+    python_ms = rows[0]['ms']
+    for row in rows:
+        row['vs_python'] = round(python_ms / row['ms'], 1) if row['ms'] else None
+    return rows
+
+
+@scenario('order_create')
+def order_create(scale):
+    # latencia de POST /orders/ a medida que crece la cantidad de items de la orden
+    from django.test import Client
+
+    user = seed_orders(0, products=max(200, scale // 10))
+    # stock suficiente para que ninguna orden se rechace por falta de stock
+    Product.objects.update(stock=1_000_000)
+    client = Client()
+    client.force_login(user)
+    product_ids = list(Product.objects.values_list('pk', flat=True))
+    rows = []
+    for item_count in (1, 10, 50, 200):
+        payload = {
+            'status': 'Pending',
+            'items': [{'product': pk, 'quantity': 1} for pk in product_ids[:item_count]],
+        }
+        result = measure(lambda: client.post('/orders/', payload, content_type='application/json'), repeat=10)
+        rows.append({'case': 'create', 'items': item_count, **result})
+    return rows
+
+
+def run_concurrent_orders(user, product_ids, threads=8, orders_per_thread=50, quantity=1):
+    # crea ordenes desde varios hilos a la vez con el test client y cuenta las aceptadas y rechazadas
+    # si SQLite devuelve "database is locked" el hilo reintenta la misma orden
+    from django.db import OperationalError
+    from django.test import Client
+
+    payload = {
+        'status': 'Pending',
+        'items': [{'product': pk, 'quantity': quantity} for pk in product_ids],
+    }
+    results = {'created': 0, 'rejected': 0, 'retries': 0}
+    lock = threading.Lock()
+
+    def worker(client):
+        try:
+            for _ in range(orders_per_thread):
+                while True:
+                    try:
+                        response = client.post('/orders/', payload, content_type='application/json')
+                        break
+                    except OperationalError:
+                        with lock:
+                            results['retries'] += 1
+                key = 'created' if response.status_code == 201 else 'rejected'
+                with lock:
+                    results[key] += 1
+        finally:
+            connections.close_all()
+
+    # el login se hace antes de arrancar los hilos para que solo compitan los POST
+    clients = []
+    for _ in range(threads):
+        client = Client()
+        client.force_login(user)
+        clients.append(client)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(client,)) for client in clients]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    results['orders_per_sec'] = round((results['created'] + results['rejected']) / elapsed, 1)
+    return results
+
+
+@scenario('stock_contention')
+def stock_contention(scale):
+    # ordenes concurrentes sobre pocos productos con stock limitado, el stock nunca puede quedar negativo
+    user = seed_orders(0, products=0)
+    products = Product.objects.bulk_create(
+        Product(name=f'Hot {i}', description='benchmark', price=Decimal('10.00'), stock=scale // 4)
+        for i in range(3)
+    )
+    result = run_concurrent_orders(user, [product.pk for product in products], threads=8, orders_per_thread=max(1, scale // 20))
+    min_stock = min(Product.objects.filter(pk__in=[p.pk for p in products]).values_list('stock', flat=True))
+    return [{'case': 'contention', 'threads': 8, 'min_stock': min_stock, **result}]
+
+
+def seed_products(count, batch_size=5000, seed=0, words=None):
+    # inserta productos en lotes grandes, sin descripciones largas para que el seed de 1M filas sea rápido
+    # con words cada descripción son 12 palabras al azar de esa lista, para los escenarios de búsqueda
+    rnd = random.Random(seed)
+    for start in range(0, count, batch_size):
+        Product.objects.bulk_create(
+            Product(
+                name=f'Product {i}',
+                description=' '.join(rnd.choices(words, k=12)) if words else 'benchmark',
+                price=Decimal(rnd.randint(100, 50000)) / 100,
+                stock=rnd.randint(1, 100)
+            )
+            for i in range(start, min(start + batch_size, count))
+        )
+
+
+@scenario('product_pages')
+def product_pages(scale):
+    # latencia de una página de /products/ al inicio, al medio y al final del catálogo
+    # keyset (la paginación actual) contra OFFSET + COUNT(*) (lo que hacía LimitOffsetPagination)
+    from django.test import Client
+    from api.pagination import ProductPagination
+
+    seed_products(scale)
+    client = Client()
+    paginator = ProductPagination()
+    paginator.base_url = '/products/'
+    rows = []
+    for ordering in ('pk', 'price'):
+        # mismo orden que arma ProductPagination.get_ordering, con el pk como desempate
+        paginator.ordering = ('pk',) if ordering == 'pk' else (ordering, 'pk')
+        ordered = Product.objects.filter(stock__gt=0).order_by(*paginator.ordering)
+        for depth in (0, scale // 2, scale - 10):
+            url = f'/products/?ordering={ordering}'
+            if depth:
+                position = paginator.dump_position(ordered[depth - 1])
+                url = paginator.encode_cursor(Cursor(offset=0, reverse=False, position=position)) + f'&ordering={ordering}'
+            rows.append({'case': 'keyset', 'ordering': ordering, 'depth': depth, **measure(lambda: client.get(url))})
+
+            def offset_page():
+                ordered.count()
+                list(ordered[depth:depth + 5])
+            rows.append({'case': 'offset', 'ordering': ordering, 'depth': depth, **measure(offset_page)})
+    return rows
+
+
+@scenario('catalog_cache')
+def catalog_cache(scale):
+    # GET de los endpoints de productos sin cache, con el cache vacío en cada request y con el cache caliente
+    from django.core.cache import caches
+    from django.test import Client, override_settings
+
+    seed_products(scale)
+    client = Client()
+    product_id = Product.objects.values_list('pk', flat=True).first()
+    urls = {
+        'list': '/products/?ordering=price&price__gt=100',
+        'detail': f'/products/{product_id}/',
+        'summary': '/products/info/summary/',
+    }
+    rows = []
+    for name, url in urls.items():
+        with override_settings(CATALOG_CACHE={**settings.CATALOG_CACHE, 'ENABLED': False}):
+            rows.append({'case': 'uncached', 'url': name, **measure(lambda: client.get(url))})
+
+        def cold():
+            caches[settings.CATALOG_CACHE['RESPONSES']].clear()
+            client.get(url)
+        rows.append({'case': 'cold', 'url': name, **measure(cold)})
+        rows.append({'case': 'warm', 'url': name, **measure(lambda: client.get(url))})
+    return rows
+
+
+@scenario('product_info')
+def product_info(scale):
+    # /products/info/ con el catálogo completo en memoria (la versión anterior) y enviado por partes
+    # peak_kb es el pico de memoria de Python medido con tracemalloc
+    import tracemalloc
+    from django.db.models import Max
+    from django.test import Client
+    from rest_framework.renderers import JSONRenderer
+    from api.serializers import ProductInfoSerializer
+
+    seed_products(scale)
+    client = Client()
+
+    def in_memory():
+        products = Product.objects.all()
+        data = ProductInfoSerializer({
+            'products': products,
+            'count': len(products),
+            'max_price': products.aggregate(max_price=Max('price'))['max_price'],
+            'min_price': None,
+            'avg_price': None,
+        }).data
+        JSONRenderer().render(data)
+
+    def streamed():
+        for _ in client.get('/products/info/').streaming_content:
+            pass
+
+    rows = []
+    for label, run in (('in_memory', in_memory), ('streamed', streamed)):
+        tracemalloc.start()
+        result = measure(run, repeat=3)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        rows.append({'case': label, 'products': scale, 'peak_kb': peak // 1024, **result})
+    return rows
+
+
+@scenario('order_export')
+def order_export(scale):
+    # todas las ordenes serializadas juntas en memoria (lo que hacía el listado sin paginar) contra /orders/export/
+    import tracemalloc
+    from django.test import Client
+    from rest_framework.renderers import JSONRenderer
+    from api.serializers import OrderSerializer
+
+    user = seed_orders(scale)
+    client = Client()
+    client.force_login(user)
+
+    def in_memory():
+        JSONRenderer().render(OrderSerializer(Order.objects.prefetch_related('items__product'), many=True).data)
+
+    def export(fmt):
+        def run():
+            for _ in client.get('/orders/export/', {'format': fmt}).streaming_content:
+                pass
+        return run
+
+    rows = []
+    for label, run in (('in_memory', in_memory), ('ndjson', export('ndjson')), ('csv', export('csv'))):
+        tracemalloc.start()
+        result = measure(run, repeat=3)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        rows.append({'case': label, 'orders': scale, 'peak_kb': peak // 1024, **result})
+    return rows
+
+
+@scenario('product_import')
+def product_import(scale):
+    # carga de un catálogo de proveedor: un POST /products/ por producto contra /products/import/ con NDJSON
+    # la segunda importación del mismo archivo actualiza todos los productos (upsert por nombre)
+    import json
+    from django.test import Client
+
+    admin = User.objects.create_superuser(username='bench-admin', password='bench')
+    client = Client()
+    client.force_login(admin)
+    rnd = random.Random(0)
+    rows = [
+        {'name': f'Supplier {i}', 'description': 'supplier product', 'price': str(Decimal(rnd.randint(100, 50000)) / 100), 'stock': rnd.randint(0, 100)}
+        for i in range(scale)
+    ]
+    body = '\n'.join(json.dumps(row) for row in rows)
+
+    # los POST individuales se miden con una muestra y se extrapola a la cantidad de filas
+    sample = rows[:min(200, scale)]
+    start = time.perf_counter()
+    for row in sample:
+        client.post('/products/', {**row, 'name': f'Single {row["name"]}'}, content_type='application/json')
+    single_ms = (time.perf_counter() - start) * 1000
+    result = [{'case': 'single_post', 'rows': scale, 'ms': round(single_ms * scale / len(sample), 2)}]
+    for case in ('import_insert', 'import_update'):
+        start = time.perf_counter()
+        response = client.post('/products/import/', body, content_type='application/x-ndjson')
+        result.append({
+            'case': case, 'rows': scale, 'imported': response.json()['imported'],
+            'ms': round((time.perf_counter() - start) * 1000, 2)
+        })
+    return result
+
+
+# vocabulario de las descripciones del escenario de búsqueda
+# las palabras comunes se repiten para que aparezcan en la mayoría de los productos, las wordN son raras
+SEARCH_WORDS = ['steel', 'wireless', 'portable', 'compact', 'premium'] * 1000 + [f'word{i}' for i in range(5000)]
+
+
+@scenario('product_search')
+def product_search(scale):
+    # primera página de una búsqueda con LIKE (lo que hace SearchFilter) contra el índice FTS5
+    # probar con --scale 500000 para el catálogo de 500k productos
+    from django.db.models import Q
+    from django.test import Client, override_settings
+    from api.search import build_match_query, search_products
+
+    seed_products(scale, words=SEARCH_WORDS)
+    client = Client()
+    rows = []
+    # un término frecuente, uno raro, uno que no existe y un prefijo
+    for term in ('wireless', 'word4321', 'missing', 'port'):
+        like = Product.objects.filter(Q(name=term) | Q(description__icontains=term)).order_by('pk')
+        fts = search_products(Product.objects.all(), build_match_query([term])).order_by('search_rank', 'pk')
+        rows.append({'case': 'like', 'term': term, **measure(lambda: list(like[:6]))})
+        rows.append({'case': 'fts', 'term': term, **measure(lambda: list(fts[:6]))})
+        # sin el cache de respuestas, para medir la búsqueda y no un hit
+        with override_settings(CATALOG_CACHE={**settings.CATALOG_CACHE, 'ENABLED': False}):
+            rows.append({'case': 'endpoint', 'term': term, **measure(lambda: client.get('/products/', {'search': term}))})
+    return rows
+
+
+@scenario('order_serialization')
+def order_serialization(scale):
+    # todas las ordenes con OrderSerializer contra fast_orders (filas de .values()), con JSONRenderer y ORJSONRenderer
+    # probar con --scale 10000; identical indica si los bytes son los mismos que serializer + json
+    from rest_framework.renderers import JSONRenderer
+    from api.renderers import ORJSONRenderer
+    from api.serializers import OrderSerializer, fast_orders
+
+    seed_orders(scale)
+    ordering = ('-created_at', '-pk')
+
+    def serializer():
+        return OrderSerializer(Order.objects.prefetch_related('items__product').order_by(*ordering), many=True).data
+
+    def fast():
+        return fast_orders(Order.objects.order_by(*ordering).values('pk', *OrderSerializer.get_columns()))
+
+    expected = JSONRenderer().render(serializer())
+    rows = []
+    for label, build, renderer in (
+        ('serializer+json', serializer, JSONRenderer()),
+        ('serializer+orjson', serializer, ORJSONRenderer()),
+        ('fast+json', fast, JSONRenderer()),
+        ('fast+orjson', fast, ORJSONRenderer()),
+    ):
+        result = measure(lambda: renderer.render(build()))
+        rows.append({
+            'case': label, 'orders': scale, **result,
+            'orders_per_s': round(scale / result['ms'] * 1000),
+            'identical': renderer.render(build()) == expected,
+        })
+    return rows
+
+
+SERVER_CLIENTS = 50
+SERVER_REQUESTS_PER_CLIENT = 6
+SERVER_WSGI_WORKERS = 8
+SLOW_CLIENT_BYTES_PER_S = 20000
+
+
+def server_requests(token):
+    # las lecturas que repite cada cliente: una página de productos, un detalle y una página de sus ordenes
+    product_id = Product.objects.values_list('pk', flat=True).first()
+    auth = {'Authorization': f'Bearer {token}'}
+    requests = [('/products/', 'ordering=price', {}), (f'/products/{product_id}/', '', {}), ('/orders/', 'page_size=20', auth)]
+    return [requests[i % len(requests)] for i in range(SERVER_REQUESTS_PER_CLIENT)]
+
+
+def run_wsgi(application, requests, bytes_per_s):
+    # como gunicorn con workers sync: SERVER_WSGI_WORKERS requests a la vez, un cliente lento ocupa su worker
+    # hasta recibir la respuesta completa
+    from wsgiref.util import setup_testing_defaults
+
+    workers = threading.Semaphore(SERVER_WSGI_WORKERS)
+    latencies, statuses = [], []
+
+    def client():
+        for path, query, headers in requests:
+            start = time.perf_counter()
+            with workers:
+                environ = {'PATH_INFO': path, 'QUERY_STRING': query, 'HTTP_HOST': 'testserver'}
+                environ.update((f'HTTP_{name.upper()}', value) for name, value in headers.items())
+                setup_testing_defaults(environ)
+                status = []
+                response = application(environ, lambda status_line, headers, exc_info=None: status.append(status_line))
+                try:
+                    for chunk in response:
+                        if bytes_per_s:
+                            time.sleep(len(chunk) / bytes_per_s)
+                finally:
+                    response.close()
+            latencies.append(time.perf_counter() - start)
+            statuses.append(int(status[0].split()[0]))
+
+    threads = [threading.Thread(target=client) for _ in range(SERVER_CLIENTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses
+
+
+def run_asgi(application, requests, bytes_per_s):
+    # un único event loop para todos los clientes, un cliente lento solo demora su propia tarea
+    import asyncio
+
+    latencies, statuses = [], []
+
+    async def request(path, query, headers):
+        messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+        disconnected = asyncio.Event()
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            # ASGIHandler espera la desconexión mientras atiende la request
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+            elif bytes_per_s:
+                await asyncio.sleep(len(message.get('body', b'')) / bytes_per_s)
+
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+            'headers': [(b'host', b'testserver')] + [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 0),
+        }
+        await application(scope, receive, send)
+        disconnected.set()
+
+    async def client():
+        for path, query, headers in requests:
+            start = time.perf_counter()
+            await request(path, query, headers)
+            latencies.append(time.perf_counter() - start)
+
+    async def main():
+        await asyncio.gather(*(client() for _ in range(SERVER_CLIENTS)))
+
+    asyncio.run(main())
+    return latencies, statuses
+
+
+@scenario('server_concurrency')
+def server_concurrency(scale):
+    # lecturas concurrentes con backend.wsgi (views sync) y con backend.asgi (views async de api/async_views.py)
+    # SERVER_CLIENTS clientes hacen SERVER_REQUESTS_PER_CLIENT requests seguidas, rápidos o lentos
+    # (reciben SLOW_CLIENT_BYTES_PER_S bytes por segundo); el cache de respuestas del catálogo está apagado
+    # para que cada request haga sus queries; probar con --scale 500
+    from django.core.asgi import get_asgi_application
+    from django.core.wsgi import get_wsgi_application
+    from django.test import override_settings
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    seed_orders(scale)
+    requests = server_requests(str(AccessToken.for_user(User.objects.get(username='bench'))))
+    rows = []
+    with override_settings(CATALOG_CACHE={**settings.CATALOG_CACHE, 'ENABLED': False}):
+        for server, urlconf, run, get_application in (
+            ('wsgi', 'backend.urls', run_wsgi, get_wsgi_application),
+            ('asgi', 'backend.async_urls', run_asgi, get_asgi_application),
+        ):
+            with override_settings(ROOT_URLCONF=urlconf):
+                application = get_application()
+                for client, bytes_per_s in (('fast', 0), ('slow', SLOW_CLIENT_BYTES_PER_S)):
+                    start = time.perf_counter()
+                    latencies, statuses = run(application, requests, bytes_per_s)
+                    elapsed = time.perf_counter() - start
+                    latencies.sort()
+                    rows.append({
+                        'server': server, 'client': client, 'requests': len(latencies),
+                        'rps': round(len(latencies) / elapsed),
+                        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 1),
+                        'p95_ms': round(latencies[int(len(latencies) * 0.95)] * 1000, 1),
+                        'errors': sum(status != 200 for status in statuses),
+                    })
+    return rows
+
+
+@scenario('read_write_mix')
+def read_write_mix(scale):
+    # lecturas de productos y ordenes mientras otros hilos crean ordenes, comparar DJANGO_DATABASE_PROFILE=default
+    # (rollback journal, las lecturas esperan a las escrituras) con production (WAL y réplica de lectura)
+    # locked cuenta las requests que fallaron con "database is locked"
+    from django.db import OperationalError
+    from django.test import Client
+
+    user = seed_orders(scale)
+    product_ids = list(Product.objects.values_list('pk', flat=True)[:3])
+    Product.objects.filter(pk__in=product_ids).update(stock=10 ** 6)
+    payload = {'items': [{'product': pk, 'quantity': 1} for pk in product_ids]}
+    writers_done = threading.Event()
+    lock = threading.Lock()
+    results = {'reads': 0, 'writes': 0, 'locked': 0}
+    read_latencies = []
+
+    def count(key, latency=None):
+        with lock:
+            results[key] += 1
+            if latency is not None:
+                read_latencies.append(latency)
+
+    def request(client, method, *args, **kwargs):
+        try:
+            return getattr(client, method)(*args, **kwargs)
+        except OperationalError:
+            count('locked')
+            return None
+
+    def writer(client):
+        try:
+            for _ in range(max(1, scale // 20)):
+                if request(client, 'post', '/orders/', payload, content_type='application/json') is not None:
+                    count('writes')
+        finally:
+            connections.close_all()
+
+    def reader(client):
+        try:
+            while not writers_done.is_set():
+                for url in ('/products/?ordering=price', '/orders/?page_size=20'):
+                    start = time.perf_counter()
+                    if request(client, 'get', url) is not None:
+                        count('reads', time.perf_counter() - start)
+        finally:
+            connections.close_all()
+
+    clients = []
+    for _ in range(8):
+        client = Client()
+        client.force_login(user)
+        clients.append(client)
+    writers = [threading.Thread(target=writer, args=(client,)) for client in clients[:4]]
+    readers = [threading.Thread(target=reader, args=(client,)) for client in clients[4:]]
+    start = time.perf_counter()
+    for thread in writers + readers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    writers_done.set()
+    for thread in readers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    read_latencies.sort()
+    return [{
+        'profile': settings.DATABASE_PROFILE, 'writes_per_s': round(results['writes'] / elapsed, 1),
+        'reads_per_s': round(results['reads'] / elapsed, 1),
+        'read_p95_ms': round(read_latencies[int(len(read_latencies) * 0.95)] * 1000, 1) if read_latencies else None,
+        'locked': results['locked'],
+    }]
+
+
+@scenario('product_thumbnails')
+def product_thumbnails(scale):
+    # bytes de la imagen original contra los de cada miniatura y latencia de la primera request (la genera)
+    # contra las siguientes; herd: 16 hilos piden la misma miniatura que todavía no existe, renders debería ser 1
+    # el tamaño de la imagen de prueba es scale x 3/4 scale px, probar con --scale 2000
+    import shutil
+    import tempfile
+    from io import BytesIO
+    from unittest import mock
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from django.test import Client, override_settings
+    from PIL import Image
+    from api import thumbnails
+
+    width, height = scale, scale * 3 // 4
+    # degradado con ruido, se comprime como una foto y no como un color plano
+    image = Image.radial_gradient('L').resize((width, height)).convert('RGB')
+    image = Image.blend(image, Image.effect_noise((width, height), 40).convert('RGB'), 0.3)
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=90)
+    original = buffer.getvalue()
+
+    media_root = tempfile.mkdtemp()
+    rows = []
+    try:
+        with override_settings(MEDIA_ROOT=media_root, PRODUCT_THUMBNAILS={**settings.PRODUCT_THUMBNAILS, 'WORKERS': 0}):
+            product = Product.objects.create(
+                name='Photo', description='benchmark', price=Decimal('10.00'), stock=1,
+                image=SimpleUploadedFile('photo.jpg', original, content_type='image/jpeg'),
+            )
+            client = Client()
+            urls = client.get(f'/products/{product.pk}/').json()['thumbnails']
+            for size_name, formats in urls.items():
+                for format, url in formats.items():
+                    start = time.perf_counter()
+                    response = client.get(url)
+                    size = len(b''.join(response.streaming_content))
+                    cold_ms = (time.perf_counter() - start) * 1000
+                    warm = measure(lambda: b''.join(client.get(url).streaming_content))
+                    rows.append({
+                        'size': size_name, 'format': format, 'original_kb': round(len(original) / 1024, 1),
+                        'thumbnail_kb': round(size / 1024, 1), 'cold_ms': round(cold_ms, 2), 'warm_ms': warm['ms'],
+                    })
+
+            # un tamaño que todavía no se generó
+            herd_size = (200, 200)
+            with override_settings(PRODUCT_THUMBNAILS={
+                **settings.PRODUCT_THUMBNAILS, 'SIZES': {'herd': herd_size}, 'FORMATS': ['webp'], 'WORKERS': 0,
+            }), mock.patch('api.thumbnails.render', wraps=thumbnails.render) as render:
+                workers = [
+                    threading.Thread(
+                        target=thumbnails.ensure_thumbnails,
+                        args=(product.image.name, product.image_hash, [(herd_size, 'webp')]),
+                    )
+                    for _ in range(16)
+                ]
+                start = time.perf_counter()
+                for thread in workers:
+                    thread.start()
+                for thread in workers:
+                    thread.join()
+                rows.append({
+                    'size': 'herd', 'format': 'webp', 'threads': 16, 'renders': render.call_count,
+                    'ms': round((time.perf_counter() - start) * 1000, 2),
+                })
+    finally:
+        shutil.rmtree(media_root)
+    return rows
@@ -0,0 +1,250 @@
+import hashlib
+import pickle
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from api.conditional import cached_conditional_response
+from api.metrics import CACHE_REQUESTS
+
+CATALOG_VERSION_KEY = 'catalog:version'
+
+# igual que LocMemCache guardamos el tamaño de las entradas y su suma por nombre de cache, compartidos por todos los hilos
+_sizes = {}
+_total_bytes = {}
+
+# contadores de hits y misses del cache de respuestas de este proceso
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+class VersionFileCache(FileBasedCache):
+    # FileBasedCache lista todo el directorio en cada set para ver si pasó MAX_ENTRIES, y cada login guarda el usuario
+    # y cambia su versión; con MAX_ENTRIES=0 no se limpia nunca (hay una entrada por usuario más la del catálogo)
+    def _cull(self):
+        if self._max_entries:
+            super()._cull()
+
+
+class LRUCache(LocMemCache):
+    # igual que LocMemCache pero al llenarse descarta de a una las entradas usadas hace más tiempo
+    # en lugar de borrar un tercio del cache, y además permite limitar el tamaño total en bytes
+    # OPTIONS: MAX_ENTRIES (cantidad de entradas) y MAX_BYTES (suma del tamaño de los valores serializados)
+    # el tamaño de cada entrada y la suma solo se llevan con MAX_BYTES, cada set es O(1) en los dos casos
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        options = params.get('OPTIONS', {})
+        self._max_bytes = int(options.get('MAX_BYTES', 0))
+        self._name = name
+        self._sizes = _sizes.setdefault(name, {})
+        _total_bytes.setdefault(name, 0)
+
+    @property
+    def total_bytes(self):
+        return _total_bytes[self._name]
+
+    # se llama con self._lock tomado
+    def _set_size(self, key, size):
+        _total_bytes[self._name] += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+
+    def _set(self, key, value, timeout=None):
+        self._delete(key)
+        while self._cache and (
+            len(self._cache) >= self._max_entries
+            or (self._max_bytes and self.total_bytes + len(value) > self._max_bytes)
+        ):
+            # LocMemCache deja la entrada usada más recientemente al principio, la última es la menos usada
+            self._delete(next(reversed(self._cache)))
+        self._cache[key] = value
+        self._cache.move_to_end(key, last=False)
+        self._expire_info[key] = self.get_backend_timeout(timeout)
+        if self._max_bytes:
+            self._set_size(key, len(value))
+
+    def _delete(self, key):
+        if self._max_bytes:
+            _total_bytes[self._name] -= self._sizes.pop(key, 0)
+        return super()._delete(key)
+
+    # LocMemCache.incr reemplaza el valor sin pasar por _set, actualizamos el tamaño de la entrada
+    def incr(self, key, delta=1, version=None):
+        if not self._max_bytes:
+            return super().incr(key, delta, version)
+        key = self.make_and_validate_key(key, version=version)
+        with self._lock:
+            if self._has_expired(key):
+                self._delete(key)
+                raise ValueError(f"Key '{key}' not found")
+            new_value = pickle.loads(self._cache[key]) + delta
+            pickled = pickle.dumps(new_value, self.pickle_protocol)
+            self._cache[key] = pickled
+            self._cache.move_to_end(key, last=False)
+            self._set_size(key, len(pickled))
+        return new_value
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._expire_info.clear()
+            self._sizes.clear()
+            _total_bytes[self._name] = 0
+
+
+def get_response_cache():
+    return caches[settings.CATALOG_CACHE['RESPONSES']]
+
+
+def get_version_cache():
+    # la versión tiene que estar en un cache compartido por todos los procesos (check api.E001)
+    # para que una escritura en un worker invalide las respuestas guardadas por los demás
+    return caches[settings.CATALOG_CACHE['VERSION']]
+
+
+def get_catalog_version():
+    cache = get_version_cache()
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # si la versión se perdió (reinicio o expiración) arrancamos desde la hora actual
+        # así nunca volvemos a una versión vieja que todavía tenga respuestas guardadas
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+# igual que get_catalog_version con la API async del cache, para las views de api/async_views.py
+async def aget_catalog_version():
+    cache = get_version_cache()
+    version = await cache.aget(CATALOG_VERSION_KEY)
+    if version is None:
+        await cache.aadd(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+        version = await cache.aget(CATALOG_VERSION_KEY)
+    return version
+
+
+def _incr_catalog_version():
+    cache = get_version_cache()
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def bump_catalog_version():
+    # cambiamos la versión en el momento y otra vez al confirmar la transacción
+    # lo que otro proceso guarde mientras la transacción está abierta queda con la versión intermedia y no se vuelve a usar
+    _incr_catalog_version()
+    transaction.on_commit(_incr_catalog_version)
+
+
+def user_version_key(user_id):
+    return f'auth:user:{user_id}:version'
+
+
+def get_user_version(user_id):
+    # igual que la versión del catálogo: en un cache compartido, cambia con cada save o delete del usuario
+    cache = caches[settings.JWT_USER_CACHE['VERSION']]
+    key = user_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_user_version(user_id):
+    cache = caches[settings.JWT_USER_CACHE['VERSION']]
+    key = user_version_key(user_id)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def _incr_user_version(user_id):
+    cache = caches[settings.JWT_USER_CACHE['VERSION']]
+    key = user_version_key(user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+
+
+def bump_user_version(user_id):
+    # los usuarios guardados por CachedJWTAuthentication con la versión anterior dejan de usarse
+    # igual que el catálogo: en el momento y otra vez al confirmar, así un usuario leído antes del commit
+    # (por ejemplo todavía activo) y guardado con la versión intermedia tampoco se vuelve a usar
+    _incr_user_version(user_id)
+    transaction.on_commit(lambda: _incr_user_version(user_id))
+
+
+def cached_for_catalog_version(name, func):
+    # guarda el resultado de func en el cache de respuestas hasta que cambie la versión del catálogo
+    key = f'catalog:{name}:{get_catalog_version()}'
+    return get_response_cache().get_or_set(key, func, timeout=settings.CATALOG_CACHE['TIMEOUT'])
+
+
+# func es una corrutina, por ejemplo un aaggregate
+async def acached_for_catalog_version(name, func):
+    key = f'catalog:{name}:{await aget_catalog_version()}'
+    cache = get_response_cache()
+    value = await cache.aget(key)
+    if value is None:
+        value = await func()
+        await cache.aset(key, value, timeout=settings.CATALOG_CACHE['TIMEOUT'])
+    return value
+
+
+def record(hit):
+    with _stats_lock:
+        _stats['hits' if hit else 'misses'] += 1
+    # get_stats es solo de este proceso, la métrica se suma entre todos los workers
+    CACHE_REQUESTS.labels(settings.CATALOG_CACHE['RESPONSES'], 'hit' if hit else 'miss').inc()
+
+
+def get_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+class CatalogCacheMixin:
+    # guarda la respuesta ya renderizada de los GET de las views de productos
+    # la key se arma con la view, el host, el path, los parámetros ordenados, el Accept y la versión del catálogo,
+    # cualquier escritura de Product cambia la versión y las respuestas anteriores dejan de usarse
+    # en un hit no se ejecutan los filtros, las queries, el serializer ni el renderer
+    def get_cache_key(self, request, version):
+        params = sorted((key, value) for key in request.GET for value in request.GET.getlist(key))
+        raw = repr((
+            type(self).__name__, request.get_host(), request.path, params,
+            request.META.get('HTTP_ACCEPT', ''), version
+        ))
+        return f'catalog:{hashlib.sha1(raw.encode()).hexdigest()}'
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method != 'GET' or not settings.CATALOG_CACHE['ENABLED']:
+            return super().dispatch(request, *args, **kwargs)
+
+        cache = get_response_cache()
+        key = self.get_cache_key(request, get_catalog_version())
+        response = cache.get(key)
+        if response is not None:
+            record(hit=True)
+            response['X-Cache'] = 'HIT'
+            # la respuesta guardada ya tiene ETag y Last-Modified, si el cliente tiene la misma devolvemos 304
+            return cached_conditional_response(request, response)
+
+        record(hit=False)
+        response = super().dispatch(request, *args, **kwargs)
+        # solo guardamos respuestas JSON, la API navegable muestra datos del usuario logueado
+        if response.status_code == 200 and getattr(response, 'accepted_renderer', None) is not None \
+                and response.accepted_renderer.format == 'json':
+            response.render()
+            cache.set(key, response, timeout=settings.CATALOG_CACHE['TIMEOUT'])
+        response['X-Cache'] = 'MISS'
+        return response
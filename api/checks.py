@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+# las versiones invalidan en todos los workers lo guardado en el cache de cada proceso: el usuario de
+# CachedJWTAuthentication (una desactivación o un cambio de contraseña) y las respuestas y los ETags del catálogo
+# en un cache de un solo proceso los demás workers no ven el cambio hasta que vence el TIMEOUT de cada setting
+@checks.register(checks.Tags.caches, checks.Tags.security)
+def check_version_caches(app_configs, **kwargs):
+    errors = []
+    for setting in ('JWT_USER_CACHE', 'CATALOG_CACHE'):
+        config = getattr(settings, setting)
+        if not config['ENABLED']:
+            continue
+        alias = config['VERSION']
+        if not isinstance(caches[alias], (LocMemCache, DummyCache)):
+            continue
+        errors.append(checks.Error(
+            f"{setting}['VERSION'] uses the cache '{alias}', which is not shared between processes.",
+            hint='Use a cache shared by every worker (file based, database, redis or memcached) '
+                 f"or set {setting}['ENABLED'] to False.",
+            obj=setting,
+            id='api.E001',
+        ))
+    return errors
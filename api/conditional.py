@@ -0,0 +1,74 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date, parse_http_date_safe
+
+
+# la lanza initial() cuando el GET se puede responder sin ejecutar la view (304 o 412)
+class ConditionalResponse(Exception):
+    def __init__(self, response):
+        super().__init__(response.status_code)
+        self.response = response
+
+
+def timestamp(value):
+    # los headers HTTP tienen precisión de segundos
+    return int(value.timestamp()) if value is not None else None
+
+
+def cached_conditional_response(request, response):
+    # evalúa If-None-Match / If-Modified-Since contra los headers de una respuesta ya renderizada (por ej. del cache)
+    return get_conditional_response(
+        request,
+        etag=response.get('ETag'),
+        last_modified=parse_http_date_safe(response.get('Last-Modified')),
+        response=response,
+    )
+
+
+class ConditionalGetMixin:
+    # agrega ETag y Last-Modified a los GET y responde 304 cuando el cliente ya tiene la misma versión
+    # los valores salen de get_validators, que tiene que ser una consulta barata (un MAX, un COUNT o la versión del catálogo)
+    # la comparación se hace después de la autenticación y los permisos, pero antes de ejecutar la view,
+    # así un 304 no hace las queries del listado, ni serializa ni renderiza nada
+
+    # devuelve (key, last_modified) o None si la respuesta no se puede validar (por ej. un detalle que no existe)
+    # key es cualquier valor que cambie cuando cambia el contenido de la respuesta, last_modified un datetime o None
+    def get_validators(self, request):
+        raise NotImplementedError
+
+    def get_etag(self, request, key):
+        # un ETag fuerte tiene que ser distinto para cada representación: incluimos el path con los parámetros y el Accept
+        raw = repr((type(self).__name__, request.get_full_path(), request.META.get('HTTP_ACCEPT', ''), key))
+        return quote_etag(hashlib.sha1(raw.encode()).hexdigest())
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.etag = self.last_modified = None
+        if request.method not in ('GET', 'HEAD'):
+            return
+        self.check_conditional(request, self.get_validators(request))
+
+    # las views async (api/async_views.py) obtienen los validadores con el ORM async y llaman directamente a este método
+    def check_conditional(self, request, validators):
+        if validators is None:
+            return
+        key, last_modified = validators
+        self.etag = self.get_etag(request, key)
+        self.last_modified = timestamp(last_modified)
+        response = get_conditional_response(request, etag=self.etag, last_modified=self.last_modified)
+        if response is not None:
+            raise ConditionalResponse(response)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, ConditionalResponse):
+            return exc.response
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'etag', None) is not None and response.status_code in (200, 304):
+            response['ETag'] = self.etag
+            if self.last_modified is not None:
+                response['Last-Modified'] = http_date(self.last_modified)
+        return response
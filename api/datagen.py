@@ -0,0 +1,278 @@
+import random
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import timedelta
+from decimal import Decimal
+from itertools import groupby
+from operator import itemgetter
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import OperationalError, connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.lorem_ipsum import WORDS
+
+from api.models import Order, OrderItem, Product, User
+
+MASK64 = (1 << 64) - 1
+
+
+@dataclass
+class GenerationPlan:
+    # todo lo que necesita un proceso para generar cualquier lote, sin consultar la DB
+    seed: int
+    products: int
+    users: int
+    orders: int
+    min_items: int
+    max_items: int
+    # [(status, peso)], por ejemplo [('Pending', 70), ('Confirmed', 25), ('Cancelled', 5)]
+    status_mix: list
+    batch_size: int
+    days: int
+    # los ids se asignan desde el parent para que el resultado sea el mismo con cualquier cantidad de procesos
+    product_base: int = 0
+    user_base: int = 0
+    # usuarios a los que se asignan las ordenes además de los generados (por ej. el admin)
+    extra_user_ids: list = field(default_factory=list)
+    # fecha de la orden más nueva, las demás se reparten en los days anteriores
+    now: object = None
+    password: str = ''
+
+
+def mix(value):
+    # splitmix64: hash entero barato y determinista, lo usamos para derivar el precio de cada producto desde su índice
+    value = (value + 0x9E3779B97F4A7C15) & MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK64
+    return value ^ (value >> 31)
+
+
+def product_price(plan, index):
+    # el precio depende solo del seed y el índice, así el lote de ordenes calcula los totales sin leer los productos
+    return Decimal(100 + mix((plan.seed << 32) | index) % 49900) / 100
+
+
+def product_supply(plan, index):
+    # stock inicial de cada producto, antes de las ordenes; igual que el precio depende solo del seed y el índice,
+    # así los lotes de ordenes no eligen productos sin stock
+    # algunos productos sin stock, para que InStockFilterBackend filtre filas reales
+    value = mix((plan.seed << 32) | index | 1 << 31)
+    if value % 10 == 0:
+        return 0
+    # sumamos una vez y media lo que se espera que pidan las ordenes (cantidades de 1 a 5, en promedio 3),
+    # así reserve_stock casi no cancela ordenes y se mantiene la proporción de status pedida
+    demand = plan.orders * (plan.min_items + plan.max_items) / 2 * 3 / max(1, plan.products * 0.9)
+    return 1 + (value >> 8) % 500 + int(demand * 1.5)
+
+
+# índices de los productos con stock inicial, se calculan una vez por proceso y por plan
+_in_stock = {}
+
+
+def products_in_stock(plan):
+    key = (plan.seed, plan.products)
+    if key not in _in_stock:
+        _in_stock[key] = [index for index in range(plan.products) if product_supply(plan, index)]
+    return _in_stock[key]
+
+
+def chunk_rng(plan, kind, number):
+    # cada lote tiene su propio generador, el resultado no depende del orden en que los procesos terminan
+    # los ids iniciales forman parte de la semilla para que otra ejecución sobre la misma base no repita order_id
+    return random.Random(f'{plan.seed}:{plan.product_base}:{plan.user_base}:{kind}:{number}')
+
+
+def chunks(total, batch_size):
+    return [(number, start, min(start + batch_size, total)) for number, start in enumerate(range(0, total, batch_size))]
+
+
+@contextmanager
+def explicit_timestamps(model, *names):
+    # auto_now y auto_now_add pisan el valor en bulk_create, los desactivamos para repartir las fechas de las ordenes
+    fields = [model._meta.get_field(name) for name in names]
+    saved = [(f.auto_now, f.auto_now_add) for f in fields]
+    for f in fields:
+        f.auto_now = f.auto_now_add = False
+    try:
+        yield
+    finally:
+        for f, (auto_now, auto_now_add) in zip(fields, saved):
+            f.auto_now, f.auto_now_add = auto_now, auto_now_add
+
+
+def write(func):
+    # con SQLite solo un proceso escribe a la vez, si la base está bloqueada reintentamos el mismo lote
+    # ahí los workers solo adelantan la generación de los objetos, con PostgreSQL también escriben en paralelo
+    while True:
+        try:
+            with transaction.atomic():
+                return func()
+        except OperationalError as exc:
+            if 'locked' not in str(exc):
+                raise
+            time.sleep(0.05)
+
+
+def product_chunk(plan, number, start, end):
+    rnd = chunk_rng(plan, 'products', number)
+    products = []
+    for index in range(start, end):
+        pk = plan.product_base + index
+        products.append(Product(
+            pk=pk,
+            name=f'{" ".join(rnd.sample(WORDS, 2)).title()} {pk}',
+            description=' '.join(rnd.choices(WORDS, k=rnd.randint(8, 40))),
+            price=product_price(plan, index),
+            # reserve_stock descuenta después lo que retienen las ordenes
+            stock=product_supply(plan, index),
+        ))
+    write(lambda: Product.objects.bulk_create(products, batch_size=plan.batch_size))
+    return len(products)
+
+
+def user_chunk(plan, number, start, end):
+    users = [
+        User(pk=plan.user_base + index, username=f'user_{plan.user_base + index}', password=plan.password)
+        for index in range(start, end)
+    ]
+    write(lambda: User.objects.bulk_create(users, batch_size=plan.batch_size))
+    return len(users)
+
+
+def pick_user(plan, index):
+    # los primeros índices son los usuarios extra, el resto los generados
+    if index < len(plan.extra_user_ids):
+        return plan.extra_user_ids[index]
+    return plan.user_base + index - len(plan.extra_user_ids)
+
+
+def order_chunk(plan, number, start, end):
+    rnd = chunk_rng(plan, 'orders', number)
+    extra = len(plan.extra_user_ids)
+    statuses, weights = zip(*plan.status_mix)
+    span = timedelta(days=plan.days).total_seconds()
+    in_stock = products_in_stock(plan)
+    orders, items = [], []
+    for _ in range(start, end):
+        created_at = plan.now - timedelta(seconds=rnd.random() * span)
+        order = Order(
+            order_id=uuid.UUID(int=rnd.getrandbits(128), version=4),
+            user_id=pick_user(plan, rnd.randrange(extra + plan.users)),
+            status=rnd.choices(statuses, weights)[0],
+            created_at=created_at,
+            updated_at=created_at,
+        )
+        total = Decimal('0')
+        count = min(rnd.randint(plan.min_items, plan.max_items), len(in_stock))
+        for index in rnd.sample(in_stock, count):
+            quantity = rnd.randint(1, 5)
+            price = product_price(plan, index)
+            total += price * quantity
+            # asignamos los ids directamente, el descriptor de la ForeignKey es lo más lento de crear cada item
+            items.append(OrderItem(
+                order_id=order.order_id, product_id=plan.product_base + index, quantity=quantity, unit_price=price
+            ))
+        # los totales guardados se calculan acá, no hace falta recalculate_order_totals después
+        order.total_price = total
+        order.item_count = count
+        orders.append(order)
+
+    def save():
+        with explicit_timestamps(Order, 'created_at', 'updated_at'):
+            Order.objects.bulk_create(orders, batch_size=plan.batch_size)
+        OrderItem.objects.bulk_create(items, batch_size=plan.batch_size)
+    write(save)
+    return len(orders)
+
+
+def run_chunk(task):
+    func, plan, number, start, end = task
+    try:
+        return func(plan, number, start, end)
+    finally:
+        # cada proceso usa su propia conexión, la cerramos para no dejar transacciones abiertas
+        connections.close_all()
+
+
+def init_worker():
+    import django
+    django.setup()
+
+
+def run_phase(func, plan, total, workers):
+    tasks = [(func, plan, number, start, end) for number, start, end in chunks(total, plan.batch_size)]
+    if workers <= 1 or len(tasks) <= 1:
+        return sum(func(plan, number, start, end) for _, _, number, start, end in tasks)
+    # las conexiones abiertas no se pueden compartir con los procesos hijos
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        return sum(executor.map(run_chunk, tasks))
+
+
+def generate(plan, workers=1, stdout=None):
+    # productos, usuarios y ordenes, en ese orden porque las ordenes hacen referencia a los otros dos
+    plan.product_base = (Product.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+    plan.user_base = (User.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+    plan.now = plan.now or timezone.now()
+    # el hash de la contraseña se calcula una vez, hashear por usuario tarda más que insertarlos
+    plan.password = make_password(f'user-{plan.seed}')
+    results = {}
+    for name, func, total in (
+        ('products', product_chunk, plan.products),
+        ('users', user_chunk, plan.users),
+        ('orders', order_chunk, plan.orders if plan.products and (plan.users or plan.extra_user_ids) else 0),
+    ):
+        start = time.perf_counter()
+        results[name] = run_phase(func, plan, total, workers)
+        if stdout is not None:
+            stdout.write(f'{name}: {results[name]} in {time.perf_counter() - start:.1f}s')
+    reset_sequences(Product, User)
+    if results['orders']:
+        start = time.perf_counter()
+        cancelled = reserve_stock(plan)
+        if stdout is not None:
+            stdout.write(f'stock: {cancelled} orders cancelled for lack of stock in {time.perf_counter() - start:.1f}s')
+    return results
+
+
+# las ordenes generadas retienen stock igual que las creadas por la API, así cancelarlas o borrarlas devuelve
+# stock que efectivamente se descontó; recorremos las que no están canceladas de la más vieja a la más nueva
+# (el mismo resultado con cualquier cantidad de procesos) y las que ya no entran en el stock quedan canceladas
+# devuelve la cantidad de ordenes canceladas
+def reserve_stock(plan):
+    stock = dict(Product.objects.filter(pk__gte=plan.product_base).values_list('pk', 'stock'))
+    # las ordenes nuevas solo tienen productos nuevos, filtrar por producto alcanza para no tocar las anteriores
+    rows = OrderItem.objects.filter(product_id__gte=plan.product_base).exclude(
+        order__status=Order.StatusChoices.CANCELLED
+    ).order_by('order__created_at', 'order_id').values_list('order_id', 'product_id', 'quantity')
+    cancelled = []
+    for order_id, items in groupby(rows.iterator(chunk_size=plan.batch_size), key=itemgetter(0)):
+        quantities = Order.item_quantities(
+            OrderItem(product_id=product_id, quantity=quantity) for _, product_id, quantity in items
+        )
+        if all(stock[pk] >= quantity for pk, quantity in quantities.items()):
+            for pk, quantity in quantities.items():
+                stock[pk] -= quantity
+        else:
+            cancelled.append(order_id)
+
+    products = [Product(pk=pk, stock=value) for pk, value in stock.items()]
+    write(lambda: Product.objects.bulk_update(products, ['stock'], batch_size=plan.batch_size))
+    for start in range(0, len(cancelled), plan.batch_size):
+        batch = cancelled[start:start + plan.batch_size]
+        write(lambda: Order.objects.filter(pk__in=batch).update(status=Order.StatusChoices.CANCELLED))
+    return len(cancelled)
+
+
+def reset_sequences(*models):
+    # insertamos los ids a mano, en las bases con secuencias (PostgreSQL) hay que moverlas después del último id
+    connection = connections['default']
+    statements = connection.ops.sequence_reset_sql(no_style(), models)
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
@@ -0,0 +1,198 @@
+import json
+import math
+import platform
+import time
+import tracemalloc
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connection, connections
+from django.test import Client, override_settings
+
+from api.datagen import GenerationPlan, generate
+from api.models import Order, Product, User
+
+# métricas que se comparan contra el baseline, las de latencia y memoria admiten el margen configurado
+# las queries por request son exactas: una query de más es un N+1 nuevo, no ruido de la máquina
+TIMED_METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'peak_kb')
+EXACT_METRICS = ('queries',)
+
+
+def percentile(values, pct):
+    # percentil por rango más cercano sobre los valores ordenados
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class EndpointContext:
+    # datos sembrados que usan los casos: usuarios, un producto, una orden del usuario y productos para las ordenes
+    def __init__(self, scale, seed=0):
+        self.admin = User.objects.create_superuser(username=f'bench-admin-{scale}', password='bench')
+        generate(GenerationPlan(
+            seed=seed, products=scale, users=max(10, scale // 100), orders=scale, min_items=1, max_items=5,
+            status_mix=[('Pending', 60), ('Confirmed', 35), ('Cancelled', 5)], batch_size=5000, days=365,
+            extra_user_ids=[self.admin.pk],
+        ))
+        # stock suficiente para que los POST y PATCH de ordenes nunca fallen por falta de stock
+        Product.objects.update(stock=1_000_000)
+        self.user = User.objects.get(pk=Order.objects.exclude(user=self.admin).values_list('user', flat=True).first())
+        self.order = Order.objects.filter(user=self.user).first()
+        self.product = Product.objects.order_by('pk').first()
+        self.item_products = list(Product.objects.order_by('pk').values_list('pk', flat=True)[:3])
+        self.word = self.product.description.split()[0]
+        self.clients = {}
+        for name, user in (('anonymous', None), ('user', self.user), ('admin', self.admin)):
+            client = Client()
+            if user is not None:
+                client.force_login(user)
+            self.clients[name] = client
+        self.counter = 0
+        # las filas del import tienen siempre los mismos nombres, después de la primera request son updates
+        self.import_body = ''.join(
+            json.dumps({'name': f'bench import {i}', 'description': 'import', 'price': '9.99', 'stock': 10}) + '\n'
+            for i in range(100)
+        )
+
+    def next_quantity(self):
+        # el PATCH alterna la cantidad para que siempre cambie algún item
+        self.counter += 1
+        return 1 + self.counter % 3
+
+
+# cada caso: (nombre, cliente, método, función que arma la url, el body y opcionalmente su content type)
+CASES = [
+    ('product-list', 'anonymous', 'get', lambda ctx: ('/products/', None)),
+    ('product-list-filter', 'anonymous', 'get', lambda ctx: ('/products/?price__gt=50&price__lt=300', None)),
+    ('product-list-search', 'anonymous', 'get', lambda ctx: (f'/products/?search={ctx.word}', None)),
+    ('product-list-ordering', 'anonymous', 'get', lambda ctx: ('/products/?ordering=-price', None)),
+    ('product-detail', 'anonymous', 'get', lambda ctx: (f'/products/{ctx.product.pk}/', None)),
+    ('product-info', 'anonymous', 'get', lambda ctx: ('/products/info/', None)),
+    ('product-summary', 'anonymous', 'get', lambda ctx: ('/products/info/summary/', None)),
+    ('order-list', 'user', 'get', lambda ctx: ('/orders/', None)),
+    ('order-list-admin', 'admin', 'get', lambda ctx: ('/orders/?status=Confirmed', None)),
+    ('order-detail', 'user', 'get', lambda ctx: (f'/orders/{ctx.order.pk}/', None)),
+    ('order-export', 'admin', 'get', lambda ctx: ('/orders/export/?status=Confirmed', None)),
+    ('order-create', 'user', 'post', lambda ctx: ('/orders/', {
+        'items': [{'product': pk, 'quantity': 1} for pk in ctx.item_products]
+    })),
+    ('product-import', 'admin', 'post', lambda ctx: ('/products/import/', ctx.import_body, 'application/x-ndjson')),
+    ('order-update', 'user', 'patch', lambda ctx: (f'/orders/{ctx.order.pk}/', {
+        'items': [{'product': pk, 'quantity': ctx.next_quantity()} for pk in ctx.item_products]
+    })),
+]
+
+
+def request(ctx, client_name, method, build):
+    url, body, *content_type = build(ctx)
+    client = ctx.clients[client_name]
+    if body is None:
+        response = getattr(client, method)(url)
+    else:
+        response = getattr(client, method)(url, body, content_type=content_type[0] if content_type else 'application/json')
+    # las respuestas por partes se consumen completas, si no el tiempo no incluye generar el body
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    return response
+
+
+class QueryCounter:
+    # CaptureQueriesContext no sirve con el Client: request_started vacía connection.queries en cada request
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def run_case(ctx, case, repeat):
+    name, client_name, method, build = case
+    # una request de calentamiento: imports perezosos, sesión y caches de la primera vez
+    request(ctx, client_name, method, build)
+    timings = []
+    statuses = set()
+    for _ in range(repeat):
+        counter = QueryCounter()
+        # en todas las conexiones, las lecturas de productos y ordenes van a la réplica (api.routers)
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(counter))
+            start = time.perf_counter()
+            response = request(ctx, client_name, method, build)
+            timings.append((time.perf_counter() - start) * 1000)
+        statuses.add(response.status_code)
+    # la memoria se mide en una request aparte, tracemalloc hace más lentas las que se cronometran
+    tracemalloc.start()
+    request(ctx, client_name, method, build)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'queries': counter.count,
+        'peak_kb': peak // 1024,
+        'statuses': sorted(statuses),
+    }
+
+
+def run_suite(scales, repeat=50, cases=None, seed=0, stdout=None):
+    # siembra cada escala sobre los datos de la anterior y ejecuta todos los casos
+    # sin el cache de respuestas de productos, medimos las queries y la serialización de cada endpoint
+    names = set(cases or [case[0] for case in CASES])
+    results = {
+        'meta': {'python': platform.python_version(), 'database': connection.vendor, 'repeat': repeat},
+        'scales': {},
+    }
+    with override_settings(CATALOG_CACHE={**settings.CATALOG_CACHE, 'ENABLED': False}):
+        for scale in scales:
+            ctx = EndpointContext(scale, seed=seed)
+            rows = {}
+            for case in CASES:
+                if case[0] not in names:
+                    continue
+                rows[case[0]] = run_case(ctx, case, repeat)
+                if stdout is not None:
+                    stdout.write(f'  {scale:>8}  {case[0]:<22} ' + '  '.join(
+                        f'{key}={value}' for key, value in rows[case[0]].items()
+                    ))
+            results['scales'][str(scale)] = rows
+    return results
+
+
+def compare(results, baseline, margin):
+    # devuelve las métricas que superan el baseline: latencia y memoria por más del margen, queries por cualquier valor
+    regressions = []
+    for scale, rows in results['scales'].items():
+        for name, metrics in rows.items():
+            expected = baseline.get('scales', {}).get(scale, {}).get(name)
+            if expected is None:
+                continue
+            for key in TIMED_METRICS + EXACT_METRICS:
+                if key not in expected:
+                    continue
+                limit = expected[key] * (1 + margin) if key in TIMED_METRICS else expected[key]
+                if metrics[key] > limit:
+                    regressions.append({
+                        'scale': scale, 'case': name, 'metric': key,
+                        'baseline': expected[key], 'value': metrics[key],
+                    })
+            if any(code >= 400 for code in metrics['statuses']):
+                regressions.append({
+                    'scale': scale, 'case': name, 'metric': 'statuses',
+                    'baseline': expected.get('statuses'), 'value': metrics['statuses'],
+                })
+    return regressions
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def dump(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
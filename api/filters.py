@@ -1,5 +1,10 @@
+import datetime
+
 import django_filters
+from django.conf import settings
+from django.utils import timezone
 from api.models import Product, Order
+from api.search import build_match_query, fts_available, search_products
 from rest_framework import filters
 
 # creamos un filtro para devolver solo productos en stock
@@ -9,6 +14,27 @@ class InStockFilterBackend(filters.BaseFilterBackend):
         # indicamos que, del queryset filtre, para los elementos stock, solo los mayores que 0
         return queryset.filter(stock__gt=0)
 
+# búsqueda con el índice FTS5 de productos en lugar de LIKE '%término%' sobre name y description
+# usa el mismo parámetro search que SearchFilter, cada término busca por prefijo y todos tienen que aparecer
+# anota search_rank para ordenar por relevancia, con otros motores de base de datos delega en SearchFilter
+class FullTextSearchFilter(filters.SearchFilter):
+    def filter_queryset(self, request, queryset, view):
+        if not fts_available(queryset):
+            return super().filter_queryset(request, queryset, view)
+        match = build_match_query(self.get_search_terms(request))
+        if not match:
+            return queryset
+        return search_products(queryset, match)
+
+
+# si hay búsqueda y no se pidió otro orden, ordenamos por relevancia (la paginación desempata por pk)
+class SearchRankOrderingFilter(filters.OrderingFilter):
+    def get_ordering(self, request, queryset, view):
+        if self.ordering_param not in request.query_params and 'search_rank' in queryset.query.annotations:
+            return ['search_rank']
+        return super().get_ordering(request, queryset, view)
+
+
 class ProductFilter(django_filters.FilterSet):
     class Meta:
         model = Product
@@ -20,12 +46,29 @@ class ProductFilter(django_filters.FilterSet):
         }
 
 
+# filtra un campo DateTime por día con un rango semiabierto [día 00:00, día siguiente 00:00)
+# created_at__date aplica una función a la columna en cada fila y no puede usar el índice de created_at
+class DayFilter(django_filters.DateFilter):
+    @staticmethod
+    def start_of_day(value):
+        start = datetime.datetime.combine(value, datetime.time.min)
+        # el día se interpreta en la zona horaria actual, igual que __date
+        return timezone.make_aware(start) if settings.USE_TZ else start
+
+    def filter(self, qs, value):
+        if value in django_filters.constants.EMPTY_VALUES:
+            return qs
+        start = self.start_of_day(value)
+        end = self.start_of_day(value + datetime.timedelta(days=1))
+        return self.get_method(qs)(**{f'{self.field_name}__gte': start, f'{self.field_name}__lt': end})
+
+
 class OrderFilter(django_filters.FilterSet):
     # sobrescribimos  el atributo created_at
-    # DateFilter establece un filtro para el contenido de created_at
-    # field_name='created_at__date' extrae del atributo created_at, que es DateTime solo la fecha, Date
+    # DayFilter establece un filtro para el contenido de created_at
+    # compara solo la fecha de created_at, que es DateTime, con la fecha Date que se envía
     # El formato original es "2024-11-28T21:11:15.606905Z", mediante el filtro queda solo 2024-11-28
-    created_at = django_filters.DateFilter(field_name='created_at__date')
+    created_at = DayFilter(field_name='created_at')
     class Meta:
         model = Order
         fields = {
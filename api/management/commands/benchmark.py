@@ -0,0 +1,33 @@
+import logging
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import modify_settings
+
+from api.benchmarks import SCENARIOS, temporary_database
+
+
+class Command(BaseCommand):
+    help = 'Runs performance scenarios against a temporary database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help='Scenarios to run (all by default)')
+        parser.add_argument('--scale', type=int, default=2000, help='Number of orders/products to seed')
+
+    # silk guarda cada request en la DB, lo quitamos para que no se sume a las mediciones
+    @modify_settings(MIDDLEWARE={'remove': 'silk.middleware.SilkyMiddleware'})
+    def handle(self, *args, **options):
+        names = options['scenarios'] or list(SCENARIOS)
+        unknown = set(names) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+
+        # los escenarios generan respuestas 400 a propósito, no las mostramos como warnings
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        with temporary_database():
+            for name in names:
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                for row in SCENARIOS[name](scale=options['scale']):
+                    self.stdout.write('  ' + '  '.join(f'{key}={value}' for key, value in row.items()))
+                # vaciamos las tablas para que cada escenario empiece desde cero
+                call_command('flush', verbosity=0, interactive=False)
@@ -0,0 +1,58 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import modify_settings
+
+from api.benchmarks import temporary_database
+from api.endpoint_benchmarks import CASES, compare, dump, load, run_suite
+
+
+class Command(BaseCommand):
+    help = 'Measures latency percentiles, queries and memory of the API endpoints and compares them with a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('cases', nargs='*', help='Cases to run (all by default)')
+        parser.add_argument('--scales', default='1000,10000', help='Comma separated number of products/orders to seed')
+        parser.add_argument('--repeat', type=int, default=50, help='Timed requests per case')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--baseline', help='JSON results to compare against, exits with an error on regressions')
+        parser.add_argument('--margin', type=float, default=0.2,
+                            help='Allowed latency/memory increase over the baseline (0.2 = 20%%)')
+        parser.add_argument('--update-baseline', action='store_true', help='Overwrite --baseline with these results')
+
+    # silk guarda cada request en la DB, lo quitamos para que no se sume a las mediciones
+    @modify_settings(MIDDLEWARE={'remove': 'silk.middleware.SilkyMiddleware'})
+    def handle(self, *args, **options):
+        names = options['cases'] or [case[0] for case in CASES]
+        unknown = set(names) - {case[0] for case in CASES}
+        if unknown:
+            raise CommandError(f'Unknown cases: {", ".join(sorted(unknown))}')
+        try:
+            scales = [int(scale) for scale in options['scales'].split(',') if scale]
+        except ValueError:
+            raise CommandError('--scales must be a comma separated list of integers')
+        if options['update_baseline'] and not options['baseline']:
+            raise CommandError('--update-baseline requires --baseline')
+
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        with temporary_database():
+            results = run_suite(scales, repeat=options['repeat'], cases=names, seed=options['seed'], stdout=self.stdout)
+
+        if options['output']:
+            dump(results, options['output'])
+        if not options['baseline']:
+            return
+        if options['update_baseline']:
+            dump(results, options['baseline'])
+            self.stdout.write(self.style.SUCCESS(f'Baseline written to {options["baseline"]}'))
+            return
+
+        regressions = compare(results, load(options['baseline']), options['margin'])
+        for row in regressions:
+            self.stdout.write(self.style.ERROR(
+                f'  {row["scale"]:>8}  {row["case"]:<22} {row["metric"]}: {row["baseline"]} -> {row["value"]}'
+            ))
+        if regressions:
+            raise CommandError(f'{len(regressions)} regressions over the baseline')
+        self.stdout.write(self.style.SUCCESS('No regressions over the baseline'))
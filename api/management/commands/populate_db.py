@@ -1,39 +1,69 @@
-import random
-from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+
+from api.datagen import GenerationPlan, generate
+from api.models import Order, User
 
-from django.core.management.base import BaseCommand
-from django.utils import lorem_ipsum
-from api.models import User, Product, Order, OrderItem
 
 class Command(BaseCommand):
-    help = 'Creates application data'
+    help = 'Generates deterministic synthetic products, users and orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100, help='Number of products to create')
+        parser.add_argument('--users', type=int, default=10, help='Number of users to create (besides admin)')
+        parser.add_argument('--orders', type=int, default=200, help='Number of orders to create')
+        parser.add_argument('--items-per-order', default='1-5', help='Items per order, N or MIN-MAX')
+        parser.add_argument(
+            '--status-mix', default='Pending=60,Confirmed=35,Cancelled=5',
+            help='Relative weight of each order status, e.g. Pending=60,Confirmed=35,Cancelled=5'
+        )
+        parser.add_argument('--days', type=int, default=365, help='Spread order dates over the last N days')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed generates the same data')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk insert and transaction')
+        parser.add_argument('--workers', type=int, default=1, help='Parallel worker processes')
+
+    def parse_items(self, value):
+        try:
+            low, _, high = value.partition('-')
+            low, high = int(low), int(high or low)
+        except ValueError:
+            raise CommandError(f'Invalid --items-per-order: {value}')
+        if low < 0 or high < low:
+            raise CommandError(f'Invalid --items-per-order: {value}')
+        return low, high
+
+    def parse_status_mix(self, value):
+        valid = set(Order.StatusChoices.values)
+        mix = []
+        for part in value.split(','):
+            status, _, weight = part.partition('=')
+            status = status.strip()
+            if status not in valid:
+                raise CommandError(f'Unknown status {status!r}, expected one of {", ".join(sorted(valid))}')
+            try:
+                mix.append((status, float(weight)))
+            except ValueError:
+                raise CommandError(f'Invalid weight for {status}: {weight!r}')
+        if not any(weight > 0 for _, weight in mix):
+            raise CommandError('--status-mix needs at least one positive weight')
+        return mix
 
-    def handle(self, *args, **kwargs):
-        # get or create superuser
+    def handle(self, *args, **options):
+        # get or create superuser, las ordenes generadas también se reparten entre el admin y los usuarios nuevos
         user = User.objects.filter(username='admin').first()
         if not user:
             user = User.objects.create_superuser(username='admin', password='test')
 
-        # create products - name, desc, price, stock, image
-        products = [
-            Product(name="A Scanner Darkly", description=lorem_ipsum.paragraph(), price=Decimal('12.99'), stock=4),
-            Product(name="Coffee Machine", description=lorem_ipsum.paragraph(), price=Decimal('70.99'), stock=6),
-            Product(name="Velvet Underground & Nico", description=lorem_ipsum.paragraph(), price=Decimal('15.99'), stock=11),
-            Product(name="Enter the Wu-Tang (36 Chambers)", description=lorem_ipsum.paragraph(), price=Decimal('17.99'), stock=2),
-            Product(name="Digital Camera", description=lorem_ipsum.paragraph(), price=Decimal('350.99'), stock=4),
-            Product(name="Watch", description=lorem_ipsum.paragraph(), price=Decimal('500.05'), stock=0),
-        ]
-
-        # create products & re-fetch from DB
-        Product.objects.bulk_create(products)
-        products = Product.objects.all()
-
-
-        # create some dummy orders tied to the superuser
-        for _ in range(3):
-            # create an Order with 2 order items
-            order = Order.objects.create(user=user)
-            for product in random.sample(list(products), 2):
-                OrderItem.objects.create(
-                    order=order, product=product, quantity=random.randint(1,3)
-                )
\ No newline at end of file
+        min_items, max_items = self.parse_items(options['items_per_order'])
+        plan = GenerationPlan(
+            seed=options['seed'],
+            products=options['products'],
+            users=options['users'],
+            orders=options['orders'],
+            min_items=min_items,
+            max_items=max_items,
+            status_mix=self.parse_status_mix(options['status_mix']),
+            batch_size=options['batch_size'],
+            days=options['days'],
+            extra_user_ids=[user.pk],
+        )
+        generate(plan, workers=options['workers'], stdout=self.stdout)
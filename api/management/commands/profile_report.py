@@ -0,0 +1,44 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Summarizes the per-view timings written by SamplingProfilerMiddleware'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='Profile file (PROFILING["PATH"] by default)')
+        parser.add_argument('--sort', choices=['total_ms', 'avg_ms', 'max_ms', 'sql_count', 'sql_ms'], default='total_ms')
+        parser.add_argument('--limit', type=int, default=20)
+
+    def handle(self, *args, **options):
+        path = options['path'] or settings.PROFILING['PATH']
+        views = {}
+        try:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    window = json.loads(line)
+                    row = views.setdefault(window['view'], {
+                        'count': 0, 'sampled': 0, 'slow': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'sql_count': 0, 'sql_ms': 0.0,
+                    })
+                    for key in ('count', 'sampled', 'slow', 'total_ms', 'sql_count', 'sql_ms'):
+                        row[key] += window[key]
+                    row['max_ms'] = max(row['max_ms'], window['max_ms'])
+        except FileNotFoundError:
+            raise CommandError(f'{path} does not exist')
+
+        for row in views.values():
+            row['avg_ms'] = row['total_ms'] / row['count']
+            # las queries solo se miden en las requests de la muestra
+            row['sql_per_request'] = row['sql_count'] / row['sampled'] if row['sampled'] else None
+        ranked = sorted(views.items(), key=lambda item: item[1][options['sort']], reverse=True)
+        self.stdout.write(f'{"view":<40} {"count":>7} {"slow":>5} {"avg_ms":>9} {"max_ms":>9} {"sql/req":>8} {"sql_ms":>9}')
+        for view, row in ranked[:options['limit']]:
+            sql = f'{row["sql_per_request"]:.1f}' if row['sql_per_request'] is not None else '-'
+            self.stdout.write(
+                f'{view:<40} {row["count"]:>7} {row["slow"]:>5} {row["avg_ms"]:>9.1f} {row["max_ms"]:>9.1f} '
+                f'{sql:>8} {row["sql_ms"]:>9.1f}'
+            )
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.search import rebuild_product_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the FTS5 full-text index used by the product search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--optimize', action='store_true', help='Merge the index segments after rebuilding')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('The product search index is only available on SQLite')
+        rebuild_product_index(optimize=options['optimize'])
+        self.stdout.write('Rebuilt the product search index')
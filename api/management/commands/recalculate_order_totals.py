@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Recomputes and verifies the stored order totals in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Orders per batch')
+        parser.add_argument('--verify', action='store_true', help='Only report drifted orders, do not fix them')
+
+    def handle(self, *args, **options):
+        checked, drifted = Order.objects.recalculate_totals(
+            batch_size=options['batch_size'],
+            dry_run=options['verify']
+        )
+        action = 'found' if options['verify'] else 'fixed'
+        self.stdout.write(f'Checked {checked} orders, {action} {drifted} with drifted totals')
+        # devolvemos un código de error al verificar si hay diferencias, útil para jobs programados
+        if options['verify'] and drifted:
+            raise SystemExit(1)
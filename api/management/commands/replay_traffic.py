@@ -0,0 +1,49 @@
+import json
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.traffic import load_records, replay, summarize
+
+
+class Command(BaseCommand):
+    help = 'Replays requests captured by TrafficCaptureMiddleware against backend.wsgi.application'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='JSONL file written by the capture middleware')
+        parser.add_argument('--concurrency', type=int, default=1, help='Threads or processes sending requests')
+        parser.add_argument('--mode', choices=['threads', 'processes'], default='threads')
+        parser.add_argument('--limit', type=int, help='Replay only the first N requests')
+        parser.add_argument('--repeat', type=int, default=1, help='Replay the whole file N times')
+        parser.add_argument('--include-writes', action='store_true',
+                            help='Also replay POST/PUT/PATCH/DELETE requests (they modify the database)')
+        parser.add_argument('--output', help='Write the summary as JSON to this file')
+
+    def handle(self, *args, **options):
+        try:
+            records = load_records(options['path'], limit=options['limit'])
+        except FileNotFoundError:
+            raise CommandError(f'{options["path"]} does not exist')
+        if not options['include_writes']:
+            records = [record for record in records if record['method'] in ('GET', 'HEAD', 'OPTIONS')]
+        records = records * options['repeat']
+        if not records:
+            raise CommandError('No requests to replay')
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be at least 1')
+
+        # los 4xx y 5xx se cuentan en el resumen, no hace falta un warning por cada uno
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        results, elapsed = replay(records, concurrency=options['concurrency'], mode=options['mode'])
+        summary = summarize(results, elapsed)
+
+        self.stdout.write(
+            f'{summary["requests"]} requests in {summary["seconds"]}s, {summary["throughput"]} req/s '
+            f'({options["concurrency"]} {options["mode"]})'
+        )
+        for name, row in summary['routes'].items():
+            self.stdout.write(f'  {name:<40} ' + '  '.join(f'{key}={value}' for key, value in row.items()))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(summary, f, indent=2)
+                f.write('\n')
@@ -0,0 +1,159 @@
+import ipaddress
+import os
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+
+from api.querybudget import async_execute_wrapper
+
+# con varios workers (gunicorn, uwsgi) cada proceso escribe sus valores en archivos mmap dentro de
+# PROMETHEUS_MULTIPROC_DIR y /metrics suma los de todos; la variable tiene que estar definida antes de
+# importar este módulo y el directorio vaciarse al iniciar el servidor
+# sin la variable los valores quedan en la memoria del proceso, alcanza con un solo worker
+
+# las métricas no usan un lock global: prometheus_client tiene un lock por valor (o escribe en el mmap del proceso)
+REQUEST_SECONDS = Histogram(
+    'api_request_duration_seconds', 'Tiempo de respuesta por view',
+    ['view', 'method', 'status'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+DB_QUERIES = Histogram(
+    'api_request_db_queries', 'Queries a la base de datos por request',
+    ['view'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100),
+)
+DB_SECONDS = Histogram(
+    'api_request_db_duration_seconds', 'Tiempo en la base de datos por request',
+    ['view'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+RESPONSE_BYTES = Histogram(
+    'api_response_size_bytes', 'Tamaño del body de la respuesta (sin las respuestas por partes)',
+    ['view'],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+)
+CACHE_REQUESTS = Counter(
+    'api_cache_requests', 'Consultas al cache de respuestas, hit ratio = hit / (hit + miss)',
+    ['cache', 'result'],
+)
+ORDERS_CREATED = Counter('api_orders_created', 'Ordenes creadas')
+ORDER_CREATE_FAILURES = Counter('api_order_create_failures', 'Creaciones de ordenes rechazadas', ['reason'])
+
+
+def view_label(request):
+    # nombre de la clase de la view y, en los viewsets, la acción: OrderViewSet.list, ProductListCreateAPIView
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    func = match.func
+    cls = getattr(func, 'cls', None) or getattr(func, 'view_class', None)
+    if cls is None:
+        return f'{func.__module__}.{func.__name__}'
+    actions = getattr(func, 'actions', None)
+    if actions:
+        return f'{cls.__name__}.{actions.get(request.method.lower(), request.method.lower())}'
+    return cls.__name__
+
+
+class QueryTimer:
+    # execute_wrapper que cuenta las queries de la request y suma su duración
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+class MetricsMiddleware:
+    # registra las métricas de cada request, se desactiva con METRICS['ENABLED'] = False
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.exclude = tuple(settings.METRICS['EXCLUDE_PATHS'])
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if request.path.startswith(self.exclude):
+            return self.get_response(request)
+        timer = QueryTimer()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        self.observe(request, response, timer, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        if request.path.startswith(self.exclude):
+            return await self.get_response(request)
+        start = time.perf_counter()
+        async with async_execute_wrapper(QueryTimer()) as timer:
+            response = await self.get_response(request)
+        self.observe(request, response, timer, time.perf_counter() - start)
+        return response
+
+    @staticmethod
+    def observe(request, response, timer, elapsed):
+        view = view_label(request)
+        REQUEST_SECONDS.labels(view, request.method, str(response.status_code)).observe(elapsed)
+        DB_QUERIES.labels(view).observe(timer.count)
+        DB_SECONDS.labels(view).observe(timer.seconds)
+        # de las respuestas por partes no se sabe el tamaño sin consumirlas
+        if not response.streaming:
+            RESPONSE_BYTES.labels(view).observe(len(response.content))
+
+
+def get_registry():
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+# las métricas muestran la latencia, las queries y los pedidos de cada view, no son públicas
+# se sirven a las IPs de METRICS['ALLOWED_IPS'], con el header Authorization: Bearer METRICS['TOKEN'] o a un usuario staff
+def metrics_allowed(request):
+    config = settings.METRICS
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        address = None
+    if address is not None and any(
+        address in ipaddress.ip_network(network, strict=False) for network in config['ALLOWED_IPS']
+    ):
+        return True
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if config['TOKEN'] and constant_time_compare(authorization, f'Bearer {config["TOKEN"]}'):
+        return True
+    user = getattr(request, 'user', None)
+    return bool(user and user.is_staff)
+
+
+def metrics_view(request):
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(generate_latest(get_registry()), content_type=CONTENT_TYPE_LATEST)
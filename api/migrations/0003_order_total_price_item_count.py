@@ -0,0 +1,42 @@
+# Generated by Django 5.1.1 on 2026-10-17 02:27
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+
+
+def backfill_totals(apps, schema_editor):
+    Order = apps.get_model('api', 'Order')
+    orders = Order.objects.annotate(
+        computed_total_price=Sum(
+            F('items__quantity') * F('items__product__price'),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2)
+        ),
+        computed_item_count=Count('items')
+    )
+    for order in orders.iterator(chunk_size=1000):
+        order.total_price = order.computed_total_price or Decimal('0')
+        order.item_count = order.computed_item_count
+        order.save(update_fields=['total_price', 'item_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_alter_orderitem_order'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
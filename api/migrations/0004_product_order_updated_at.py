@@ -0,0 +1,34 @@
+# Generated by Django 5.1.1 on 2026-10-17 03:10
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_order_updated_at(apps, schema_editor):
+    # las ordenes existentes no se modificaron desde que se crearon, o al menos no tenemos otra fecha
+    Order = apps.get_model('api', 'Order')
+    Order.objects.update(updated_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_order_total_price_item_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_order_updated_at, migrations.RunPython.noop),
+    ]
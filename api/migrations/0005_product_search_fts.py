@@ -0,0 +1,65 @@
+# Generated by Django 5.1.1 on 2026-10-17 03:40
+
+from django.db import migrations
+
+# tabla FTS5 de contenido externo: guarda solo el índice invertido, el texto se lee de api_product por rowid
+# prefix='2 3' agrega índices de prefijos de 2 y 3 letras para que las búsquedas "tel*" no recorran todos los términos
+FORWARD_SQL = [
+    """
+    CREATE VIRTUAL TABLE api_product_fts USING fts5(
+        name, description,
+        content='api_product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    # los triggers mantienen el índice sincronizado con cualquier escritura, incluso bulk_create, update() y delete()
+    """
+    CREATE TRIGGER api_product_fts_insert AFTER INSERT ON api_product BEGIN
+        INSERT INTO api_product_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER api_product_fts_delete AFTER DELETE ON api_product BEGIN
+        INSERT INTO api_product_fts(api_product_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    # solo reindexamos si cambia el texto, las actualizaciones de stock no tocan el índice
+    """
+    CREATE TRIGGER api_product_fts_update AFTER UPDATE OF name, description ON api_product BEGIN
+        INSERT INTO api_product_fts(api_product_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO api_product_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+    # indexamos los productos que ya existían
+    "INSERT INTO api_product_fts(api_product_fts) VALUES ('rebuild')",
+]
+
+BACKWARD_SQL = [
+    'DROP TRIGGER IF EXISTS api_product_fts_update',
+    'DROP TRIGGER IF EXISTS api_product_fts_delete',
+    'DROP TRIGGER IF EXISTS api_product_fts_insert',
+    'DROP TABLE IF EXISTS api_product_fts',
+]
+
+
+def run(statements):
+    # FTS5 solo existe en SQLite, con otros motores la búsqueda usa SearchFilter
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for sql in statements:
+            schema_editor.execute(sql)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_product_order_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(FORWARD_SQL), run(BACKWARD_SQL)),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.1.1 on 2026-10-17 04:30
+
+import logging
+from importlib import import_module
+
+from django.db import migrations, models
+from django.db.models import Count
+
+logger = logging.getLogger('api.migrations')
+
+# los triggers del índice FTS5 de la migración 0005
+product_search = import_module('api.migrations.0005_product_search_fts')
+FTS_TRIGGERS_SQL = [sql for sql in product_search.FORWARD_SQL if 'CREATE TRIGGER' in sql]
+
+
+def rename_duplicates(apps, schema_editor):
+    # antes de agregar la restricción, los productos con nombre repetido (salvo el primero) pasan a "nombre (#id)"
+    # si ese nombre ya existe se prueba "nombre (#id-2)", "nombre (#id-3)", ... y cada cambio queda en el log
+    Product = apps.get_model('api', 'Product')
+    duplicated = Product.objects.values('name').annotate(total=Count('pk')).filter(total__gt=1).values_list('name', flat=True)
+    for name in duplicated:
+        for product in Product.objects.filter(name=name).order_by('pk')[1:]:
+            attempt = 1
+            while True:
+                suffix = f' (#{product.pk})' if attempt == 1 else f' (#{product.pk}-{attempt})'
+                # recortamos el nombre y no el sufijo, así el nombre nuevo sigue siendo distinto del original
+                new_name = name[:200 - len(suffix)] + suffix
+                if not Product.objects.filter(name=new_name).exists():
+                    break
+                attempt += 1
+            logger.warning('Renamed duplicated product %s from %r to %r', product.pk, name, new_name)
+            product.name = new_name
+            product.save(update_fields=['name'])
+
+
+def recreate_fts_triggers(apps, schema_editor):
+    # en SQLite AddConstraint vuelve a crear la tabla api_product y se pierden sus triggers
+    # los ids no cambian, el contenido del índice sigue siendo válido
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for name in ('api_product_fts_insert', 'api_product_fts_delete', 'api_product_fts_update'):
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {name}')
+    for sql in FTS_TRIGGERS_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_order_product_indexes'),
+    ]
+
+    operations = [
+        # al revertir, RemoveConstraint también vuelve a crear la tabla, los triggers se recrean después
+        migrations.RunPython(rename_duplicates, recreate_fts_triggers),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.UniqueConstraint(fields=('name',), name='product_unique_name'),
+        ),
+        migrations.RunPython(recreate_fts_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.1 on 2026-10-17 09:10
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+# AddField de un campo NOT NULL vuelve a crear la tabla api_product en SQLite, los triggers del índice FTS5
+# se recrean igual que en la migración 0007
+recreate_fts_triggers = import_module('api.migrations.0007_product_unique_name').recreate_fts_triggers
+
+
+def set_image_hashes(apps, schema_editor):
+    # los productos que ya tenían imagen, sus miniaturas se generan en la primera request de cada una
+    from api.thumbnails import image_digest
+    Product = apps.get_model('api', 'Product')
+    for product in Product.objects.exclude(image='').exclude(image__isnull=True).iterator():
+        try:
+            product.image_hash = image_digest(product.image)
+        except OSError:
+            # el archivo ya no existe, el producto queda sin miniaturas
+            continue
+        product.save(update_fields=['image_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_product_unique_name'),
+    ]
+
+    operations = [
+        # al revertir, RemoveField también vuelve a crear la tabla, los triggers se recrean después
+        migrations.RunPython(migrations.RunPython.noop, recreate_fts_triggers),
+        migrations.AddField(
+            model_name='product',
+            name='image_hash',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=64),
+        ),
+        migrations.RunPython(recreate_fts_triggers, migrations.RunPython.noop),
+        migrations.RunPython(set_image_hashes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.1 on 2026-10-17 14:02
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def set_unit_prices(apps, schema_editor):
+    # no sabemos a qué precio se vendieron los items que ya existen, usamos el precio actual del producto,
+    # que es el que mostraban hasta ahora; los totales guardados de las ordenes no se modifican
+    OrderItem = apps.get_model('api', 'OrderItem')
+    Product = apps.get_model('api', 'Product')
+    OrderItem.objects.update(
+        unit_price=Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('price')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_product_image_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+            preserve_default=False,
+        ),
+        migrations.RunPython(set_unit_prices, migrations.RunPython.noop),
+    ]
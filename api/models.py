@@ -1,10 +1,102 @@
 import uuid
-from django.db import models
+from decimal import Decimal
+from django.db import models, transaction
+from django.db.models import Avg, Case, Count, F, Max, Min, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
+
+from api.cache import bump_catalog_version, bump_user_version
+from api.thumbnails import image_digest, schedule_thumbnails
 
 # creamos un modelo de usuario en base al modelo AbstractUser
 class User(AbstractUser):
-    pass
+    # cualquier cambio (is_active, set_password, is_staff, ...) invalida el usuario guardado por CachedJWTAuthentication
+    # un queryset.update() no pasa por acá, esos cambios se ven cuando vence JWT_USER_CACHE['TIMEOUT']
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        bump_user_version(self.pk)
+
+    def delete(self, *args, **kwargs):
+        user_id = self.pk
+        result = super().delete(*args, **kwargs)
+        bump_user_version(user_id)
+        return result
+
+
+# error que devuelve adjust_stock cuando algún producto no tiene stock suficiente
+class InsufficientStock(Exception):
+    def __init__(self, product_ids):
+        super().__init__(f'Insufficient stock for products {product_ids}')
+        self.product_ids = product_ids
+
+
+class ProductQuerySet(models.QuerySet):
+    # las escrituras masivas no llaman a save() ni a delete() del modelo, también cambian la versión del catálogo
+    # y, como auto_now solo se aplica en save(), actualizan updated_at a mano
+    def update(self, **kwargs):
+        kwargs.setdefault('updated_at', timezone.now())
+        rows = super().update(**kwargs)
+        if rows:
+            bump_catalog_version()
+        return rows
+
+    def delete(self):
+        result = super().delete()
+        bump_catalog_version()
+        return result
+
+    def bulk_create(self, *args, **kwargs):
+        objs = super().bulk_create(*args, **kwargs)
+        bump_catalog_version()
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        if 'updated_at' not in fields:
+            now = timezone.now()
+            for obj in objs:
+                obj.updated_at = now
+            fields = [*fields, 'updated_at']
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        bump_catalog_version()
+        return rows
+
+    # cantidad de productos y precio máximo, mínimo y promedio con una única consulta
+    def summary(self):
+        return self.aggregate(
+            count=Count('pk'), max_price=Max('price'), min_price=Min('price'), avg_price=Avg('price')
+        )
+
+    # inserta los productos nuevos y actualiza los que ya existen con el mismo nombre, con un INSERT por lote
+    def upsert_by_name(self, products, batch_size=None):
+        return self.bulk_create(
+            products,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['name'],
+            update_fields=['description', 'price', 'stock', 'updated_at'],
+        )
+
+    # reserva (cantidad positiva) o libera (cantidad negativa) stock de varios productos con un único UPDATE condicional
+    # UPDATE ... SET stock = stock - n WHERE stock >= n, así dos pedidos concurrentes nunca dejan el stock negativo
+    # si algún producto no alcanza no se modifica ninguno y se lanza InsufficientStock
+    def adjust_stock(self, quantities):
+        quantities = {pk: quantity for pk, quantity in quantities.items() if quantity}
+        if not quantities:
+            return
+        delta = Case(
+            *(When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()),
+            output_field=models.IntegerField()
+        )
+        with transaction.atomic():
+            updated = self.filter(pk__in=quantities, stock__gte=delta).update(stock=F('stock') - delta)
+            if updated != len(quantities):
+                # deshacemos los productos que sí se actualizaron al salir del bloque atomic
+                transaction.set_rollback(True)
+        if updated != len(quantities):
+            stock = dict(self.filter(pk__in=quantities).values_list('pk', 'stock'))
+            raise InsufficientStock([pk for pk, quantity in quantities.items() if stock.get(pk, 0) < quantity])
 
 
 class Product(models.Model):
@@ -14,6 +106,25 @@ class Product(models.Model):
     stock = models.PositiveIntegerField()
     # las imágenes de los productos se van a guardar en una carpeta de medios y dentro en la carpeta products
     image = models.ImageField(upload_to='products/', blank=True, null=True)
+    # sha256 del contenido de image, forma el nombre de sus miniaturas (ver api/thumbnails.py)
+    image_hash = models.CharField(max_length=64, blank=True, default='', editable=False, db_index=True)
+    # fecha de la última modificación, con índice para que el MAX(updated_at) del catálogo no recorra la tabla
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # la importación masiva hace upsert por nombre (INSERT ... ON CONFLICT (name) DO UPDATE)
+            models.UniqueConstraint(fields=['name'], name='product_unique_name'),
+        ]
+        indexes = [
+            # filtros de rango de precio (price__lt, price__gt, price__range)
+            models.Index(fields=['price'], name='product_price_idx'),
+            # índice parcial con solo los productos en stock, el listado siempre filtra stock > 0 (InStockFilterBackend)
+            # (price, id) sirve para los rangos de precio y para ordenar por precio con el desempate por pk de la paginación
+            models.Index(fields=['price', 'id'], condition=Q(stock__gt=0), name='product_in_stock_price_idx'),
+        ]
 
     # property genera una columna en la base de datos, que se va a llamar in_stock, que va a ser True or False, en base a una función que generamos con def
     @property
@@ -23,6 +134,74 @@ class Product(models.Model):
     def __str__(self):
         return self.name
 
+    # cualquier cambio de un producto (API, admin o shell) invalida las respuestas del catálogo en cache
+    # una imagen recién subida guarda el hash de su contenido y, al confirmar la transacción, genera sus miniaturas
+    def save(self, *args, **kwargs):
+        new_image = bool(self.image) and not self.image._committed
+        if new_image:
+            self.image_hash = image_digest(self.image)
+        elif not self.image:
+            self.image_hash = ''
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'image' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'image_hash'}
+        super().save(*args, **kwargs)
+        bump_catalog_version()
+        if new_image:
+            source, digest = self.image.name, self.image_hash
+            transaction.on_commit(lambda: schedule_thumbnails(source, digest), using=self._state.db)
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        bump_catalog_version()
+        return result
+
+
+class OrderQuerySet(models.QuerySet):
+    # anota el total y la cantidad de items calculados desde los OrderItem, sin usar los campos guardados
+    # el total usa el precio guardado en cada item, un cambio de precio del producto no modifica ordenes ya hechas
+    def annotate_computed_totals(self):
+        return self.annotate(
+            computed_total_price=Coalesce(
+                Sum(
+                    F('items__quantity') * F('items__unit_price'),
+                    output_field=models.DecimalField(max_digits=12, decimal_places=2)
+                ),
+                Value(Decimal('0')),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2)
+            ),
+            computed_item_count=Count('items')
+        )
+
+    # recorre las ordenes en lotes ordenados por pk y corrige las que tengan los totales desactualizados
+    # con dry_run=True solo cuenta las diferencias sin guardar nada
+    def recalculate_totals(self, batch_size=1000, dry_run=False):
+        checked = drifted = 0
+        last_pk = None
+        qs = self.order_by('pk')
+        while True:
+            with transaction.atomic():
+                batch_qs = qs if last_pk is None else qs.filter(pk__gt=last_pk)
+                batch = list(batch_qs.annotate_computed_totals()[:batch_size])
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+                stale = [
+                    order for order in batch
+                    if order.total_price != order.computed_total_price
+                    or order.item_count != order.computed_item_count
+                ]
+                now = timezone.now()
+                for order in stale:
+                    order.total_price = order.computed_total_price
+                    order.item_count = order.computed_item_count
+                    order.updated_at = now
+                if stale and not dry_run:
+                    self.model.objects.bulk_update(stale, ['total_price', 'item_count', 'updated_at'])
+            checked += len(batch)
+            drifted += len(stale)
+        return checked, drifted
+
 
 class Order(models.Model):
     # TextChoices permite crear opciones que puede tomar alguna columna de la base de datos
@@ -35,17 +214,90 @@ class Order(models.Model):
     order_id = models.UUIDField(primary_key=True, default=uuid.uuid4)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    # fecha de la última modificación de la orden o de sus items, se usa para los GET condicionales
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     status = models.CharField(
         max_length=10,
         choices=StatusChoices.choices,
         default=StatusChoices.PENDING
     )
 
+    # guardamos el total y la cantidad de items para que el listado de ordenes no tenga que unir OrderItem y Product
+    # se actualizan dentro de la misma transacción en la que se modifican los items
+    total_price = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0)
+
     # el campo products va a contener los productos de la orden estableciendo una relación de muchos a muchos con el modelos Product, esta relación se va a establecer mediante el modelo OrderItem (through='OrderItem')
     products = models.ManyToManyField(Product, through='OrderItem', related_name='orders')
 
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        # order_id va al final de cada índice porque la paginación desempata por pk, que no es el rowid de la tabla
+        # sin él SQLite tiene que ordenar en memoria las filas con el mismo created_at
+        indexes = [
+            # listado de ordenes de un usuario ordenado o filtrado por fecha
+            models.Index(fields=['user', 'created_at', 'order_id'], name='order_user_created_idx'),
+            # filtro por status con rango de fechas, el listado de un administrador
+            models.Index(fields=['status', 'created_at', 'order_id'], name='order_status_created_idx'),
+            # listado de un administrador sin filtros o solo con fechas, en el orden por defecto (-created_at)
+            models.Index(fields=['created_at', 'order_id'], name='order_created_idx'),
+        ]
+
+    # las ordenes canceladas no retienen stock de sus productos
+    @staticmethod
+    def status_reserves_stock(status):
+        return status != Order.StatusChoices.CANCELLED
+
+    # cantidades por producto de los items de la orden, sumando si un producto aparece en más de una línea
+    @staticmethod
+    def item_quantities(items):
+        quantities = {}
+        for item in items:
+            quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+        return quantities
+
+    # cantidades que retiene una orden con ese status y esos items
+    @staticmethod
+    def reserved_quantities(status, items):
+        return Order.item_quantities(items) if Order.status_reserves_stock(status) else {}
+
+    # reserva o libera la diferencia entre lo que retenía la orden y lo que va a retener
+    # lanza InsufficientStock si algún producto no alcanza, lo usan el serializer, la view y el admin
+    @staticmethod
+    def change_stock(old_quantities, new_quantities):
+        Product.objects.adjust_stock({
+            pk: new_quantities.get(pk, 0) - old_quantities.get(pk, 0)
+            for pk in old_quantities.keys() | new_quantities.keys()
+        })
+
+    # la orden y sus items leídos de la DB dentro de la transacción en curso, no los de la instancia que se cargó
+    # antes; con SELECT ... FOR UPDATE otra transacción que modifica la misma orden espera a que esta termine,
+    # en SQLite lo serializa BEGIN IMMEDIATE (transaction_mode en DATABASES)
+    # lanza Order.DoesNotExist si otra transacción la borró
+    def lock_for_update(self):
+        order = Order.objects.select_for_update().get(pk=self.pk)
+        return order, list(order.items.all())
+
+    # borra la orden y devuelve a los productos el stock que retenía, lo usan la view y el admin
+    def delete_releasing_stock(self):
+        with transaction.atomic():
+            order, items = self.lock_for_update()
+            Order.change_stock(Order.reserved_quantities(order.status, items), {})
+            return order.delete()
+
     def __srt__(self):
         return f'Order {self.order_id} by {self.user.username}'
+
+    # recalcula desde la DB total_price e item_count y los guarda en la orden
+    def recalculate_totals(self):
+        totals = Order.objects.filter(pk=self.pk).annotate_computed_totals().values(
+            'computed_total_price', 'computed_item_count'
+        ).get()
+        self.total_price = totals['computed_total_price']
+        self.item_count = totals['computed_item_count']
+        # auto_now solo se guarda con update_fields si el campo está en la lista
+        self.save(update_fields=['total_price', 'item_count', 'updated_at'])
     
 
 class OrderItem(models.Model):
@@ -57,10 +309,20 @@ class OrderItem(models.Model):
         )
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
+    # precio del producto al momento de agregarlo a la orden, el subtotal y el total de la orden se calculan con este
+    # precio y no con el actual del producto
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, editable=False)
+
+    # los bulk_create tienen que indicar unit_price, save() lo toma del producto (por ej. desde el admin)
+    def save(self, *args, **kwargs):
+        if self.unit_price is None:
+            self.unit_price = self.product.price
+        super().save(*args, **kwargs)
 
     @property
     def item_subtotal(self):
-        return self.product.price * self.quantity
+        return self.unit_price * self.quantity
     
     def __str__(self):
-        return f'{self.quantity} x {self.product.name} in order {self.order.order_id}'
\ No newline at end of file
+        # order_id ya está en el item, self.order haría una query más (el producto sigue necesitando select_related)
+        return f'{self.quantity} x {self.product.name} in order {self.order_id}'
\ No newline at end of file
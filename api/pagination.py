@@ -0,0 +1,153 @@
+import datetime
+import decimal
+import json
+import uuid
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+
+# paginación por keyset: en lugar de OFFSET guardamos en el cursor los valores de la última fila de la página
+# y pedimos la siguiente con WHERE (campo, pk) > (valor, pk), así las páginas profundas cuestan lo mismo que la primera
+# heredamos de CursorPagination para reutilizar el formato del cursor, los links y el schema, pero a diferencia de
+# CursorPagination siempre desempatamos por pk, entonces ordenar por price o stock (con valores repetidos) es estable
+# no hacemos COUNT(*), la respuesta solo tiene next, previous y results
+class KeysetPagination(CursorPagination):
+    ordering = 'pk'
+
+    def get_ordering(self, request, queryset, view):
+        ordering = list(super().get_ordering(request, queryset, view))
+        pk_name = queryset.model._meta.pk.name
+        # sumamos el pk como último campo del orden para que cada fila tenga una posición única
+        if ordering[-1].lstrip('-') not in ('pk', pk_name):
+            ordering.append('-pk' if ordering[-1].startswith('-') else 'pk')
+        return tuple(ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page(list(queryset))
+
+    # igual que paginate_queryset con el ORM async, para las views de api/async_views.py
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page([row async for row in queryset])
+
+    # el queryset de la página, sin ejecutarlo
+    def get_page_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.model = queryset.model
+        cursor = self.decode_cursor(request)
+        self.reverse = cursor is not None and cursor.reverse
+        self.has_cursor = cursor is not None
+
+        # para la página anterior recorremos el orden al revés desde la primera fila y luego invertimos el resultado
+        order_by = [self.invert(field) for field in self.ordering] if self.reverse else list(self.ordering)
+        queryset = queryset.order_by(*order_by)
+        if cursor is not None:
+            queryset = queryset.filter(self.keyset_filter(order_by, self.load_position(cursor.position)))
+
+        # pedimos una fila de más para saber si hay otra página sin contar las filas
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, rows):
+        has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.has_cursor
+
+        if (self.has_next or self.has_previous) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self.dump_position(self.page[-1])))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self.dump_position(self.page[0])))
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    # (f1 > v1) OR (f1 = v1 AND f2 > v2) OR ... usando lt en los campos con orden descendente
+    @staticmethod
+    def keyset_filter(order_by, values):
+        conditions = []
+        equal = Q()
+        for field, value in zip(order_by, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            conditions.append(equal & Q(**{f'{name}__{lookup}': value}))
+            equal &= Q(**{name: value})
+        return reduce(or_, conditions)
+
+    def get_field(self, name):
+        if name == 'pk':
+            return self.model._meta.pk
+        try:
+            return self.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # campos anotados en el queryset, usamos el valor tal cual viene en el cursor
+            return None
+
+    # guardamos el orden junto con los valores para rechazar un cursor generado con otro ordering
+    # obj es una instancia o una fila de .values() con los campos del orden (serialización rápida)
+    def dump_position(self, obj):
+        values = []
+        for field in self.ordering:
+            name = field.lstrip('-')
+            value = obj[name] if isinstance(obj, dict) else getattr(obj, name)
+            if isinstance(value, (datetime.date, datetime.time)):
+                # isoformat completo, sin truncar los microsegundos para no saltear filas
+                value = value.isoformat()
+            elif isinstance(value, (decimal.Decimal, uuid.UUID)):
+                value = str(value)
+            values.append(value)
+        return json.dumps({'o': self.ordering, 'v': values})
+
+    def load_position(self, position):
+        try:
+            data = json.loads(position)
+            if tuple(data['o']) != self.ordering or len(data['v']) != len(self.ordering):
+                raise ValueError
+            values = []
+            for field, value in zip(self.ordering, data['v']):
+                model_field = self.get_field(field.lstrip('-'))
+                values.append(model_field.to_python(value) if model_field is not None else value)
+            return values
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class ProductPagination(KeysetPagination):
+    # mantenemos el parámetro number y el máximo de 5 productos por página que tenía LimitOffsetPagination
+    page_size_query_param = 'number'
+    max_page_size = 5
+
+
+class OrderPagination(KeysetPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = '-created_at'
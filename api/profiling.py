@@ -0,0 +1,154 @@
+import atexit
+import json
+import random
+import threading
+import time
+from contextlib import ExitStack, nullcontext
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from api.querybudget import async_execute_wrapper
+
+
+class SQLTimer:
+    # execute_wrapper que cuenta las queries y suma su duración
+    def __init__(self):
+        self.count = 0
+        self.ms = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.ms += (time.perf_counter() - start) * 1000
+
+
+class ProfileAggregator:
+    # acumula en memoria los tiempos de cada view y cada FLUSH_INTERVAL segundos un hilo los agrega a PATH
+    # la request solo actualiza un dict, no escribe en la DB ni en disco
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+        self.window_start = time.time()
+        self.thread = None
+
+    def record(self, view, ms, sql_count, sql_ms, sampled):
+        with self.lock:
+            row = self.views.get(view)
+            if row is None:
+                row = self.views[view] = {
+                    'count': 0, 'sampled': 0, 'slow': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                    'sql_count': 0, 'sql_ms': 0.0,
+                }
+            row['count'] += 1
+            row['sampled'] += sampled
+            row['slow'] += not sampled
+            row['total_ms'] += ms
+            row['max_ms'] = max(row['max_ms'], ms)
+            row['sql_count'] += sql_count
+            row['sql_ms'] += sql_ms
+            if self.thread is None:
+                self.start()
+
+    def snapshot(self):
+        with self.lock:
+            return {view: dict(row) for view, row in self.views.items()}
+
+    def take(self):
+        # devuelve la ventana actual y empieza una nueva
+        with self.lock:
+            views, self.views = self.views, {}
+            start, self.window_start = self.window_start, time.time()
+        return start, views
+
+    def flush(self):
+        start, views = self.take()
+        if not views:
+            return
+        end = time.time()
+        lines = ''.join(
+            json.dumps({'start': start, 'end': end, 'view': view, **{
+                key: round(value, 3) if isinstance(value, float) else value for key, value in row.items()
+            }}) + '\n'
+            for view, row in sorted(views.items())
+        )
+        with open(settings.PROFILING['PATH'], 'a', encoding='utf-8') as f:
+            f.write(lines)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='profiling-flush', daemon=True)
+        self.thread.start()
+        # lo que quedó en memoria al terminar el proceso también se escribe
+        atexit.register(self.flush)
+
+    def run(self):
+        while True:
+            time.sleep(settings.PROFILING['FLUSH_INTERVAL'])
+            try:
+                self.flush()
+            except OSError:
+                # si no se puede escribir se pierde la ventana, el perfilado no puede afectar a las requests
+                pass
+
+
+aggregator = ProfileAggregator()
+
+
+class SamplingProfilerMiddleware:
+    # reemplazo liviano de silk: mide una muestra de las requests (SAMPLE_RATE) y las que superan SLOW_MS
+    # de las requests muestreadas también mide las queries; las lentas fuera de la muestra solo registran el tiempo
+    # se usa con PROFILING_MODE = 'sampling', con otro modo Django no incluye el middleware
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if settings.PROFILING_MODE != 'sampling':
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = settings.PROFILING['SAMPLE_RATE']
+        self.slow_ms = settings.PROFILING['SLOW_MS']
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        sampled = random.random() < self.sample_rate
+        if not sampled and not self.slow_ms:
+            return self.get_response(request)
+        timer = SQLTimer()
+        start = time.perf_counter()
+        if sampled:
+            with ExitStack() as stack:
+                # execute_wrapper no abre la conexión, solo se agrega a la lista de wrappers del alias
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timer))
+                response = self.get_response(request)
+        else:
+            response = self.get_response(request)
+        self.record(request, sampled, timer, start)
+        return response
+
+    async def __acall__(self, request):
+        sampled = random.random() < self.sample_rate
+        if not sampled and not self.slow_ms:
+            return await self.get_response(request)
+        timer = SQLTimer()
+        start = time.perf_counter()
+        async with async_execute_wrapper(timer) if sampled else nullcontext():
+            response = await self.get_response(request)
+        self.record(request, sampled, timer, start)
+        return response
+
+    def record(self, request, sampled, timer, start):
+        ms = (time.perf_counter() - start) * 1000
+        if sampled or ms >= self.slow_ms:
+            match = request.resolver_match
+            view = f'{request.method} {match.view_name if match else "unresolved"}'
+            aggregator.record(view, ms, timer.count, timer.ms, sampled)
@@ -0,0 +1,151 @@
+import logging
+import re
+from collections import Counter
+from contextlib import ExitStack, asynccontextmanager, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger('api.queries')
+
+# listas de parámetros: IN (%s, %s, ...) y VALUES (%s, %s), (%s, %s) de los INSERT por lotes
+_PARAM_LIST = re.compile(r'\((?:\s*%s\s*,)*\s*%s\s*\)')
+_VALUES = re.compile(r'VALUES\s*\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))*', re.IGNORECASE)
+# literales que Django escribe en el SQL (LIMIT, OFFSET) y los que puedan venir en .extra() o RawSQL
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPACES = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    # forma de la query sin los valores: dos queries con la misma forma y distintos parámetros son iguales
+    sql = _PARAM_LIST.sub('(...)', sql)
+    sql = _VALUES.sub('VALUES (...)', sql)
+    sql = _LITERALS.sub('?', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+# el BEGIN y los savepoints dependen de si la view corre dentro de otra transacción (en los TestCase siempre):
+# afuera atomic() ejecuta BEGIN (BEGIN IMMEDIATE en SQLite), adentro un SAVEPOINT; ninguno de los dos se cuenta,
+# así los query_budget calibrados en un TestCase valen también en producción
+_TRANSACTION = re.compile(r'^\s*(?:BEGIN|SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT)\b', re.IGNORECASE)
+
+
+class QueryInspector:
+    # execute_wrapper que guarda la forma de cada query ejecutada
+    def __init__(self):
+        self.fingerprints = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not _TRANSACTION.match(sql):
+            self.fingerprints.append(fingerprint(sql))
+        return execute(sql, params, many, context)
+
+    @property
+    def count(self):
+        return len(self.fingerprints)
+
+    def repeated(self, threshold=None):
+        # formas que se ejecutaron threshold veces o más en la misma request, el síntoma de un N+1
+        threshold = threshold or settings.QUERY_INSPECTOR['REPEATED_THRESHOLD']
+        return {shape: total for shape, total in Counter(self.fingerprints).items() if total >= threshold}
+
+
+@contextmanager
+def inspect_queries():
+    inspector = QueryInspector()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(inspector))
+        yield inspector
+
+
+@asynccontextmanager
+async def async_execute_wrapper(wrapper):
+    # en las requests async el ORM corre con sync_to_async en el hilo de la request (ThreadSensitiveContext)
+    # y las conexiones son por hilo, el wrapper se agrega a las de ese hilo y no a las del event loop
+    stack = ExitStack()
+
+    def enter():
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(wrapper))
+
+    await sync_to_async(enter)()
+    try:
+        yield wrapper
+    finally:
+        await sync_to_async(stack.close)()
+
+
+def get_query_budget(request):
+    # query_budget de la view que atendió la request: un número o un dict por acción de viewset
+    # incluye todas las queries de la request, también las de la sesión y el usuario de los middlewares
+    match = getattr(request, 'resolver_match', None)
+    cls = getattr(match.func, 'cls', None) if match else None
+    budget = getattr(cls, 'query_budget', None)
+    if isinstance(budget, dict):
+        actions = getattr(match.func, 'actions', None) or {}
+        budget = budget.get(actions.get(request.method.lower(), request.method.lower()))
+    return cls, budget
+
+
+def check_request(request, inspector):
+    # devuelve los problemas de la request: queries repetidas y queries de más sobre el presupuesto de la view
+    problems = []
+    for shape, total in inspector.repeated().items():
+        problems.append(f'{total} queries with the same shape: {shape}')
+    cls, budget = get_query_budget(request)
+    if budget is not None and inspector.count > budget:
+        problems.append(f'{inspector.count} queries over the budget of {budget} for {cls.__name__}')
+    return problems
+
+
+class QueryInspectorMiddleware:
+    # en desarrollo registra un warning por cada request con un posible N+1 o que supera el query_budget de su view
+    # y agrega el header X-Query-Count; se activa con QUERY_INSPECTOR['ENABLED'], con None sigue a DEBUG
+    # sirve para las views sync y las async (api/async_views.py), con ASGI no obliga a Django a pasar a un hilo
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        enabled = settings.QUERY_INSPECTOR['ENABLED']
+        if not (settings.DEBUG if enabled is None else enabled):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with inspect_queries() as inspector:
+            response = self.get_response(request)
+        return self.report(request, response, inspector)
+
+    async def __acall__(self, request):
+        async with async_execute_wrapper(QueryInspector()) as inspector:
+            response = await self.get_response(request)
+        return self.report(request, response, inspector)
+
+    def report(self, request, response, inspector):
+        for problem in check_request(request, inspector):
+            logger.warning('%s %s: %s', request.method, request.path, problem)
+        response['X-Query-Count'] = str(inspector.count)
+        return response
+
+
+class QueryBudgetTestMixin:
+    # para los TestCase: hace la request con self.client y falla si hay queries repetidas o se pasa del query_budget
+    def assertWithinQueryBudget(self, method, url, *args, **kwargs):
+        with inspect_queries() as inspector:
+            response = getattr(self.client, method)(url, *args, **kwargs)
+            # las respuestas por partes ejecutan sus queries al consumirlas
+            if response.streaming:
+                b''.join(response.streaming_content)
+        cls, budget = get_query_budget(response.wsgi_request)
+        self.assertIsNotNone(budget, f'{cls.__name__ if cls else url} does not declare query_budget')
+        problems = check_request(response.wsgi_request, inspector)
+        self.assertEqual(problems, [], f'{method.upper()} {url}:\n' + '\n'.join(inspector.fingerprints))
+        return response
@@ -0,0 +1,71 @@
+import csv
+import json
+
+import orjson
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+# buffer que devuelve lo que se escribe en lugar de guardarlo, así csv.writer genera las líneas de a una
+class Echo:
+    def write(self, value):
+        return value
+
+
+# NDJSON: un objeto JSON por línea
+# las views que envían por partes usan lines() con un StreamingHttpResponse, render() queda para los errores
+class NDJSONRenderer(BaseRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    @staticmethod
+    def lines(rows):
+        for row in rows:
+            yield json.dumps(row, cls=JSONEncoder, ensure_ascii=False) + '\n'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(self.lines(rows)).encode(self.charset)
+
+
+# CSV con encabezado, cada fila es un dict con las columnas de header
+class CSVRenderer(BaseRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    @staticmethod
+    def lines(header, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow([row.get(column, '') for column in header])
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        header = list(rows[0]) if rows else []
+        return ''.join(self.lines(header, rows)).encode(self.charset)
+
+
+# JSONRenderer con orjson para las respuestas compactas (sin indent), genera los mismos bytes que JSONRenderer
+# orjson no conoce Decimal ni las lazy strings y formatea las fechas distinto: esos valores pasan por el JSONEncoder de DRF
+# con indent (la API navegable), ensure_ascii o sin COMPACT_JSON se usa JSONRenderer
+# diferencias conocidas: los float fuera de [1e-4, 1e16) se escriben sin exponente o sin el signo del exponente
+# y NaN / Infinity salen como null en lugar de un error
+class ORJSONRenderer(JSONRenderer):
+    options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if indent is not None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        ret = orjson.dumps(data, default=self.encoder_class().default, option=self.options)
+        # igual que JSONRenderer: U+2028 y U+2029 son válidos en JSON pero no dentro de un string de JavaScript
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
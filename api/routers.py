@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class ReadReplicaRouter:
+    # las lecturas de los modelos de READ_REPLICA['MODELS'] van a la conexión de solo lectura READ_REPLICA['ALIAS']
+    # las escrituras y todo lo que corre dentro de transaction.atomic() van a default: dentro de una transacción
+    # la réplica no ve lo que la transacción todavía no confirmó, ni el stock que bloquea
+    def db_for_read(self, model, **hints):
+        if model._meta.label_lower not in settings.READ_REPLICA['MODELS']:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return settings.READ_REPLICA['ALIAS']
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    # las dos conexiones son el mismo archivo, un objeto leído de la réplica se puede relacionar con uno de default
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
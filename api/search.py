@@ -0,0 +1,51 @@
+from django.db import connection, connections
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+
+# tabla FTS5 creada en la migración 0005, indexa name y description de api_product
+PRODUCT_FTS_TABLE = 'api_product_fts'
+
+# peso de cada columna en el ranking bm25, una coincidencia en el nombre vale más que en la descripción
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+
+def fts_available(queryset):
+    # la tabla FTS5 solo se crea en SQLite
+    return connections[queryset.db].vendor == 'sqlite'
+
+
+def build_match_query(terms):
+    # cada término va entre comillas (las comillas internas se duplican) para que FTS5 no interprete
+    # AND, OR, NOT, NEAR, * o ^ que escriba el usuario, y con * al final para buscar por prefijo
+    # los términos separados por espacio se combinan con AND, igual que en SearchFilter
+    phrases = []
+    for term in terms:
+        term = term.strip()
+        if term:
+            phrases.append('"{}"*'.format(term.replace('"', '""')))
+    return ' '.join(phrases)
+
+
+def search_products(queryset, match):
+    # une el queryset con la tabla FTS5 y anota search_rank (bm25, menor es mejor)
+    # search_rank es una expresión sobre la tabla unida, por eso se puede ordenar y filtrar por ella (paginación keyset)
+    table = queryset.model._meta.db_table
+    return queryset.extra(
+        tables=[PRODUCT_FTS_TABLE],
+        where=[f'{PRODUCT_FTS_TABLE}.rowid = {table}.id', f'{PRODUCT_FTS_TABLE} MATCH %s'],
+        params=[match],
+    ).annotate(
+        search_rank=RawSQL(
+            f'bm25({PRODUCT_FTS_TABLE}, %s, %s)', (NAME_WEIGHT, DESCRIPTION_WEIGHT), output_field=FloatField()
+        )
+    )
+
+
+def rebuild_product_index(optimize=False):
+    # vuelve a generar el índice desde api_product, por ejemplo después de cargar datos con los triggers desactivados
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {PRODUCT_FTS_TABLE}({PRODUCT_FTS_TABLE}) VALUES ('rebuild')")
+        if optimize:
+            # une los segmentos del índice en uno solo, las búsquedas leen menos páginas
+            cursor.execute(f"INSERT INTO {PRODUCT_FTS_TABLE}({PRODUCT_FTS_TABLE}) VALUES ('optimize')")
@@ -1,9 +1,24 @@
+from decimal import Decimal
+from operator import itemgetter
+
+from django.conf import settings
 from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Product, Order, OrderItem
+from rest_framework.exceptions import NotFound
+from .models import InsufficientStock, Product, Order, OrderItem
+from .sparse import SparseFieldsSerializerMixin
+from .thumbnails import thumbnail_urls
+
 
+class ProductSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
+    # URLs de las miniaturas de image por tamaño y formato (ver api/thumbnails.py), null si no tiene imagen
+    thumbnails = serializers.SerializerMethodField()
+    field_columns = {
+        'description': ['description'], 'name': ['name'], 'price': ['price'], 'stock': ['stock'],
+        'thumbnails': ['image_hash'],
+    }
 
-class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = (
@@ -14,8 +29,12 @@ class ProductSerializer(serializers.ModelSerializer):
             'description',
             'price',
             'stock',            
+            'thumbnails',
         )
 
+    def get_thumbnails(self, obj) -> dict | None:
+        return thumbnail_urls(obj.image_hash)
+
     # podemos crear una función que valide los datos que vienen del front o enviamos
     def validate_price(self, value):
         if value < 0:
@@ -24,17 +43,33 @@ class ProductSerializer(serializers.ModelSerializer):
         return value
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
+# valida cada fila de la importación masiva con las mismas reglas que ProductSerializer (validate_price)
+# sin el UniqueValidator de name: un nombre existente no es un error, se actualiza ese producto
+class ProductImportSerializer(ProductSerializer):
+    class Meta(ProductSerializer.Meta):
+        extra_kwargs = {
+            'name': {'validators': []}
+        }
+
+
+class OrderItemSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     # va a traer los productos que coincidan con la consulta, ya que en el modelo OrderItem tenemos un atributo product que tiene configurada una ForeignKey del modelo Product, es decir, no tenemos que usar el parámetro related_name para este caso 
     # product = ProductSerializer()
 
     # configuramos de forma explicita los atributos que necesitamos del producto para mostrar
     # product.name: el modelo OrderItem tiene un atributo product que refiere al modelo de Product
     product_name = serializers.CharField(source='product.name')
+    # el precio al que se agregó el producto a la orden, no el precio actual del producto
     product_price = serializers.DecimalField(
         max_digits=10,
         decimal_places=2,
-        source='product.price')
+        source='unit_price')
+    field_columns = {
+        'product_name': ['product__name'],
+        'product_price': ['unit_price'],
+        'quantity': ['quantity'],
+        'item_subtotal': ['unit_price', 'quantity'],
+    }
 
     class Meta:
         model = OrderItem
@@ -46,6 +81,10 @@ class OrderCreateSerializer(serializers.ModelSerializer):
     # creamos un serializer específico para que quede anidado
     # al funcionar solo en esta clase OrderCreateSerializer no es necesario declararlo afuera
     class OrderItemCreateSerializer(serializers.ModelSerializer):
+        # recibimos solo el id del producto, la existencia de todos los productos se valida junta en validate_items
+        # con un PrimaryKeyRelatedField se haría una consulta a la DB por cada item
+        product = serializers.IntegerField(source='product_id')
+
         class Meta:
             model = OrderItem
             fields = ['product', 'quantity']
@@ -55,38 +94,151 @@ class OrderCreateSerializer(serializers.ModelSerializer):
     # sumamos order id para que la respuesta sea igual a la respuesta de la consulta GET
     order_id = serializers.UUIDField(read_only=True)
 
+    # validamos todos los productos de la orden con una única consulta WHERE id IN (...)
+    def validate_items(self, value):
+        products = Product.objects.in_bulk({item['product_id'] for item in value})
+        errors = [
+            {} if item['product_id'] in products
+            else {'product': [f'Invalid pk "{item["product_id"]}" - object does not exist.']}
+            for item in value
+        ]
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        # reemplazamos cada id por la instancia de Product, como lo haría PrimaryKeyRelatedField
+        # si un producto viene repetido sumamos las cantidades en una sola línea, los items se identifican por producto
+        merged = {}
+        for item in value:
+            product_id = item.pop('product_id')
+            if product_id in merged:
+                merged[product_id]['quantity'] += item['quantity']
+            else:
+                merged[product_id] = {**item, 'product': products[product_id]}
+        return list(merged.values())
+
+    # calcula total_price e item_count con los productos que ya cargamos al validar, sin consultar la DB
+    # unit_prices: {product_id: precio} de los items que ya estaban en la orden, que conservan su precio
+    # los productos nuevos se agregan con el precio actual
+    @staticmethod
+    def get_totals(orderitem_data, unit_prices=None):
+        unit_prices = unit_prices or {}
+        return {
+            'total_price': sum(
+                (
+                    unit_prices.get(item['product'].pk, item['product'].price) * item['quantity']
+                    for item in orderitem_data
+                ),
+                Decimal('0')
+            ),
+            'item_count': len(orderitem_data),
+        }
+
+    # inserta todos los items de la orden con un único bulk_create (en lotes de ORDER_ITEMS_BATCH_SIZE)
+    @staticmethod
+    def bulk_create_items(order, orderitem_data):
+        OrderItem.objects.bulk_create(
+            [OrderItem(order=order, unit_price=item['product'].price, **item) for item in orderitem_data],
+            batch_size=settings.ORDER_ITEMS_BATCH_SIZE
+        )
+
+    # aplica la diferencia de stock entre lo que retenía la orden y lo que va a retener
+    # devuelve los errores por item si algún producto no tiene stock suficiente
+    def adjust_stock(self, old_quantities, new_quantities, orderitem_data):
+        try:
+            Order.change_stock(old_quantities, new_quantities)
+        except InsufficientStock as exc:
+            if orderitem_data is None:
+                raise serializers.ValidationError({'status': ['No hay stock suficiente para los productos de la orden']})
+            raise serializers.ValidationError({'items': [
+                {'quantity': ['No hay stock suficiente']} if item['product'].pk in exc.product_ids else {}
+                for item in orderitem_data
+            ]})
+
     # redefinimos el método create del serializer
     # validate_date es lo que nos llega desde la view que utiliza este serializer
     def create(self, validated_data):
         # guardamos en orderitem_data los items que viene en validated_data validated_data
         # pop() guarda en orderitem_data los elementos con clave items y lo elimina de 
-        orderitem_data = validated_data.pop('items')
+        orderitem_data = validated_data.pop('items', [])
+        validated_data.update(self.get_totals(orderitem_data))
 
         with transaction.atomic():
+            # reservamos el stock antes de crear la orden, si falta stock no se crea nada
+            if Order.status_reserves_stock(validated_data.get('status', Order.StatusChoices.PENDING)):
+                quantities = {item['product'].pk: item['quantity'] for item in orderitem_data}
+                self.adjust_stock({}, quantities, orderitem_data)
             order = Order.objects.create(**validated_data)
-            for item in orderitem_data:
-                OrderItem.objects.create(order=order, **item)
+            self.bulk_create_items(order, orderitem_data)
         return order
     
     # instance: son los datos que estamos actualizando, es decir, la orden con sus items
     def update(self, instance, validated_data):
-        orderitem_data = validated_data.pop('items')
+        # en un PATCH puede no venir items, en ese caso solo actualizamos los datos de la orden
+        orderitem_data = validated_data.pop('items', None)
 
         # indicamos que todo lo que se realice a continuación sea una transacción
         with transaction.atomic():
+            # el stock se calcula desde la orden como está ahora en la DB, no desde la que cargó get_object antes
+            # de abrir la transacción: dos cancelaciones al mismo tiempo liberarían dos veces el mismo stock
+            try:
+                instance, current_items = instance.lock_for_update()
+            except Order.DoesNotExist:
+                raise NotFound()
+            if orderitem_data is not None:
+                # total_price e item_count se guardan junto con el resto de los datos de la orden
+                # si un producto está en más de una línea se conserva la primera, como en update_items
+                unit_prices = {}
+                for item in current_items:
+                    unit_prices.setdefault(item.product_id, item.unit_price)
+                validated_data.update(self.get_totals(orderitem_data, unit_prices))
+
+            # comparamos el stock que retenía la orden con el que va a retener después del cambio
+            # al pasar a Cancelled se libera todo el stock, al salir de Cancelled se vuelve a reservar
+            old_quantities = Order.reserved_quantities(instance.status, current_items)
+            new_quantities = Order.reserved_quantities(
+                validated_data.get('status', instance.status),
+                current_items if orderitem_data is None else [OrderItem(**item) for item in orderitem_data]
+            )
+            self.adjust_stock(old_quantities, new_quantities, orderitem_data)
+
             # actualizamos el contenido de la variable instance pasando los datos de la orden sin los items
             instance = super().update(instance, validated_data)
 
             # Verificamos que tengamos items que actualizar
             if orderitem_data is not None:
-                # borramos todos los items que contiene actualmente la orden
-                instance.items.all().delete()
-
-            # creamos de nuevo los items con las modificaciones enviadas
-            for item in orderitem_data:
-                OrderItem.objects.create(order=instance, **item)        
+                self.update_items(instance, orderitem_data, current_items)
         return instance
 
+    # en lugar de borrar y volver a crear todos los items comparamos por producto los items actuales con los enviados
+    # hacemos como máximo un bulk_update, un bulk_create y un delete filtrado
+    def update_items(self, instance, orderitem_data, current_items):
+        existing = {}
+        removed = []
+        for item in current_items:
+            # una orden vieja puede tener el mismo producto en más de una línea, dejamos solo la primera
+            if item.product_id in existing:
+                removed.append(item.pk)
+            else:
+                existing[item.product_id] = item
+
+        changed = []
+        added = []
+        for data in orderitem_data:
+            item = existing.pop(data['product'].pk, None)
+            if item is None:
+                added.append(data)
+            elif item.quantity != data['quantity']:
+                item.quantity = data['quantity']
+                changed.append(item)
+        # los productos que quedaron en existing ya no están en la orden
+        removed += [item.pk for item in existing.values()]
+
+        if changed:
+            OrderItem.objects.bulk_update(changed, ['quantity'], batch_size=settings.ORDER_ITEMS_BATCH_SIZE)
+        if added:
+            self.bulk_create_items(instance, added)
+        if removed:
+            instance.items.filter(pk__in=removed).delete()
+
     class Meta:
         model = Order
         # los fields que vamos a usar en el alta (order_id', 'created_at' y 'total_price' se crean de forma automática)
@@ -96,22 +248,127 @@ class OrderCreateSerializer(serializers.ModelSerializer):
         }
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     order_id = serializers.UUIDField(read_only=True)
     # quitamos el read_only=True de items para poder, mediante un POST, modificar o dar de alta items
     items = OrderItemSerializer(many=True, read_only=True)
     total_price = serializers.SerializerMethodField()
+    field_columns = {
+        'order_id': ['order_id'],
+        'created_at': ['created_at'],
+        'user': ['user_id'],
+        'status': ['status'],
+        # los items se traen con un Prefetch (o una query aparte en fast_orders)
+        'items': [],
+        'total_price': ['total_price'],
+        'item_count': ['item_count'],
+    }
+    nested_fields = {'items': OrderItemSerializer}
 
     def get_total_price(self, obj):
-        order_items = obj.items.all()
-        return sum(order_item.item_subtotal for order_item in order_items)
+        # total_price se guarda en la orden, no hace falta recorrer los items para sumar
+        # una orden sin items devuelve 0, igual que sum() de una lista vacía
+        return obj.total_price or 0
 
     class Meta:
         model = Order
-        fields = ('order_id', 'created_at', 'user', 'status', 'items', 'total_price')
+        fields = ('order_id', 'created_at', 'user', 'status', 'items', 'total_price', 'item_count')
+        read_only_fields = ('item_count',)
+
+# resumen del catálogo, se calcula con un único aggregate (ProductQuerySet.summary)
+class ProductSummarySerializer(serializers.Serializer):
+    count = serializers.IntegerField()
+    max_price = serializers.FloatField()
+    min_price = serializers.FloatField()
+    avg_price = serializers.FloatField()
+
 
 # heredamos de Serializer en lugar de ModelSerializer
-class ProductInfoSerializer(serializers.Serializer):
+# ProductInfoAPIView no lo usa para generar la respuesta, que se envía por partes, pero describe su formato
+class ProductInfoSerializer(ProductSummarySerializer):
     products = ProductSerializer(many=True)
-    count = serializers.IntegerField()
-    max_price = serializers.FloatField()
\ No newline at end of file
+
+# serialización rápida de los listados en JSON (FAST_SERIALIZATION)
+# arma los mismos dicts que ProductSerializer y OrderSerializer desde filas de .values(), sin crear instancias de los
+# modelos ni recorrer los fields del serializer por cada fila; cualquier cambio en los fields de esos serializers
+# tiene que repetirse acá, los tests comparan las dos respuestas byte a byte
+# las filas tienen las columnas de field_columns, cada función recibe la fila y devuelve el valor del field
+CENTS = Decimal('0.01')
+
+
+# igual que DecimalField(decimal_places=2).to_representation
+def decimal_string(value):
+    return f'{value.quantize(CENTS):f}'
+
+
+# igual que DateTimeField.to_representation con el formato ISO 8601 por defecto
+def datetime_string(value):
+    value = timezone.localtime(value).isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+PRODUCT_FIELDS = {
+    'description': itemgetter('description'),
+    'name': itemgetter('name'),
+    'price': lambda row: decimal_string(row['price']),
+    'stock': itemgetter('stock'),
+    'thumbnails': lambda row: thumbnail_urls(row['image_hash']),
+}
+ORDER_ITEM_FIELDS = {
+    'product_name': itemgetter('product__name'),
+    'product_price': lambda row: decimal_string(row['unit_price']),
+    'quantity': itemgetter('quantity'),
+    # como item_subtotal, un Decimal que el renderer convierte a número
+    'item_subtotal': lambda row: row['unit_price'] * row['quantity'],
+}
+ORDER_FIELDS = {
+    'order_id': lambda row: str(row['order_id']),
+    'created_at': lambda row: datetime_string(row['created_at']),
+    'user': itemgetter('user_id'),
+    'status': itemgetter('status'),
+    # fast_orders agrega los items a cada fila
+    'items': itemgetter('items'),
+    'total_price': lambda row: row['total_price'] or 0,
+    'item_count': itemgetter('item_count'),
+}
+
+
+# las funciones de los fields pedidos (todos con fields=None) en el orden del serializer
+def field_getters(getters, fields=None):
+    return [(name, get) for name, get in getters.items() if fields is None or name in fields]
+
+
+def fast_products(rows, fields=None):
+    getters = field_getters(PRODUCT_FIELDS, fields)
+    return [{name: get(row) for name, get in getters} for row in rows]
+
+
+# los items de las ordenes de rows en una sola query con el JOIN a product (en lugar de los dos prefetch),
+# en el mismo orden que el prefetch de items; None si no se pidieron los items
+# las filas de las ordenes tienen pk además de las columnas de sus fields
+def order_items(rows, fields=None):
+    if not rows or (fields is not None and 'items' not in fields):
+        return None
+    item_fields = None if fields is None else fields['items']
+    return OrderItem.objects.filter(order_id__in=[row['pk'] for row in rows]).order_by('pk').values(
+        'order_id', *OrderItemSerializer.get_columns(item_fields)
+    )
+
+
+# item_rows: las filas de order_items ya leídas (las views async las leen con el ORM async)
+# los items se agrupan por orden en una pasada
+def fast_orders(rows, fields=None, item_rows=None):
+    rows = list(rows)
+    if item_rows is None:
+        item_rows = order_items(rows, fields)
+    if item_rows is not None:
+        item_getters = field_getters(ORDER_ITEM_FIELDS, None if fields is None else fields['items'])
+        items = {}
+        for item in item_rows:
+            items.setdefault(item['order_id'], []).append({name: get(item) for name, get in item_getters})
+        for row in rows:
+            row['items'] = items.get(row['pk'], [])
+    getters = field_getters(ORDER_FIELDS, fields)
+    return [{name: get(row) for name, get in getters} for row in rows]
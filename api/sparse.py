@@ -0,0 +1,95 @@
+from django.db.models import Prefetch
+from rest_framework.exceptions import ValidationError
+
+
+# ?fields=name,price o ?fields=order_id,items.quantity: la respuesta solo tiene esos fields
+# y el SELECT solo trae las columnas que necesitan (only() en las instancias, values() en la serialización rápida)
+
+# fields pedidos: {field: None} para el field completo, {field: [fields del serializer anidado]} para items.quantity
+class SparseFieldsSerializerMixin:
+    # columnas de la DB que usa cada field, con la sintaxis de only() / values() (product__name)
+    field_columns = {}
+    # fields con un serializer anidado, se traen con un Prefetch de la relación del mismo nombre
+    nested_fields = {}
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is None:
+            return
+        for name in set(self.fields) - set(fields):
+            self.fields.pop(name)
+        for name, subfields in fields.items():
+            if subfields is not None:
+                child = self.fields[name].child
+                for subname in set(child.fields) - set(subfields):
+                    child.fields.pop(subname)
+
+    @classmethod
+    def get_columns(cls, fields=None):
+        names = cls.field_columns if fields is None else fields
+        return list(dict.fromkeys(column for name in names for column in cls.field_columns[name]))
+
+
+class SparseFieldsMixin:
+    fields_param = 'fields'
+    # acciones de los viewsets que aceptan fields, las views genéricas no tienen action
+    sparse_actions = (None, 'list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.sparse_fields = self.get_sparse_fields(request)
+
+    def get_sparse_fields(self, request):
+        value = request.query_params.get(self.fields_param)
+        if not value or request.method != 'GET' or getattr(self, 'action', None) not in self.sparse_actions:
+            return None
+        serializer_class = self.get_serializer_class()
+        fields = {}
+        unknown = []
+        for part in filter(None, (part.strip() for part in value.split(','))):
+            name, _, subname = part.partition('.')
+            nested = serializer_class.nested_fields.get(name)
+            if name not in serializer_class.field_columns or subname and (
+                    nested is None or subname not in nested.field_columns):
+                unknown.append(part)
+            elif not subname:
+                fields[name] = None
+            elif fields.get(name, []) is not None:
+                fields.setdefault(name, []).append(subname)
+        if unknown:
+            raise ValidationError({self.fields_param: [f'Campo desconocido: {name}' for name in unknown]})
+        return fields or None
+
+    # columnas que lee la paginación para armar los cursores, se traen aunque no se pidan
+    def get_sparse_columns(self, serializer_class, fields):
+        return list(dict.fromkeys([*serializer_class.get_columns(fields), *getattr(self, 'ordering_fields', [])]))
+
+    @staticmethod
+    def narrow(queryset, columns):
+        # only() con las relaciones de product__name en select_related
+        related = list(dict.fromkeys(column.split('__')[0] for column in columns if '__' in column))
+        if related:
+            queryset = queryset.select_related(*related)
+        return queryset.only(*columns, *related)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = getattr(self, 'sparse_fields', None)
+        if fields is None:
+            return queryset
+        serializer_class = self.get_serializer_class()
+        queryset = self.narrow(queryset, self.get_sparse_columns(serializer_class, fields)).prefetch_related(None)
+        for name, nested in serializer_class.nested_fields.items():
+            if name in fields:
+                # la FK hacia el modelo de la view, el prefetch la usa para repartir las filas
+                related_field = queryset.model._meta.get_field(name).field.name
+                columns = [related_field, *nested.get_columns(fields[name])]
+                queryset = queryset.prefetch_related(Prefetch(name, self.narrow(nested.Meta.model.objects.all(), columns)))
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        fields = getattr(self, 'sparse_fields', None)
+        # la API navegable pide el serializer del formulario con el método POST
+        if fields is not None and self.request.method == 'GET':
+            kwargs.setdefault('fields', fields)
+        return super().get_serializer(*args, **kwargs)
@@ -1,9 +1,45 @@
-from django.test import TestCase
-from .models import Order, User
+import csv
+import datetime
+import json
+import os
+import tempfile
+import threading
+from decimal import Decimal
+from io import StringIO
+from unittest import skipUnless
+from urllib.parse import parse_qs, urlparse
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from .models import Order, OrderItem, Product, User
+from .querybudget import QueryBudgetTestMixin
 # reverse la utilizamos para hacer llamados a las path de las urls desde el test
 from django.urls import reverse
 from rest_framework import status
 
+# el perfilado por muestreo queda activo en los tests, lo que registre va a un directorio temporal
+profiling_dir = tempfile.TemporaryDirectory()
+profiling_settings = override_settings(
+    PROFILING={**settings.PROFILING, 'PATH': os.path.join(profiling_dir.name, 'profile-tests.jsonl')}
+)
+
+
+def setUpModule():
+    profiling_settings.enable()
+
+
+def tearDownModule():
+    from api.profiling import aggregator
+    aggregator.take()
+    profiling_settings.disable()
+    profiling_dir.cleanup()
+
+
 # TestCase: clase desde la cual vamos a configurar el test
 class UserOrderTestClass(TestCase):
     # setUp: configuramos las variables que van a generarse en el test para poder realizarlo
@@ -22,18 +58,1820 @@ class UserOrderTestClass(TestCase):
         # client.force_login: en clases que heredan de TestCase tenemos el objeto client
         # client tiene métodos como force_login que permiten tratar de hacer login con el user que le pasamos
         self.client.force_login(user)
-        # hacemos un llamado a la api en el path con name user-orders y la respuesta se guarda en response
-        response = self.client.get(reverse('user-orders'))
+        # hacemos un llamado a la api en el path con name order-list y la respuesta se guarda en response
+        # (user-orders ya no existe, el listado de OrderViewSet devuelve solo las ordenes del usuario logueado)
+        response = self.client.get(reverse('order-list'))
         # si response.status_code == 200 da false muestra el error y termina la ejecución
         # si da true sigue con la siguiente línea
         assert response.status_code == status.HTTP_200_OK
-        orders = response.json()
+        # el listado está paginado, las ordenes vienen en results
+        orders = response.json()['results']
+        self.assertEqual(len(orders), 2)
         # self.assertTrue: para que pasé el assert debe devolver true
         # all: todo lo que se evalúe en all tiene que ser true
         # order['user'] == user.id: para order compara el valor de user por el valor de id del user de arriba
         self.assertTrue(all(order['user'] == user.id for order in orders))
 
     def test_user_order_list_unauthenticated(self):
-        response = self.client.get(reverse('user-orders'))
+        response = self.client.get(reverse('order-list'))
         # Cambiamos 403 por 401 ya que la autenticación por JWT que estamos usando devuelve ese error
-        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class OrderTotalsTestClass(TestCase):
+    # generamos unas miles de ordenes con items para medir el listado de ordenes
+    @classmethod
+    def setUpTestData(cls):
+        from api.benchmarks import seed_orders
+        seed_orders(2000, items_per_order=3)
+        cls.admin = User.objects.create_superuser(username='admin', password='test')
+
+    def test_order_list_total_price_uses_constant_queries(self):
+        self.client.force_login(self.admin)
+        # session + user + MAX/COUNT del ETag + orders + items con sus productos (fast_orders)
+        # sin importar el tamaño de página
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('order-list'), {'page_size': 500})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['results']), 500)
+
+    def test_order_list_total_price_matches_items(self):
+        self.client.force_login(self.admin)
+        orders = self.client.get(reverse('order-list'), {'page_size': 500}).json()['results']
+        for order in orders:
+            expected = sum(float(item['item_subtotal']) for item in order['items'])
+            self.assertAlmostEqual(order['total_price'], expected, places=2)
+            self.assertEqual(order['item_count'], len(order['items']))
+
+    def test_annotated_and_stored_totals_use_one_query(self):
+        from api.benchmarks import SCENARIOS
+        # los tiempos se comparan con `manage.py benchmark order_totals`, acá solo contamos las queries
+        rows = {row['case']: row for row in SCENARIOS['order_totals'](scale=200)}
+        self.assertEqual(rows['annotated']['queries'], 1)
+        self.assertEqual(rows['stored']['queries'], 1)
+        self.assertEqual(rows['python']['vs_python'], 1.0)
+
+
+class OrderStoredTotalsTestClass(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='admin', password='test')
+        self.tv = Product.objects.create(name='TV', description='tv', price=Decimal('300.00'), stock=10)
+        self.radio = Product.objects.create(name='Radio', description='radio', price=Decimal('25.50'), stock=10)
+        self.client.force_login(self.user)
+
+    def create_order(self, items):
+        response = self.client.post(reverse('order-list'), {'status': 'Pending', 'items': items}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return Order.objects.get(pk=response.json()['order_id'])
+
+    def test_create_stores_totals(self):
+        order = self.create_order([{'product': self.tv.pk, 'quantity': 2}, {'product': self.radio.pk, 'quantity': 1}])
+        self.assertEqual(order.total_price, Decimal('625.50'))
+        self.assertEqual(order.item_count, 2)
+
+    def test_update_recalculates_totals(self):
+        order = self.create_order([{'product': self.tv.pk, 'quantity': 2}])
+        response = self.client.put(
+            reverse('order-detail', args=[order.pk]),
+            {'status': 'Confirmed', 'items': [{'product': self.radio.pk, 'quantity': 4}]},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Decimal('102.00'))
+        self.assertEqual(order.item_count, 1)
+
+    def test_admin_inline_edit_recalculates_totals(self):
+        order = self.create_order([{'product': self.tv.pk, 'quantity': 1}])
+        item = order.items.get()
+        response = self.client.post(reverse('admin:api_order_change', args=[order.pk]), {
+            'order_id': order.pk,
+            'user': self.user.pk,
+            'status': 'Pending',
+            'items-TOTAL_FORMS': '2',
+            'items-INITIAL_FORMS': '1',
+            'items-MIN_NUM_FORMS': '0',
+            'items-MAX_NUM_FORMS': '1000',
+            'items-0-id': item.pk,
+            'items-0-order': order.pk,
+            'items-0-product': self.tv.pk,
+            'items-0-quantity': '3',
+            'items-1-order': order.pk,
+            'items-1-product': self.radio.pk,
+            'items-1-quantity': '2',
+        })
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Decimal('951.00'))
+        self.assertEqual(order.item_count, 2)
+
+    def test_price_change_keeps_order_prices(self):
+        order = self.create_order([{'product': self.tv.pk, 'quantity': 2}])
+        self.tv.price = Decimal('500.00')
+        self.tv.save()
+        data = self.client.get(reverse('order-detail', args=[order.pk])).json()
+        self.assertEqual(data['total_price'], 600.0)
+        self.assertEqual(data['items'][0]['product_price'], '300.00')
+        self.assertEqual(data['items'][0]['item_subtotal'], 600.0)
+        self.assertEqual(Order.objects.recalculate_totals(), (1, 0))
+
+        # al modificar la orden los items que ya estaban conservan su precio, los nuevos usan el actual
+        response = self.client.patch(reverse('order-detail', args=[order.pk]), {'items': [
+            {'product': self.tv.pk, 'quantity': 1}, {'product': self.radio.pk, 'quantity': 1},
+        ]}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Decimal('325.50'))
+        self.assertEqual(Order.objects.recalculate_totals(), (1, 0))
+
+    def test_create_inserts_items_in_one_batch(self):
+        products = Product.objects.bulk_create(
+            Product(name=f'P{i}', description='p', price=Decimal('1.00'), stock=1) for i in range(50)
+        )
+        items = [{'product': product.pk, 'quantity': 1} for product in products]
+        # session + user + IN de productos + savepoint + UPDATE de stock en su savepoint (3) + INSERT de la orden
+        # + INSERT de los items + release + items de la respuesta + get de create_order, sin importar la cantidad de items
+        with self.assertNumQueries(12):
+            order = self.create_order(items)
+        self.assertEqual(order.items.count(), 50)
+        self.assertEqual(order.total_price, Decimal('50.00'))
+
+    def test_create_rejects_unknown_products(self):
+        response = self.client.post(reverse('order-list'), {
+            'status': 'Pending',
+            'items': [{'product': self.tv.pk, 'quantity': 1}, {'product': 999, 'quantity': 1}]
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'items': [{}, {'product': ['Invalid pk "999" - object does not exist.']}]})
+        self.assertFalse(Order.objects.exists())
+
+    def test_update_only_touches_changed_items(self):
+        order = self.create_order([{'product': self.tv.pk, 'quantity': 1}, {'product': self.radio.pk, 'quantity': 1}])
+        tv_item = order.items.get(product=self.tv)
+        radio_item = order.items.get(product=self.radio)
+        response = self.client.put(
+            reverse('order-detail', args=[order.pk]),
+            {'status': 'Pending', 'items': [{'product': self.tv.pk, 'quantity': 1}, {'product': self.radio.pk, 'quantity': 3}]},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # los items conservan su id, solo cambia la cantidad del que se modificó
+        self.assertEqual(
+            set(order.items.values_list('pk', 'quantity')),
+            {(tv_item.pk, 1), (radio_item.pk, 3)}
+        )
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Decimal('376.50'))
+
+    def test_update_adds_and_removes_items(self):
+        order = self.create_order([{'product': self.tv.pk, 'quantity': 1}])
+        camera = Product.objects.create(name='Camera', description='camera', price=Decimal('10.00'), stock=1)
+        response = self.client.put(
+            reverse('order-detail', args=[order.pk]),
+            {'status': 'Pending', 'items': [{'product': self.radio.pk, 'quantity': 2}, {'product': camera.pk, 'quantity': 1}]},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            set(order.items.values_list('product_id', 'quantity')),
+            {(self.radio.pk, 2), (camera.pk, 1)}
+        )
+        order.refresh_from_db()
+        self.assertEqual(order.item_count, 2)
+        self.assertEqual(order.total_price, Decimal('61.00'))
+
+    def test_partial_update_without_items_keeps_items(self):
+        order = self.create_order([{'product': self.tv.pk, 'quantity': 2}])
+        response = self.client.patch(
+            reverse('order-detail', args=[order.pk]), {'status': 'Confirmed'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.StatusChoices.CONFIRMED)
+        self.assertEqual(order.items.count(), 1)
+        self.assertEqual(order.total_price, Decimal('600.00'))
+
+    def test_repeated_products_are_merged(self):
+        order = self.create_order([{'product': self.tv.pk, 'quantity': 1}, {'product': self.tv.pk, 'quantity': 2}])
+        self.assertEqual(list(order.items.values_list('product_id', 'quantity')), [(self.tv.pk, 3)])
+        self.assertEqual(order.item_count, 1)
+
+    def test_recalculate_command_repairs_drift(self):
+        order = self.create_order([{'product': self.tv.pk, 'quantity': 1}])
+        Order.objects.filter(pk=order.pk).update(total_price=Decimal('1.00'), item_count=7)
+        out = StringIO()
+        with self.assertRaises(SystemExit):
+            call_command('recalculate_order_totals', '--verify', stdout=out)
+        self.assertIn('found 1', out.getvalue())
+        call_command('recalculate_order_totals', '--batch-size', '1', stdout=out)
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Decimal('300.00'))
+        self.assertEqual(order.item_count, 1)
+
+
+class OrderStockTestClass(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='test')
+        self.tv = Product.objects.create(name='TV', description='tv', price=Decimal('300.00'), stock=5)
+        self.radio = Product.objects.create(name='Radio', description='radio', price=Decimal('25.50'), stock=2)
+        self.client.force_login(self.user)
+
+    def post_order(self, items, order_status='Pending'):
+        return self.client.post(reverse('order-list'), {'status': order_status, 'items': items}, content_type='application/json')
+
+    def assertStock(self, tv, radio):
+        self.tv.refresh_from_db()
+        self.radio.refresh_from_db()
+        self.assertEqual((self.tv.stock, self.radio.stock), (tv, radio))
+
+    def test_create_reserves_stock(self):
+        response = self.post_order([{'product': self.tv.pk, 'quantity': 2}, {'product': self.radio.pk, 'quantity': 2}])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertStock(3, 0)
+
+    def test_create_fails_when_any_line_is_short(self):
+        response = self.post_order([{'product': self.tv.pk, 'quantity': 2}, {'product': self.radio.pk, 'quantity': 3}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'items': [{}, {'quantity': ['No hay stock suficiente']}]})
+        # no se reservó stock de ninguna línea ni se creó la orden
+        self.assertStock(5, 2)
+        self.assertFalse(Order.objects.exists())
+
+    def test_update_reserves_only_the_difference(self):
+        order_id = self.post_order([{'product': self.tv.pk, 'quantity': 2}]).json()['order_id']
+        response = self.client.put(
+            reverse('order-detail', args=[order_id]),
+            {'status': 'Pending', 'items': [{'product': self.tv.pk, 'quantity': 4}, {'product': self.radio.pk, 'quantity': 1}]},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertStock(1, 1)
+
+    def test_cancel_releases_and_reactivate_reserves_stock(self):
+        order_id = self.post_order([{'product': self.tv.pk, 'quantity': 2}]).json()['order_id']
+        url = reverse('order-detail', args=[order_id])
+        self.client.patch(url, {'status': 'Cancelled'}, content_type='application/json')
+        self.assertStock(5, 2)
+        # cancelar dos veces no devuelve el stock dos veces
+        self.client.patch(url, {'status': 'Cancelled'}, content_type='application/json')
+        self.assertStock(5, 2)
+        self.client.patch(url, {'status': 'Pending'}, content_type='application/json')
+        self.assertStock(3, 2)
+
+    def test_destroy_releases_stock(self):
+        order_id = self.post_order([{'product': self.tv.pk, 'quantity': 2}]).json()['order_id']
+        response = self.client.delete(reverse('order-detail', args=[order_id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertStock(5, 2)
+
+    # el formulario de cambio del admin con la orden y sus items [(item, producto, cantidad)]
+    def post_admin(self, order, order_status, items):
+        data = {
+            'order_id': order.pk,
+            'user': self.user.pk,
+            'status': order_status,
+            'items-TOTAL_FORMS': str(len(items)),
+            'items-INITIAL_FORMS': str(sum(item is not None for item, _, _ in items)),
+            'items-MIN_NUM_FORMS': '0',
+            'items-MAX_NUM_FORMS': '1000',
+        }
+        for index, (item, product, quantity) in enumerate(items):
+            data.update({
+                f'items-{index}-id': item.pk if item else '',
+                f'items-{index}-order': order.pk,
+                f'items-{index}-product': product.pk,
+                f'items-{index}-quantity': str(quantity),
+            })
+        return self.client.post(reverse('admin:api_order_change', args=[order.pk]), data)
+
+    def test_admin_changes_reserve_and_release_stock(self):
+        order = Order.objects.get(pk=self.post_order([{'product': self.tv.pk, 'quantity': 2}]).json()['order_id'])
+        item = order.items.get()
+        self.client.force_login(User.objects.create_superuser(username='admin', password='test'))
+
+        response = self.post_admin(order, 'Pending', [(item, self.tv, 3), (None, self.radio, 1)])
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertStock(2, 1)
+        response = self.post_admin(order, 'Cancelled', [(item, self.tv, 3), (order.items.get(product=self.radio), self.radio, 1)])
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertStock(5, 2)
+
+        # sin stock suficiente el formulario muestra el error y no se guarda nada
+        response = self.post_admin(order, 'Pending', [(item, self.tv, 6)])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, 'No hay stock suficiente para: TV')
+        self.assertStock(5, 2)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'Cancelled')
+
+        # el item de radio que no se envía sigue en la orden y también vuelve a reservar su stock
+        self.post_admin(order, 'Confirmed', [(item, self.tv, 3)])
+        self.assertStock(2, 1)
+        response = self.client.post(reverse('admin:api_order_delete', args=[order.pk]), {'post': 'yes'})
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertStock(5, 2)
+        self.assertFalse(Order.objects.exists())
+
+    def test_admin_bulk_delete_releases_stock(self):
+        for _ in range(2):
+            self.post_order([{'product': self.tv.pk, 'quantity': 2}, {'product': self.radio.pk, 'quantity': 1}])
+        self.client.force_login(User.objects.create_superuser(username='admin', password='test'))
+        response = self.client.post(reverse('admin:api_order_changelist'), {
+            'action': 'delete_selected', 'post': 'yes', '_selected_action': list(Order.objects.values_list('pk', flat=True)),
+        })
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertStock(5, 2)
+        self.assertFalse(Order.objects.exists())
+
+
+class OrderStockContentionTestClass(TransactionTestCase):
+    # fuera de una transacción las lecturas de productos y ordenes van a la réplica (api.routers)
+    databases = '__all__'
+
+    # varios hilos crean ordenes al mismo tiempo sobre el mismo producto
+    def test_concurrent_orders_never_oversell(self):
+        from api.benchmarks import run_concurrent_orders
+        user = User.objects.create_user(username='user1', password='test')
+        product = Product.objects.create(name='TV', description='tv', price=Decimal('300.00'), stock=20)
+        result = run_concurrent_orders(user, [product.pk], threads=8, orders_per_thread=5, quantity=1)
+        product.refresh_from_db()
+        self.assertGreaterEqual(product.stock, 0)
+        self.assertEqual(result['created'], 20)
+        self.assertEqual(result['rejected'], 20)
+        self.assertEqual(product.stock, 20 - result['created'])
+        self.assertEqual(OrderItem.objects.count(), result['created'])
+
+    # cada request en su hilo, todas arrancan juntas; devuelve los status code en el orden de requests
+    def run_concurrently(self, user, requests):
+        from django.db import connections
+        from django.test import Client
+
+        barrier = threading.Barrier(len(requests))
+        results = [None] * len(requests)
+
+        def worker(index, client, method, url, data):
+            try:
+                barrier.wait()
+                while True:
+                    try:
+                        response = getattr(client, method)(url, data, content_type='application/json')
+                        break
+                    except OperationalError:
+                        # database is locked fuera del perfil production, se reintenta
+                        continue
+                results[index] = response.status_code
+            finally:
+                connections.close_all()
+
+        threads = []
+        for index, (method, url, data) in enumerate(requests):
+            client = Client()
+            client.force_login(user)
+            threads.append(threading.Thread(target=worker, args=(index, client, method, url, data)))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def create_order(self, user, product, quantity):
+        from django.test import Client
+        client = Client()
+        client.force_login(user)
+        response = client.post(reverse('order-list'), {
+            'status': 'Pending', 'items': [{'product': product.pk, 'quantity': quantity}]
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return reverse('order-detail', args=[response.json()['order_id']])
+
+    # la orden se vuelve a leer dentro de la transacción, el stock se libera una sola vez
+    def test_concurrent_cancel_and_destroy_release_stock_once(self):
+        user = User.objects.create_user(username='user1', password='test')
+        product = Product.objects.create(name='TV', description='tv', price=Decimal('300.00'), stock=10)
+        url = self.create_order(user, product, 5)
+        results = self.run_concurrently(user, [('patch', url, {'status': 'Cancelled'})] * 6)
+        self.assertEqual(results, [status.HTTP_200_OK] * 6)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 10)
+
+        url = self.create_order(user, product, 5)
+        results = self.run_concurrently(user, [('delete', url, None)] + [('patch', url, {'status': 'Cancelled'})] * 3)
+        self.assertEqual(results[0], status.HTTP_204_NO_CONTENT)
+        self.assertLessEqual(set(results[1:]), {status.HTTP_200_OK, status.HTTP_404_NOT_FOUND})
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 10)
+
+    def test_concurrent_item_updates_keep_stock_consistent(self):
+        user = User.objects.create_user(username='user1', password='test')
+        product = Product.objects.create(name='TV', description='tv', price=Decimal('300.00'), stock=10)
+        url = self.create_order(user, product, 1)
+        results = self.run_concurrently(user, [
+            ('put', url, {'status': 'Pending', 'items': [{'product': product.pk, 'quantity': quantity}]})
+            for quantity in (2, 3, 4, 5)
+        ])
+        self.assertEqual(results, [status.HTTP_200_OK] * 4)
+        item = OrderItem.objects.get()
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 10 - item.quantity)
+
+
+class KeysetPaginationTestClass(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # precios repetidos para comprobar que el desempate por pk no pierde ni repite productos
+        Product.objects.bulk_create(
+            Product(name=f'Product {i:02}', description='p', price=Decimal(i % 4), stock=1 + i % 3)
+            for i in range(23)
+        )
+
+    def walk(self, url, params=None):
+        pages = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append(response.json())
+            if not pages[-1]['next']:
+                return pages
+            response = self.client.get(pages[-1]['next'])
+
+    def test_pages_cover_every_product_for_each_ordering(self):
+        expected = sorted(Product.objects.values_list('name', flat=True))
+        for ordering in ('pk', 'price', '-price', 'stock', '-stock', 'name', '-name'):
+            pages = self.walk(reverse('product-list'), {'ordering': ordering})
+            names = [product['name'] for page in pages for product in page['results']]
+            self.assertEqual(len(names), len(expected), ordering)
+            self.assertEqual(sorted(names), expected, ordering)
+            self.assertEqual(len(pages), 5)
+
+    def test_previous_link_returns_the_same_page(self):
+        first = self.client.get(reverse('product-list'), {'ordering': '-price'}).json()
+        second = self.client.get(first['next']).json()
+        back = self.client.get(second['previous']).json()
+        self.assertEqual(back['results'], first['results'])
+        self.assertIsNone(back['previous'])
+
+    def test_no_count_query(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('product-list'), {'ordering': 'price'})
+        self.assertNotIn('count', response.json())
+        self.assertFalse(any('COUNT(' in query['sql'] for query in ctx.captured_queries))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('product-list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        # un cursor generado con otro ordering no se puede usar
+        cursor = parse_qs(urlparse(self.client.get(reverse('product-list')).json()['next']).query)['cursor'][0]
+        response = self.client.get(reverse('product-list'), {'cursor': cursor, 'ordering': 'price'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_order_pages_are_scoped_to_user(self):
+        user = User.objects.create_user(username='user1', password='test')
+        other = User.objects.create_user(username='user2', password='test')
+        Order.objects.bulk_create([Order(user=user) for _ in range(7)] + [Order(user=other) for _ in range(3)])
+        self.client.force_login(user)
+        pages = self.walk(reverse('order-list'), {'page_size': 3, 'ordering': 'created_at'})
+        orders = [order for page in pages for order in page['results']]
+        self.assertEqual(len(orders), 7)
+        self.assertEqual(len({order['order_id'] for order in orders}), 7)
+        self.assertTrue(all(order['user'] == user.id for order in orders))
+
+
+class CatalogCacheTestClass(TestCase):
+    def setUp(self):
+        caches['catalog'].clear()
+        self.tv = Product.objects.create(name='TV', description='tv', price=Decimal('300.00'), stock=5)
+        self.admin = User.objects.create_superuser(username='admin', password='test')
+
+    def test_second_get_is_served_from_cache(self):
+        url = reverse('product-list')
+        self.assertEqual(self.client.get(url, {'ordering': 'price', 'number': 2})['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            # el orden de los parámetros no cambia la key
+            response = self.client.get(f'{url}?number=2&ordering=price')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.json()['results'][0]['name'], 'TV')
+
+    def test_product_writes_invalidate_cached_responses(self):
+        # /products/info/ se envía por partes y no se guarda entera, usamos el resumen
+        url = reverse('product-summary')
+        self.client.get(url)
+        Product.objects.bulk_create([Product(name='Radio', description='radio', price=Decimal('25.50'), stock=2)])
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['count'], 2)
+
+        self.client.force_login(self.admin)
+        self.client.patch(reverse('product-detail', args=[self.tv.pk]), {'stock': 9}, content_type='application/json')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+
+    def test_stock_reservation_invalidates_cached_responses(self):
+        url = reverse('product-detail', args=[self.tv.pk])
+        self.client.get(url)
+        self.client.force_login(self.admin)
+        self.client.post(reverse('order-list'), {'items': [{'product': self.tv.pk, 'quantity': 2}]}, content_type='application/json')
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['stock'], 3)
+
+    def test_hit_and_miss_counters(self):
+        from api.cache import get_stats
+        before = get_stats()
+        for _ in range(3):
+            self.client.get(reverse('product-list'))
+        after = get_stats()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 2)
+
+
+@override_settings(PRODUCT_INFO_CHUNK_SIZE=2)
+class ProductInfoTestClass(TestCase):
+    def setUp(self):
+        caches['catalog'].clear()
+        Product.objects.bulk_create(
+            Product(name=f'Product {i}', description='p', price=Decimal(price), stock=1)
+            for i, price in enumerate(['10.00', '20.00', '30.00', '40.00', '50.50'])
+        )
+
+    def get_info(self):
+        response = self.client.get(reverse('product-info'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return json.loads(b''.join(response.streaming_content))
+
+    def test_streams_every_product_with_summary(self):
+        data = self.get_info()
+        self.assertEqual(data['count'], 5)
+        self.assertEqual(data['max_price'], 50.5)
+        self.assertEqual(data['min_price'], 10.0)
+        self.assertAlmostEqual(data['avg_price'], 30.1)
+        self.assertEqual([product['name'] for product in data['products']], [f'Product {i}' for i in range(5)])
+
+    def test_summary_is_one_query_and_cached(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.get_info()
+        aggregates = [q['sql'] for q in ctx.captured_queries if 'COUNT(' in q['sql']]
+        self.assertEqual(len(aggregates), 1)
+        self.assertIn('MAX("api_product"."price")', aggregates[0])
+        # lotes de 2, 2 y 1 productos
+        self.assertEqual(len([q for q in ctx.captured_queries if 'LIMIT 2' in q['sql']]), 3)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('product-summary'))
+        self.assertFalse(any('COUNT(' in q['sql'] for q in ctx.captured_queries))
+
+    def test_empty_catalog(self):
+        Product.objects.all().delete()
+        data = self.get_info()
+        self.assertEqual(data, {'count': 0, 'max_price': None, 'min_price': None, 'avg_price': None, 'products': []})
+
+
+@override_settings(ORDER_EXPORT_CHUNK_SIZE=2)
+class OrderExportTestClass(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='test')
+        other = User.objects.create_user(username='user2', password='test')
+        self.tv = Product.objects.create(name='TV', description='tv', price=Decimal('300.00'), stock=50)
+        self.radio = Product.objects.create(name='Radio', description='radio', price=Decimal('25.50'), stock=50)
+        for user, order_status in ((self.user, 'Pending'), (self.user, 'Confirmed'), (self.user, 'Pending'), (other, 'Pending')):
+            order = Order.objects.create(user=user, status=order_status)
+            OrderItem.objects.create(order=order, product=self.tv, quantity=1)
+            OrderItem.objects.create(order=order, product=self.radio, quantity=2)
+            order.recalculate_totals()
+        Order.objects.create(user=self.user)
+        self.client.force_login(self.user)
+
+    def export(self, **params):
+        response = self.client.get(reverse('order-export'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_ndjson_is_scoped_and_filtered(self):
+        response, content = self.export()
+        self.assertTrue(response['Content-Type'].startswith('application/x-ndjson'))
+        orders = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(len(orders), 4)
+        self.assertTrue(all(order['user'] == self.user.id for order in orders))
+        with_items = [order for order in orders if order['items']]
+        self.assertTrue(all(order['total_price'] == 351.0 for order in with_items))
+
+        _, content = self.export(status='Confirmed')
+        self.assertEqual(len(content.splitlines()), 1)
+
+    def test_csv_has_one_row_per_item(self):
+        response, content = self.export(format='csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="orders.csv"')
+        rows = list(csv.DictReader(StringIO(content)))
+        # 3 ordenes con 2 items y una orden sin items
+        self.assertEqual(len(rows), 7)
+        self.assertEqual({row['product_name'] for row in rows}, {'TV', 'Radio', ''})
+
+    def test_prefetch_runs_per_chunk(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.export()
+        # 4 ordenes en lotes de 2: 2 prefetch de items y 2 de productos, sin consultas por orden
+        self.assertEqual(len([q for q in ctx.captured_queries if 'FROM "api_orderitem"' in q['sql']]), 2)
+        self.assertEqual(len([q for q in ctx.captured_queries if 'FROM "api_product"' in q['sql']]), 2)
+
+    def test_requires_authentication(self):
+        self.client.logout()
+        response = self.client.get(reverse('order-export'), {'format': 'csv'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(PRODUCT_IMPORT_BATCH_SIZE=2)
+class ProductImportTestClass(TestCase):
+    def setUp(self):
+        self.tv = Product.objects.create(name='TV', description='tv', price=Decimal('300.00'), stock=5)
+        self.admin = User.objects.create_superuser(username='admin', password='test')
+        self.client.force_login(self.admin)
+
+    def post(self, body, content_type):
+        return self.client.post(reverse('product-import'), body, content_type=content_type)
+
+    def test_ndjson_upserts_by_name_and_reports_bad_rows(self):
+        body = '\n'.join([
+            json.dumps({'name': 'TV', 'description': 'tv 4k', 'price': '350.00', 'stock': 7}),
+            json.dumps({'name': 'Radio', 'description': 'radio', 'price': '-1', 'stock': 2}),
+            '{no es json',
+            '',
+            json.dumps({'name': 'Radio', 'description': 'radio', 'price': '25.50', 'stock': 2}),
+            json.dumps({'name': 'Cable', 'description': 'cable', 'price': '5.00', 'stock': 9}),
+        ])
+        response = self.post(body, 'application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(data['imported'], 3)
+        self.assertEqual([error['row'] for error in data['errors']], [2, 3])
+        self.assertIn('price', data['errors'][0]['errors'])
+        self.tv.refresh_from_db()
+        self.assertEqual((self.tv.description, self.tv.price, self.tv.stock), ('tv 4k', Decimal('350.00'), 7))
+        self.assertEqual(Product.objects.count(), 3)
+
+    def test_csv_import_is_batched(self):
+        rows = ''.join(f'Product {i},desc,{i}.50,{i}\n' for i in range(5))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.post('\ufeffname,description,price,stock\n' + rows + 'Bad,desc,abc,1\n', 'text/csv')
+        self.assertEqual(response.json()['imported'], 5)
+        self.assertEqual(response.json()['errors'][0]['row'], 6)
+        # 5 productos en lotes de 2, un INSERT ... ON CONFLICT por lote
+        self.assertEqual(len([q for q in ctx.captured_queries if 'ON CONFLICT' in q['sql']]), 3)
+        self.assertEqual(Product.objects.get(name='Product 3').stock, 3)
+
+    def test_imported_products_are_searchable(self):
+        self.post(json.dumps({'name': 'Lámpara', 'description': 'lámpara de pie', 'price': '10', 'stock': 1}), 'application/x-ndjson')
+        self.post(json.dumps({'name': 'TV', 'description': 'televisor', 'price': '300', 'stock': 1}), 'application/x-ndjson')
+        caches['catalog'].clear()
+        names = [p['name'] for p in self.client.get(reverse('product-list'), {'search': 'lampara'}).json()['results']]
+        self.assertEqual(names, ['Lámpara'])
+        names = [p['name'] for p in self.client.get(reverse('product-list'), {'search': 'televisor'}).json()['results']]
+        self.assertEqual(names, ['TV'])
+
+    def test_admin_only_and_content_type(self):
+        self.assertEqual(self.post('{}', 'application/json').status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        # el charset no cambia el formato, solo se acepta UTF-8
+        body = 'name,description,price,stock\nRadio,radio,25.50,2\n'
+        response = self.post(body, 'text/csv; charset=utf-8')
+        self.assertEqual((response.status_code, response.json()['imported']), (status.HTTP_200_OK, 1))
+        response = self.post(json.dumps({'name': 'Cable', 'description': 'c', 'price': '1', 'stock': 1}),
+                             'application/x-ndjson; charset=UTF-8')
+        self.assertEqual((response.status_code, response.json()['imported']), (status.HTTP_200_OK, 1))
+        self.assertEqual(self.post(body, 'text/csv; charset=latin-1').status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        self.client.force_login(User.objects.create_user(username='user1', password='test'))
+        self.assertEqual(self.post('{}', 'application/x-ndjson').status_code, status.HTTP_403_FORBIDDEN)
+
+
+# TransactionTestCase: los workers paralelos escriben desde otros procesos con sus propias conexiones
+class PopulateDbTestClass(TransactionTestCase):
+    # fuera de una transacción las lecturas de productos y ordenes van a la réplica (api.routers)
+    databases = '__all__'
+
+    def populate(self, **options):
+        call_command('populate_db', products=30, users=4, orders=40, batch_size=8, stdout=StringIO(), **options)
+
+    def snapshot(self):
+        first_product = Product.objects.order_by('pk').first().pk
+        return (
+            list(Product.objects.order_by('pk').values_list('description', 'price', 'stock')),
+            list(Order.objects.order_by('order_id').values_list('order_id', 'status', 'total_price', 'item_count')),
+            sorted(
+                (str(order_id), product_id - first_product, quantity)
+                for order_id, product_id, quantity in OrderItem.objects.values_list('order_id', 'product_id', 'quantity')
+            ),
+        )
+
+    def reset(self):
+        Order.objects.all().delete()
+        Product.objects.all().delete()
+        User.objects.exclude(username='admin').delete()
+
+    def test_generates_requested_rows_with_consistent_totals(self):
+        self.populate(items_per_order='2-3', status_mix='Cancelled=1')
+        self.assertEqual(Product.objects.count(), 30)
+        self.assertEqual(User.objects.count(), 5)
+        self.assertEqual(Order.objects.count(), 40)
+        self.assertFalse(Order.objects.exclude(status='Cancelled').exists())
+        self.assertTrue(all(2 <= order.item_count <= 3 for order in Order.objects.all()))
+        # los totales guardados coinciden con los items
+        checked, drifted = Order.objects.recalculate_totals(dry_run=True)
+        self.assertEqual((checked, drifted), (40, 0))
+        # una segunda ejecución agrega filas nuevas sin chocar con las anteriores
+        self.populate()
+        self.assertEqual(Order.objects.count(), 80)
+
+    def test_generated_orders_reserve_stock(self):
+        from django.db.models import Sum
+        from api.datagen import GenerationPlan, product_supply
+        self.populate(seed=3)
+        plan = GenerationPlan(
+            seed=3, products=30, users=4, orders=40, min_items=1, max_items=5, status_mix=[], batch_size=8, days=0
+        )
+        first_product = Product.objects.order_by('pk').first().pk
+        reserved = dict(
+            OrderItem.objects.exclude(order__status='Cancelled').values_list('product_id').annotate(total=Sum('quantity'))
+        )
+        for product in Product.objects.all():
+            self.assertGreaterEqual(product.stock, 0)
+            # stock actual + lo que retienen las ordenes = stock inicial del producto
+            self.assertEqual(
+                product.stock + reserved.get(product.pk, 0), product_supply(plan, product.pk - first_product)
+            )
+
+    def test_orders_without_stock_are_cancelled(self):
+        from types import SimpleNamespace
+        from api.datagen import reserve_stock
+        user = User.objects.create_user(username='user1', password='test')
+        product = Product.objects.create(name='TV', description='tv', price=Decimal('1.00'), stock=3)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        orders = []
+        for days in (2, 1):
+            order = Order.objects.create(user=user)
+            Order.objects.filter(pk=order.pk).update(created_at=now - datetime.timedelta(days=days))
+            OrderItem.objects.create(order=order, product=product, quantity=2)
+            orders.append(order)
+        self.assertEqual(reserve_stock(SimpleNamespace(product_base=product.pk, batch_size=10)), 1)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 1)
+        # la más vieja retiene el stock, la más nueva ya no entra
+        self.assertEqual(
+            [Order.objects.get(pk=order.pk).status for order in orders], ['Pending', 'Cancelled']
+        )
+
+    def test_same_seed_same_data_with_any_number_of_workers(self):
+        self.populate(seed=7)
+        expected = self.snapshot()
+        self.reset()
+        self.populate(seed=7, workers=2)
+        self.assertEqual(self.snapshot(), expected)
+        self.reset()
+        self.populate(seed=8)
+        self.assertNotEqual(self.snapshot(), expected)
+
+
+class EndpointBenchmarkTestClass(TestCase):
+    def test_suite_measures_every_case(self):
+        from api.endpoint_benchmarks import CASES, run_suite
+        results = run_suite([20], repeat=3)
+        rows = results['scales']['20']
+        self.assertEqual(list(rows), [case[0] for case in CASES])
+        for name, metrics in rows.items():
+            with self.subTest(case=name):
+                self.assertTrue(all(code < 400 for code in metrics['statuses']))
+                self.assertGreater(metrics['queries'], 0)
+                self.assertLessEqual(metrics['p50_ms'], metrics['p95_ms'])
+                self.assertLessEqual(metrics['p95_ms'], metrics['p99_ms'])
+
+    def test_compare_against_baseline(self):
+        from api.endpoint_benchmarks import compare, percentile
+        self.assertEqual(percentile([5, 1, 4, 2, 3], 50), 3)
+        self.assertEqual(percentile(list(range(1, 101)), 95), 95)
+        baseline = {'scales': {'10': {'product-list': {'p95_ms': 10, 'queries': 2, 'peak_kb': 100, 'statuses': [200]}}}}
+        results = {'scales': {'10': {
+            'product-list': {'p95_ms': 11.5, 'queries': 2, 'peak_kb': 130, 'statuses': [200]},
+            'product-detail': {'p95_ms': 99, 'queries': 9, 'peak_kb': 1, 'statuses': [200]},
+        }}}
+        # la latencia entra en el margen, la memoria no, y los casos sin baseline no se comparan
+        self.assertEqual([row['metric'] for row in compare(results, baseline, 0.2)], ['peak_kb'])
+        results['scales']['10']['product-list']['queries'] = 3
+        results['scales']['10']['product-list']['statuses'] = [200, 500]
+        self.assertEqual(
+            [row['metric'] for row in compare(results, baseline, 0.5)], ['queries', 'statuses']
+        )
+
+
+class TrafficReplayTestClass(TransactionTestCase):
+    # fuera de una transacción las lecturas de productos y ordenes van a la réplica (api.routers)
+    databases = '__all__'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.path = os.path.join(self.directory, 'traffic.jsonl')
+        open(self.path, 'w').close()
+        self.user = User.objects.create_user(username='user1', password='test')
+        self.admin = User.objects.create_superuser(username='admin', password='test')
+        self.tv = Product.objects.create(name='TV', description='tv', price=Decimal('300.00'), stock=5)
+
+    def capture(self):
+        return override_settings(TRAFFIC_CAPTURE={**settings.TRAFFIC_CAPTURE, 'ENABLED': True, 'PATH': self.path})
+
+    def test_capture_sanitizes_and_records_identity(self):
+        with self.capture():
+            self.client.get(reverse('product-list'), {'price__gt': 10})
+            self.client.post(reverse('token_obtain_pair'), {'username': 'user1', 'password': 'test'})
+            self.client.force_login(self.user)
+            self.client.post(
+                reverse('order-list'), {'items': [{'product': self.tv.pk, 'quantity': 1}], 'password': 'secret'},
+                content_type='application/json'
+            )
+            token = self.client.post(reverse('token_obtain_pair'), {'username': 'admin', 'password': 'test'}).json()['access']
+            self.client.logout()
+            self.client.get(reverse('order-list'), HTTP_AUTHORIZATION=f'Bearer {token}')
+        from api.traffic import load_records
+        listing, create, jwt_listing = load_records(self.path)
+        self.assertEqual((listing['method'], listing['path'], listing['query']), ('GET', '/products/', 'price__gt=10'))
+        self.assertIsNone(listing['user'])
+        self.assertEqual((create['user'], create['status']), (self.user.pk, status.HTTP_201_CREATED))
+        self.assertEqual(json.loads(create['body'])['password'], '***')
+        # el usuario del JWT también se registra, pero no el token
+        self.assertEqual(jwt_listing['user'], self.admin.pk)
+        self.assertNotIn(token, open(self.path).read())
+
+    def test_replay_reports_latencies(self):
+        from api.traffic import TrafficCaptureMiddleware
+        # las requests se escriben como las guarda el middleware
+        writer = object.__new__(TrafficCaptureMiddleware)
+        writer.path = self.path
+        for record in (
+            {'method': 'GET', 'path': '/products/', 'query': '', 'body': None, 'content_type': None, 'user': None},
+            {'method': 'GET', 'path': f'/products/{self.tv.pk}/', 'query': '', 'body': None, 'content_type': None, 'user': None},
+            {'method': 'GET', 'path': '/orders/', 'query': '', 'body': None, 'content_type': None, 'user': self.user.pk},
+            {'method': 'POST', 'path': '/orders/', 'query': '', 'content_type': 'application/json',
+             'body': json.dumps({'items': [{'product': self.tv.pk, 'quantity': 1}]}), 'user': self.user.pk},
+        ):
+            writer.write(record)
+        output = os.path.join(self.directory, 'replay.json')
+        call_command('replay_traffic', self.path, concurrency=2, repeat=3, output=output, stdout=StringIO())
+        with open(output) as f:
+            summary = json.load(f)
+        # sin --include-writes el POST no se reproduce
+        self.assertEqual(summary['requests'], 9)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(summary['routes']['GET product-detail']['statuses'], {'200': 3})
+        # el usuario se autentica con un JWT emitido para la reproducción
+        self.assertEqual(summary['routes']['GET order-list']['statuses'], {'200': 3})
+        call_command('replay_traffic', self.path, include_writes=True, stdout=StringIO())
+        self.assertEqual(Order.objects.count(), 1)
+
+
+@override_settings(PROFILING_MODE='sampling')
+class SamplingProfilerTestClass(TestCase):
+    def setUp(self):
+        from api.profiling import aggregator
+        self.aggregator = aggregator
+        self.aggregator.take()
+        fd, self.path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+        self.tv = Product.objects.create(name='TV', description='tv', price=Decimal('300.00'), stock=5)
+
+    def profile(self, sample_rate, slow_ms=0):
+        return override_settings(PROFILING={
+            **settings.PROFILING, 'SAMPLE_RATE': sample_rate, 'SLOW_MS': slow_ms, 'PATH': self.path
+        })
+
+    def test_silk_is_not_installed_by_default(self):
+        self.assertNotIn('silk', settings.INSTALLED_APPS)
+        self.assertNotIn('silk.middleware.SilkyMiddleware', settings.MIDDLEWARE)
+        self.assertEqual(self.client.get('/silk/').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_sampled_requests_record_sql(self):
+        with self.profile(1.0):
+            for _ in range(3):
+                self.client.get(reverse('product-detail', args=[self.tv.pk]))
+            self.client.get(reverse('product-list'))
+            self.aggregator.flush()
+        rows = {row['view']: row for row in map(json.loads, open(self.path))}
+        detail = rows['GET product-detail']
+        self.assertEqual((detail['count'], detail['sampled'], detail['slow']), (3, 3, 0))
+        self.assertGreater(detail['sql_count'], 0)
+        self.assertGreaterEqual(detail['total_ms'], detail['max_ms'])
+        self.assertIn('GET product-list', rows)
+        # después del flush la ventana empieza vacía
+        self.assertEqual(self.aggregator.snapshot(), {})
+        out = StringIO()
+        call_command('profile_report', path=self.path, stdout=out)
+        self.assertIn('GET product-detail', out.getvalue())
+
+    def test_unsampled_requests_only_recorded_when_slow(self):
+        with self.profile(0.0, slow_ms=0.001):
+            self.client.get(reverse('product-detail', args=[self.tv.pk]))
+        row = self.aggregator.snapshot()['GET product-detail']
+        self.assertEqual((row['sampled'], row['slow'], row['sql_count']), (0, 1, 0))
+        self.aggregator.take()
+        # el client guarda los middlewares ya creados, uno nuevo lee la configuración
+        self.client = self.client_class()
+        with self.profile(0.0, slow_ms=60_000):
+            self.client.get(reverse('product-detail', args=[self.tv.pk]))
+        self.assertEqual(self.aggregator.snapshot(), {})
+
+    @override_settings(PROFILING_MODE='off')
+    def test_off_mode_skips_middleware(self):
+        with self.profile(1.0):
+            self.client.get(reverse('product-detail', args=[self.tv.pk]))
+        self.assertEqual(self.aggregator.snapshot(), {})
+
+
+class MetricsTestClass(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='test')
+        self.tv = Product.objects.create(name='TV', description='tv', price=Decimal('300.00'), stock=1)
+
+    def sample(self, name, **labels):
+        from prometheus_client import REGISTRY
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_requests_labelled_by_view_class_and_action(self):
+        before = self.sample('api_request_duration_seconds_count', view='ProductListCreateAPIView', method='GET', status='200')
+        queries = self.sample('api_request_db_queries_count', view='OrderViewSet.list')
+        self.client.get(reverse('product-list'))
+        self.client.force_login(self.user)
+        self.client.get(reverse('order-list'))
+        self.assertEqual(
+            self.sample('api_request_duration_seconds_count', view='ProductListCreateAPIView', method='GET', status='200'),
+            before + 1
+        )
+        self.assertEqual(self.sample('api_request_db_queries_count', view='OrderViewSet.list'), queries + 1)
+        self.assertGreater(self.sample('api_request_db_queries_sum', view='OrderViewSet.list'), 0)
+        self.assertGreater(self.sample('api_response_size_bytes_sum', view='OrderViewSet.list'), 0)
+
+    def test_order_create_throughput_and_failures(self):
+        created = self.sample('api_orders_created_total')
+        failed = self.sample('api_order_create_failures_total', reason='ValidationError')
+        self.client.force_login(self.user)
+        items = {'items': [{'product': self.tv.pk, 'quantity': 1}]}
+        self.client.post(reverse('order-list'), items, content_type='application/json')
+        # ya no queda stock
+        self.client.post(reverse('order-list'), items, content_type='application/json')
+        self.assertEqual(self.sample('api_orders_created_total'), created + 1)
+        self.assertEqual(self.sample('api_order_create_failures_total', reason='ValidationError'), failed + 1)
+
+    def test_cache_hits_and_metrics_endpoint(self):
+        caches['catalog'].clear()
+        hits = self.sample('api_cache_requests_total', cache='catalog', result='hit')
+        self.client.get(reverse('product-summary'))
+        self.client.get(reverse('product-summary'))
+        self.assertEqual(self.sample('api_cache_requests_total', cache='catalog', result='hit'), hits + 1)
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn(b'api_request_duration_seconds_bucket{', response.content)
+        # el scrape no se mide a sí mismo
+        self.assertNotIn(b'view="metrics_view"', response.content)
+
+    def test_metrics_endpoint_is_not_public(self):
+        remote = {'REMOTE_ADDR': '203.0.113.7'}
+        self.assertEqual(self.client.get('/metrics', **remote).status_code, status.HTTP_403_FORBIDDEN)
+        with override_settings(METRICS={**settings.METRICS, 'ALLOWED_IPS': ['203.0.113.0/24']}):
+            self.assertEqual(self.client.get('/metrics', **remote).status_code, status.HTTP_200_OK)
+        with override_settings(METRICS={**settings.METRICS, 'TOKEN': 'secret'}):
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong', **remote)
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret', **remote)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/metrics', **remote).status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_login(User.objects.create_superuser(username='admin', password='test'))
+        self.assertEqual(self.client.get('/metrics', **remote).status_code, status.HTTP_200_OK)
+
+    def test_multiprocess_directory_sums_workers(self):
+        import subprocess
+        import sys
+        from prometheus_client import CollectorRegistry, multiprocess
+        with tempfile.TemporaryDirectory() as directory:
+            script = 'import django; django.setup(); from api.metrics import ORDERS_CREATED; ORDERS_CREATED.inc(2)'
+            env = {**os.environ, 'PROMETHEUS_MULTIPROC_DIR': directory, 'DJANGO_SETTINGS_MODULE': 'backend.settings'}
+            for _ in range(2):
+                subprocess.run([sys.executable, '-c', script], env=env, check=True, cwd=settings.BASE_DIR)
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry, path=directory)
+            self.assertEqual(registry.get_sample_value('api_orders_created_total'), 4)
+
+
+# todas las rutas se mantienen dentro del query_budget de su view y sin queries repetidas (N+1)
+# con varias ordenes e items, así un N+1 se ve como formas de query repetidas
+@override_settings(CATALOG_CACHE={**settings.CATALOG_CACHE, 'ENABLED': False})
+class QueryBudgetTestClass(QueryBudgetTestMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='test')
+        self.admin = User.objects.create_superuser(username='admin', password='test')
+        self.products = Product.objects.bulk_create(
+            Product(name=f'P{i}', description='producto', price=Decimal('10.00'), stock=100) for i in range(10)
+        )
+        self.client.force_login(self.user)
+        for i in range(4):
+            self.client.post(reverse('order-list'), self.items(i, 4), content_type='application/json')
+        self.order = Order.objects.filter(user=self.user).first()
+
+    def items(self, start, count, quantity=1):
+        return {'items': [{'product': p.pk, 'quantity': quantity} for p in self.products[start:start + count]]}
+
+    def test_product_routes(self):
+        for user in (None, self.user):
+            self.client.logout()
+            if user is not None:
+                self.client.force_login(user)
+            self.assertWithinQueryBudget('get', reverse('product-list'))
+            self.assertWithinQueryBudget('get', reverse('product-list'), {'search': 'producto', 'ordering': 'price'})
+            self.assertWithinQueryBudget('get', reverse('product-detail', args=[self.products[0].pk]))
+            self.assertWithinQueryBudget('get', reverse('product-info'))
+            self.assertWithinQueryBudget('get', reverse('product-summary'))
+        self.client.force_login(self.admin)
+        product = {'name': 'Nuevo', 'description': 'd', 'price': '1.00', 'stock': 1}
+        self.assertWithinQueryBudget('post', reverse('product-list'), product, content_type='application/json')
+        url = reverse('product-detail', args=[self.products[9].pk])
+        self.assertWithinQueryBudget('put', url, product | {'name': 'Otro'}, content_type='application/json')
+        self.assertWithinQueryBudget('patch', url, {'stock': 3}, content_type='application/json')
+        self.assertWithinQueryBudget('delete', url)
+        rows = ''.join(json.dumps(product | {'name': f'Import {i}'}) + '\n' for i in range(20))
+        self.assertWithinQueryBudget('post', reverse('product-import'), rows, content_type='application/x-ndjson')
+
+    def test_order_routes(self):
+        for user in (self.user, self.admin):
+            self.client.force_login(user)
+            self.assertWithinQueryBudget('get', reverse('order-list'))
+            self.assertWithinQueryBudget('get', reverse('order-detail', args=[self.order.pk]))
+        self.assertWithinQueryBudget('get', reverse('order-export'))
+        self.assertWithinQueryBudget('get', reverse('order-export'), {'format': 'csv'})
+        self.client.force_login(self.user)
+        self.assertWithinQueryBudget('post', reverse('order-list'), self.items(2, 5), content_type='application/json')
+        url = reverse('order-detail', args=[self.order.pk])
+        self.assertWithinQueryBudget('patch', url, self.items(1, 6, quantity=2), content_type='application/json')
+        self.assertWithinQueryBudget(
+            'put', url, {'status': 'Confirmed', **self.items(0, 3)}, content_type='application/json'
+        )
+        self.assertWithinQueryBudget('delete', url)
+
+    def test_detects_repeated_query_shapes(self):
+        from api.querybudget import fingerprint, inspect_queries
+        self.assertEqual(
+            fingerprint('SELECT * FROM t WHERE id IN (%s, %s,  %s) LIMIT 21'),
+            fingerprint('SELECT * FROM t WHERE id IN (%s) LIMIT 5'),
+        )
+        # sin select_related cada item consulta su producto
+        with inspect_queries() as inspector:
+            [str(item) for item in OrderItem.objects.all()]
+        repeated, = inspector.repeated().values()
+        self.assertEqual(repeated, OrderItem.objects.count())
+        with inspect_queries() as inspector:
+            [str(item) for item in OrderItem.objects.select_related('product')]
+        self.assertEqual((inspector.count, inspector.repeated()), (1, {}))
+
+    def test_middleware_logs_offenders(self):
+        from api.views import OrderViewSet
+        with override_settings(QUERY_INSPECTOR={**settings.QUERY_INSPECTOR, 'ENABLED': True}):
+            self.client = self.client_class()
+            self.client.force_login(self.user)
+            with self.assertNoLogs('api.queries'):
+                response = self.client.get(reverse('order-list'))
+            self.assertEqual(response['X-Query-Count'], '5')
+            original = OrderViewSet.query_budget
+            OrderViewSet.query_budget = {**original, 'list': 2}
+            try:
+                with self.assertLogs('api.queries', 'WARNING') as logs:
+                    self.client.get(reverse('order-list'))
+            finally:
+                OrderViewSet.query_budget = original
+        self.assertIn('5 queries over the budget of 2 for OrderViewSet', logs.output[0])
+
+
+# fuera de un TestCase atomic() ejecuta BEGIN en lugar de un SAVEPOINT, los budgets valen igual
+class QueryBudgetTransactionTestClass(TransactionTestCase):
+    # fuera de una transacción las lecturas de productos y ordenes van a la réplica (api.routers)
+    databases = '__all__'
+
+    @override_settings(QUERY_INSPECTOR={**settings.QUERY_INSPECTOR, 'ENABLED': True})
+    def test_writes_within_budget_outside_test_transaction(self):
+        from api.views import OrderViewSet, ProductImportAPIView
+        admin = User.objects.create_superuser(username='admin', password='test')
+        tv = Product.objects.create(name='TV', description='tv', price=Decimal('300.00'), stock=5)
+        self.client.force_login(admin)
+        with self.assertNoLogs('api.queries'):
+            response = self.client.post(
+                reverse('order-list'), {'items': [{'product': tv.pk, 'quantity': 1}]}, content_type='application/json'
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(int(response['X-Query-Count']), OrderViewSet.query_budget['create'])
+            response = self.client.post(
+                reverse('product-import'), 'name,description,price,stock\nRadio,radio,25.50,2\n', content_type='text/csv'
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(int(response['X-Query-Count']), ProductImportAPIView.query_budget)
+
+
+class CachedJWTAuthenticationTestClass(TestCase):
+    def setUp(self):
+        caches['auth'].clear()
+        self.user = User.objects.create_user(username='user1', password='test')
+        self.token = self.client.post(
+            reverse('token_obtain_pair'), {'username': 'user1', 'password': 'test'}
+        ).json()['access']
+
+    def get_orders(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('order-list'), HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        user_queries = [q for q in ctx.captured_queries if 'FROM "api_user"' in q['sql']]
+        return response.status_code, len(user_queries)
+
+    def test_user_resolved_once_per_token(self):
+        self.assertEqual(self.get_orders(), (status.HTTP_200_OK, 1))
+        self.assertEqual(self.get_orders(), (status.HTTP_200_OK, 0))
+
+    def test_save_invalidates_cached_user(self):
+        self.get_orders()
+        self.user.set_password('otra')
+        self.user.save()
+        self.assertEqual(self.get_orders(), (status.HTTP_200_OK, 1))
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_orders()[0], status.HTTP_401_UNAUTHORIZED)
+        self.user.delete()
+        self.assertEqual(self.get_orders()[0], status.HTTP_401_UNAUTHORIZED)
+
+    def test_user_cached_before_commit_is_not_reused(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Otro'
+            self.user.save()
+            # otra request antes del commit guarda el usuario con la versión intermedia
+            self.assertEqual(self.get_orders(), (status.HTTP_200_OK, 1))
+        self.assertEqual(self.get_orders(), (status.HTTP_200_OK, 1))
+        self.assertEqual(self.get_orders(), (status.HTTP_200_OK, 0))
+
+    def test_version_caches_must_be_shared(self):
+        from api.checks import check_version_caches
+        self.assertEqual(check_version_caches(None), [])
+        for setting in ('JWT_USER_CACHE', 'CATALOG_CACHE'):
+            config = getattr(settings, setting)
+            with override_settings(**{setting: {**config, 'VERSION': 'default'}}):
+                self.assertEqual([(error.id, error.obj) for error in check_version_caches(None)], [('api.E001', setting)])
+            with override_settings(**{setting: {**config, 'VERSION': 'default', 'ENABLED': False}}):
+                self.assertEqual(check_version_caches(None), [])
+
+    def test_version_file_cache_does_not_list_directory_on_set(self):
+        from unittest import mock
+        from api.cache import VersionFileCache
+        with tempfile.TemporaryDirectory() as directory:
+            cache = VersionFileCache(directory, {'TIMEOUT': None, 'OPTIONS': {'MAX_ENTRIES': 0}})
+            with mock.patch.object(cache, '_list_cache_files', wraps=cache._list_cache_files) as list_files:
+                for user_id in range(5):
+                    cache.set(f'auth:user:{user_id}:version', 1)
+                cache.incr('auth:user:0:version')
+            list_files.assert_not_called()
+            self.assertEqual(len(cache.get_many([f'auth:user:{user_id}:version' for user_id in range(5)])), 5)
+            self.assertEqual(cache.get('auth:user:0:version'), 2)
+
+    def test_read_only_claims_user(self):
+        from rest_framework.test import APIRequestFactory
+        from rest_framework_simplejwt.models import TokenUser
+        from api.authentication import ReadOnlyClaimsJWTAuthentication
+        admin = User.objects.create_superuser(username='admin', password='test')
+        token = self.client.post(reverse('token_obtain_pair'), {'username': 'admin', 'password': 'test'}).json()['access']
+        factory = APIRequestFactory()
+        with self.assertNumQueries(0):
+            user, _ = ReadOnlyClaimsJWTAuthentication().authenticate(
+                factory.get('/orders/', HTTP_AUTHORIZATION=f'Bearer {token}')
+            )
+        self.assertIsInstance(user, TokenUser)
+        # el id viene como texto en el claim, los filtros por user_id lo convierten
+        self.assertEqual((str(user.pk), user.is_staff), (str(admin.pk), True))
+        user, _ = ReadOnlyClaimsJWTAuthentication().authenticate(
+            factory.post('/orders/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        )
+        self.assertEqual(user, admin)
+
+
+class LRUCacheTestClass(TestCase):
+    def make_cache(self, **options):
+        from api.cache import LRUCache
+        cache = LRUCache(f'lru-test-{self._testMethodName}', {'OPTIONS': options})
+        cache.clear()
+        return cache
+
+    def test_evicts_least_recently_used_entry(self):
+        cache = self.make_cache(MAX_ENTRIES=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+    def test_evicts_by_total_size(self):
+        cache = self.make_cache(MAX_BYTES=2500)
+        for key in 'abc':
+            cache.set(key, 'x' * 1000)
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertLessEqual(cache.total_bytes, 2500)
+
+    def test_tracks_total_bytes(self):
+        cache = self.make_cache(MAX_BYTES=10000)
+        cache.set('a', 'x' * 1000)
+        cache.set('b', 'x' * 500)
+        cache.set('a', 'x' * 100)
+        cache.set('n', 1)
+        cache.incr('n', 10 ** 30)
+        self.assertEqual(cache.total_bytes, sum(len(value) for value in cache._cache.values()))
+        cache.delete('b')
+        self.assertEqual(cache.total_bytes, sum(len(value) for value in cache._cache.values()))
+        cache.clear()
+        self.assertEqual(cache.total_bytes, 0)
+
+    def test_no_size_bookkeeping_without_max_bytes(self):
+        cache = self.make_cache(MAX_ENTRIES=3)
+        for key in 'abcd':
+            cache.set(key, 'x' * 1000)
+        cache.set('n', 1)
+        self.assertEqual(cache.incr('n'), 2)
+        self.assertEqual((len(cache._cache), cache._sizes, cache.total_bytes), (3, {}, 0))
+
+
+class ConditionalGetTestClass(TestCase):
+    def setUp(self):
+        caches['catalog'].clear()
+        self.tv = Product.objects.create(name='TV', description='tv', price=Decimal('300.00'), stock=5)
+        self.user = User.objects.create_user(username='user1', password='test')
+        self.admin = User.objects.create_superuser(username='admin', password='test')
+
+    def test_product_list_returns_304_for_same_etag(self):
+        url = reverse('product-list')
+        response = self.client.get(url)
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+        caches['catalog'].clear()
+        # sin el cache: solo la consulta del MAX(updated_at), ni el listado ni el serializer
+        with self.assertNumQueries(1):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assertEqual(not_modified.content, b'')
+        # desde el cache no hace ninguna consulta
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_product_etag_changes_on_write_and_delete(self):
+        url = reverse('product-info')
+        etag = self.client.get(url)['ETag']
+        Product.objects.filter(pk=self.tv.pk).update(stock=9)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        Product.objects.create(name='Radio', description='radio', price=Decimal('25.50'), stock=2).delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_product_detail_if_modified_since(self):
+        url = reverse('product-detail', args=[self.tv.pk])
+        last_modified = self.client.get(url)['Last-Modified']
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.client.get(reverse('product-detail', args=[999])).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_order_304_requires_authentication(self):
+        order = Order.objects.create(user=self.user)
+        self.client.force_login(self.user)
+        etag = self.client.get(reverse('order-list'))['ETag']
+        detail_etag = self.client.get(reverse('order-detail', args=[order.pk]))['ETag']
+        self.assertEqual(
+            self.client.get(reverse('order-list'), HTTP_IF_NONE_MATCH=etag).status_code,
+            status.HTTP_304_NOT_MODIFIED
+        )
+        self.assertEqual(
+            self.client.get(reverse('order-detail', args=[order.pk]), HTTP_IF_NONE_MATCH=detail_etag).status_code,
+            status.HTTP_304_NOT_MODIFIED
+        )
+        self.client.logout()
+        response = self.client.get(reverse('order-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_order_etag_changes_when_orders_change(self):
+        order = Order.objects.create(user=self.user)
+        self.client.force_login(self.user)
+        url = reverse('order-list')
+        etag = self.client.get(url)['ETag']
+        self.client.patch(
+            reverse('order-detail', args=[order.pk]),
+            {'items': [{'product': self.tv.pk, 'quantity': 1}]}, content_type='application/json'
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        # otro usuario no cambia el listado del usuario
+        Order.objects.create(user=self.admin)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.client.delete(reverse('order-detail', args=[order.pk]))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+
+class ProductSearchTestClass(TestCase):
+    def setUp(self):
+        caches['catalog'].clear()
+        Product.objects.bulk_create([
+            Product(name='Televisor', description='pantalla de 50 pulgadas', price=Decimal('300.00'), stock=5),
+            Product(name='Radio', description='radio portátil con televisor incluido', price=Decimal('25.50'), stock=2),
+            Product(name='Parlante', description='parlante portátil', price=Decimal('40.00'), stock=3),
+            Product(name='Cable', description='cable para televisor', price=Decimal('5.00'), stock=0),
+        ])
+
+    def search(self, term, **params):
+        response = self.client.get(reverse('product-list'), {'search': term, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [product['name'] for product in response.json()['results']]
+
+    def test_ranked_by_relevance(self):
+        # la coincidencia en el nombre pesa más que en la descripción, Cable no tiene stock
+        self.assertEqual(self.search('televisor'), ['Televisor', 'Radio'])
+        self.assertEqual(self.search('televisor', ordering='price'), ['Radio', 'Televisor'])
+
+    def test_prefix_terms_and_accents(self):
+        self.assertEqual(self.search('tele'), ['Televisor', 'Radio'])
+        self.assertEqual(sorted(self.search('portatil')), ['Parlante', 'Radio'])
+        self.assertEqual(self.search('portatil tele'), ['Radio'])
+        # la sintaxis de FTS5 que escribe el usuario se busca como texto
+        self.assertEqual(self.search('"OR* NEAR('), [])
+
+    def test_index_follows_writes(self):
+        Product.objects.filter(name='Parlante').update(description='bocina inalámbrica')
+        self.assertEqual(self.search('bocina'), ['Parlante'])
+        Product.objects.filter(name='Televisor').delete()
+        self.assertEqual(self.search('televisor'), ['Radio'])
+
+    def test_keyset_pages_through_search_results(self):
+        Product.objects.bulk_create(
+            Product(name=f'Lámpara {i}', description='lámpara', price=Decimal('10.00'), stock=1) for i in range(12)
+        )
+        names, url = [], reverse('product-list') + '?search=lampara'
+        while url:
+            data = self.client.get(url).json()
+            names += [product['name'] for product in data['results']]
+            url = data['next']
+        self.assertEqual(len(names), 12)
+        self.assertEqual(len(set(names)), 12)
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO api_product_fts(api_product_fts) VALUES ('delete-all')")
+        self.assertEqual(self.search('televisor'), [])
+        caches['catalog'].clear()
+        call_command('rebuild_product_search', '--optimize', stdout=StringIO())
+        self.assertEqual(self.search('televisor'), ['Televisor', 'Radio'])
+
+
+# ejecuta cada combinación de filtros contra la API y revisa con EXPLAIN QUERY PLAN la query del listado
+@override_settings(CATALOG_CACHE={**settings.CATALOG_CACHE, 'ENABLED': False})
+class IndexPlanTestClass(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='test')
+        self.admin = User.objects.create_superuser(username='admin', password='test')
+        for user in (self.user, self.admin):
+            for _ in range(3):
+                Order.objects.create(user=user)
+        Product.objects.create(name='TV', description='tv', price=Decimal('300.00'), stock=5)
+
+    def plan(self, url, params, table):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # la query de la página es la única con LIMIT, las demás son sesión, usuario y el MAX del ETag
+        sql, = [q['sql'] for q in ctx.captured_queries if f'FROM "{table}"' in q['sql'] and 'LIMIT' in q['sql']]
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return ' ; '.join(row[-1] for row in cursor.fetchall())
+
+    def assertUsesIndex(self, plan, sorted_in_memory=False):
+        self.assertRegex(plan, r'USING (COVERING )?INDEX \w+_idx')
+        if not sorted_in_memory:
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_product_filters_use_indexes(self):
+        url = reverse('product-list')
+        # sin filtros recorre la tabla en el orden del pk (el rowid) y corta al completar la página
+        self.assertEqual(self.plan(url, {}, 'api_product'), 'SCAN api_product')
+        for params in (
+            {'ordering': 'price'},
+            {'ordering': '-price'},
+            {'price': '300'},
+            {'price__gt': '10', 'ordering': 'price'},
+            {'price__range': '10,500', 'ordering': 'price'},
+        ):
+            with self.subTest(params=params):
+                self.assertUsesIndex(self.plan(url, params, 'api_product'))
+        # un rango ordenado por pk busca en el índice y ordena solo las filas del rango
+        for params in ({'price__lt': '500'}, {'price__gt': '10', 'price__lt': '500'}):
+            with self.subTest(params=params):
+                self.assertUsesIndex(self.plan(url, params, 'api_product'), sorted_in_memory=True)
+
+    def test_order_filters_use_indexes(self):
+        url = reverse('order-list')
+        for user in (self.user, self.admin):
+            self.client.force_login(user)
+            for params in (
+                {},
+                {'status': 'Pending'},
+                {'created_at': '2024-11-28'},
+                {'created_at__lt': '2024-11-28'},
+                {'created_at__gt': '2024-11-28'},
+                {'status': 'Pending', 'created_at': '2024-11-28'},
+                {'ordering': 'created_at'},
+                # segunda página, con el filtro del keyset
+                {'page_size': 1, 'cursor': parse_qs(urlparse(self.client.get(url, {'page_size': 1}).json()['next']).query)['cursor'][0]},
+            ):
+                with self.subTest(user=user.username, params=params):
+                    self.assertUsesIndex(self.plan(url, params, 'api_order'))
+
+    def test_created_at_day_filter_uses_half_open_range(self):
+        from api.filters import OrderFilter
+        order = Order.objects.create(user=self.user)
+        day = order.created_at.date()
+        Order.objects.filter(pk=order.pk).update(created_at=datetime.datetime.combine(day, datetime.time(23, 59, 59, 999999), datetime.timezone.utc))
+        qs = OrderFilter({'created_at': day.isoformat()}, Order.objects.all()).qs
+        self.assertIn(order, qs)
+        self.assertNotIn(order, OrderFilter({'created_at': (day + datetime.timedelta(days=1)).isoformat()}, Order.objects.all()).qs)
+        self.assertNotIn('django_datetime_cast_date', str(qs.query))
+
+
+# los listados en JSON con fast_products / fast_orders y ORJSONRenderer tienen que ser iguales byte a byte
+# a los de los serializers con JSONRenderer
+@override_settings(CATALOG_CACHE={**settings.CATALOG_CACHE, 'ENABLED': False})
+class FastSerializationTestClass(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='user1', password='test')
+        cls.admin = User.objects.create_superuser(username='admin', password='test')
+        products = Product.objects.bulk_create([
+            Product(name='Televisor', description='pantalla de 50"   con ñ', price=Decimal('300.10'), stock=5),
+            Product(name='Radio', description='radio portátil con televisor', price=Decimal('25.5'), stock=2),
+            Product(name='Parlante', description='parlante portátil', price=Decimal('40'), stock=3),
+            Product(name='Cable', description='cable', price=Decimal('0.05'), stock=7),
+        ])
+        for i, user in enumerate([cls.user, cls.user, cls.admin, cls.user]):
+            order = Order.objects.create(user=user, status=Order.StatusChoices.CONFIRMED if i % 2 else 'Pending')
+            OrderItem.objects.bulk_create(
+                OrderItem(order=order, product=product, quantity=i + 1, unit_price=product.price)
+                for product in products[i:]
+            )
+        # una orden sin items
+        Order.objects.create(user=cls.user)
+        Order.objects.recalculate_totals()
+
+    def compare(self, url, params=None):
+        with override_settings(FAST_SERIALIZATION=False, REST_FRAMEWORK={
+            **settings.REST_FRAMEWORK,
+            'DEFAULT_RENDERER_CLASSES': ['rest_framework.renderers.JSONRenderer'],
+        }):
+            expected = self.client.get(url, params)
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, expected.content)
+        return response.json()
+
+    def walk(self, url, params=None):
+        page = self.compare(url, params)
+        while page['next']:
+            page = self.compare(page['next'])
+
+    def test_products(self):
+        for params in ({}, {'ordering': '-price'}, {'search': 'televisor'}, {'price__lt': 50}, {'number': 1},
+                       {'fields': 'price,name', 'number': 1}):
+            self.walk(reverse('product-list'), params)
+
+    def test_orders(self):
+        for user in (self.user, self.admin):
+            self.client.force_login(user)
+            for params in ({}, {'ordering': 'total_price'}, {'page_size': 2}, {'status': 'Pending'},
+                           {'fields': 'status,items.item_subtotal,order_id', 'page_size': 2}, {'fields': 'user'}):
+                self.walk(reverse('order-list'), params)
+
+    def test_fewer_queries(self):
+        self.client.force_login(self.admin)
+        with CaptureQueriesContext(connection) as fast:
+            self.client.get(reverse('order-list'))
+        with override_settings(FAST_SERIALIZATION=False), CaptureQueriesContext(connection) as full:
+            self.client.get(reverse('order-list'))
+        # los items y sus productos salen de una sola query
+        self.assertEqual(len(fast.captured_queries), len(full.captured_queries) - 1)
+
+    def test_browsable_api_uses_serializer(self):
+        response = self.client.get(reverse('product-list'), HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('Televisor', response.content.decode())
+
+    def test_renderer_matches_json_renderer(self):
+        from rest_framework.renderers import JSONRenderer
+        from .renderers import ORJSONRenderer
+        data = {
+            'decimal': Decimal('10.50'), 'date': datetime.date(2024, 1, 2),
+            'datetime': datetime.datetime(2024, 1, 2, 3, 4, 5, 678, tzinfo=datetime.timezone.utc),
+            'text': 'línea\u2028separada\u2029', 1: [None, True, 1.5, (1, 2)],
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        # con indent se usa JSONRenderer
+        context = {'indent': 2}
+        self.assertEqual(ORJSONRenderer().render(data, renderer_context=context),
+                         JSONRenderer().render(data, renderer_context=context))
+
+
+@override_settings(CATALOG_CACHE={**settings.CATALOG_CACHE, 'ENABLED': False})
+class SparseFieldsTestClass(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='admin', password='test')
+        cls.product = Product.objects.create(name='Radio', description='radio portátil', price=Decimal('25.5'), stock=2)
+        cls.order = Order.objects.create(user=cls.admin)
+        OrderItem.objects.create(order=cls.order, product=cls.product, quantity=3)
+        Order.objects.recalculate_totals()
+
+    def get(self, url, fields):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, {'fields': fields})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json(), ' '.join(query['sql'] for query in ctx.captured_queries)
+
+    def test_product_list_and_detail(self):
+        for fast in (True, False):
+            with override_settings(FAST_SERIALIZATION=fast):
+                data, sql = self.get(reverse('product-list'), 'name,price')
+                self.assertEqual(data['results'], [{'name': 'Radio', 'price': '25.50'}])
+                self.assertNotIn('description', sql)
+        data, sql = self.get(reverse('product-detail', kwargs={'product_id': self.product.pk}), 'stock')
+        self.assertEqual(data, {'stock': 2})
+        self.assertNotIn('description', sql)
+
+    def test_order_items_only_when_requested(self):
+        self.client.force_login(self.admin)
+        url = reverse('order-detail', kwargs={'pk': self.order.pk})
+        data, sql = self.get(url, 'status')
+        self.assertEqual(data, {'status': 'Pending'})
+        self.assertNotIn('api_orderitem', sql)
+        data, sql = self.get(url, 'items.quantity,items.item_subtotal')
+        self.assertEqual(data, {'items': [{'quantity': 3, 'item_subtotal': 76.5}]})
+        self.assertNotIn('"api_product"."description"', sql)
+        data, _ = self.get(reverse('order-list'), 'items,order_id')
+        self.assertEqual(set(data['results'][0]), {'order_id', 'items'})
+        self.assertEqual(len(data['results'][0]['items'][0]), 4)
+
+    def test_unknown_fields(self):
+        for fields in ('name,color', 'name.id', 'price.amount'):
+            response = self.client.get(reverse('product-list'), {'fields': fields})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('fields', response.json())
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('order-list'), {'fields': 'items.description'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_writes_ignore_fields(self):
+        self.client.force_login(self.admin)
+        url = reverse('product-detail', kwargs={'product_id': self.product.pk})
+        response = self.client.patch(f'{url}?fields=name', {'stock': 5}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.json()), {'description', 'name', 'price', 'stock', 'thumbnails'})
+
+
+@override_settings(PRODUCT_INFO_CHUNK_SIZE=2)
+class AsyncViewsTestClass(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='admin', password='test')
+        cls.user = User.objects.create_user(username='user1', password='test')
+        cls.products = Product.objects.bulk_create(
+            Product(name=f'Product {i}', description='p', price=Decimal('10.50') * (i + 1), stock=i + 1)
+            for i in range(3)
+        )
+        cls.order = Order.objects.create(user=cls.user)
+        OrderItem.objects.create(order=cls.order, product=cls.products[0], quantity=2)
+        cls.admin_order = Order.objects.create(user=cls.admin)
+        Order.objects.recalculate_totals()
+
+    def setUp(self):
+        caches['catalog'].clear()
+
+    # la misma request con las views sync y con las async, las respuestas tienen que ser iguales
+    def compare(self, url, params=None, **extra):
+        sync_response = self.client.get(url, params, **extra)
+        caches['catalog'].clear()
+        with override_settings(ROOT_URLCONF='backend.async_urls'):
+            response = self.client.get(url, params, **extra)
+            self.assertTrue(hasattr(response.resolver_match.func, 'view_class'))
+        self.assertEqual(response.status_code, sync_response.status_code)
+        self.assertEqual(response.content, sync_response.content)
+        self.assertEqual(response.get('ETag'), sync_response.get('ETag'))
+        return response
+
+    def test_products(self):
+        url = reverse('product-list')
+        for params in ({}, {'ordering': '-price', 'number': 2}, {'fields': 'name,stock'}, {'fields': 'color'}):
+            self.compare(url, params)
+        cursor = self.compare(url, {'number': 2}).json()['next']
+        self.compare(cursor)
+        self.compare(reverse('product-detail', args=[self.products[1].pk]), {'fields': 'price'})
+        self.assertEqual(self.compare(reverse('product-detail', args=[0])).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_orders(self):
+        self.assertEqual(self.compare(reverse('order-list')).status_code, status.HTTP_401_UNAUTHORIZED)
+        for user in (self.user, self.admin):
+            self.client.force_login(user)
+            self.compare(reverse('order-list'))
+            self.compare(reverse('order-list'), {'fields': 'status,items.quantity'})
+            self.compare(reverse('order-detail', args=[self.order.pk]), {'fields': 'items'})
+            response = self.compare(reverse('order-detail', args=[self.admin_order.pk]))
+            self.assertEqual(response.status_code, status.HTTP_200_OK if user.is_staff else status.HTTP_404_NOT_FOUND)
+
+    def test_jwt_and_conditional_get(self):
+        token = self.client.post(
+            reverse('token_obtain_pair'), {'username': 'user1', 'password': 'test'}
+        ).json()['access']
+        response = self.compare(reverse('order-list'), HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(len(response.json()['results']), 1)
+        with override_settings(ROOT_URLCONF='backend.async_urls'):
+            response = self.client.get(
+                reverse('order-list'), HTTP_AUTHORIZATION=f'Bearer {token}', HTTP_IF_NONE_MATCH=response['ETag']
+            )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_browsable_api_and_writes_use_sync_views(self):
+        self.client.force_login(self.admin)
+        with override_settings(ROOT_URLCONF='backend.async_urls'):
+            response = self.client.get(reverse('product-list'), HTTP_ACCEPT='text/html')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertContains(response, 'Product 2')
+            response = self.client.post(
+                reverse('order-list'), {'items': [{'product': self.products[2].pk, 'quantity': 1}]},
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            response = self.client.delete(reverse('order-detail', args=[self.order.pk]))
+            self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_product_info_stream(self):
+        sync_content = b''.join(self.client.get(reverse('product-info')).streaming_content)
+
+        # la view async envía los productos con un generador async
+        async def get_info():
+            response = await self.async_client.get(reverse('product-info'))
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        with override_settings(ROOT_URLCONF='backend.async_urls'):
+            content = async_to_sync(get_info)()
+        self.assertEqual(content, sync_content)
+        self.assertEqual(len(json.loads(content)['products']), 3)
+
+
+# la réplica y los pragmas solo existen con DJANGO_DATABASE_PROFILE=production
+@skipUnless(settings.DATABASE_PROFILE == 'production', 'DJANGO_DATABASE_PROFILE no es production')
+class ReadReplicaTestClass(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        caches['catalog'].clear()
+        self.user = User.objects.create_user(username='user1', password='test')
+        self.product = Product.objects.create(name='TV', description='tv', price=Decimal('300.00'), stock=5)
+
+    def test_pragmas(self):
+        from django.db import connections
+        for alias in ('default', 'replica'):
+            with connections[alias].cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                self.assertEqual(cursor.fetchone()[0], 'wal')
+                cursor.execute('PRAGMA synchronous')
+                # 1 es NORMAL
+                self.assertEqual(cursor.fetchone()[0], 1)
+        with self.assertRaises(OperationalError):
+            Product.objects.using('replica').filter(pk=self.product.pk).update(stock=1)
+
+    def test_reads_use_replica_outside_transactions(self):
+        from django.db import transaction
+        self.assertEqual(Product.objects.all().db, 'replica')
+        self.assertEqual(User.objects.all().db, 'default')
+        with transaction.atomic():
+            self.assertEqual(Product.objects.all().db, 'default')
+
+    def test_views_read_from_replica_and_write_to_default(self):
+        from django.db import connections
+        self.client.force_login(self.user)
+        payload = {'items': [{'product': self.product.pk, 'quantity': 2}]}
+        with CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.post(reverse('order-list'), payload, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # la validación y la respuesta leen de la réplica, la orden y el stock se escriben en default
+        self.assertTrue(all(query['sql'].startswith('SELECT') for query in replica.captured_queries))
+        with CaptureQueriesContext(connections['replica']) as replica:
+            orders = self.client.get(reverse('order-list')).json()['results']
+            stock = self.client.get(reverse('product-detail', args=[self.product.pk])).json()['stock']
+        # lo que confirmó default se ve en la réplica en la request siguiente
+        self.assertEqual((len(orders), stock), (1, 3))
+        self.assertTrue(any('"api_order"' in query['sql'] for query in replica.captured_queries))
+
+
+class ProductThumbnailsTestClass(TestCase):
+    def setUp(self):
+        import shutil
+        caches['catalog'].clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(
+            MEDIA_ROOT=media_root, PRODUCT_THUMBNAILS={**settings.PRODUCT_THUMBNAILS, 'WORKERS': 0}
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.content = self.make_image('RGBA', (1200, 800))
+        self.product = Product.objects.create(
+            name='TV', description='tv', price=Decimal('300.00'), stock=5, image=self.upload(self.content)
+        )
+
+    @staticmethod
+    def make_image(mode, size, format='PNG'):
+        from io import BytesIO
+        from PIL import Image
+        buffer = BytesIO()
+        Image.new(mode, size, 'red').save(buffer, format)
+        return buffer.getvalue()
+
+    @staticmethod
+    def upload(content):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        return SimpleUploadedFile('tv.png', content, content_type='image/png')
+
+    def test_urls_change_with_the_image_content(self):
+        import hashlib
+        self.assertEqual(self.product.image_hash, hashlib.sha256(self.content).hexdigest())
+        detail = self.client.get(reverse('product-detail', args=[self.product.pk])).json()['thumbnails']
+        self.assertEqual(set(detail), set(settings.PRODUCT_THUMBNAILS['SIZES']))
+        self.assertEqual(set(detail['small']), {'webp', 'jpeg'})
+        self.assertTrue(detail['small']['webp'].startswith('/media/thumbnails/' + self.product.image_hash))
+        for fast in (True, False):
+            with override_settings(FAST_SERIALIZATION=fast):
+                caches['catalog'].clear()
+                results = self.client.get(reverse('product-list'), {'fields': 'thumbnails'}).json()['results']
+                self.assertEqual(results, [{'thumbnails': detail}])
+
+        self.product.image = self.upload(self.make_image('RGB', (300, 300)))
+        self.product.save()
+        self.assertNotEqual(self.product.image_hash, hashlib.sha256(self.content).hexdigest())
+        self.product.image = None
+        self.product.save()
+        self.assertEqual(self.client.get(reverse('product-detail', args=[self.product.pk])).json()['thumbnails'], None)
+
+    def test_generated_on_first_request_with_long_cache(self):
+        from io import BytesIO
+        from PIL import Image
+        urls = self.client.get(reverse('product-detail', args=[self.product.pk])).json()['thumbnails']
+        for size_name, formats in urls.items():
+            for format, url in formats.items():
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(response['Content-Type'], f'image/{format}')
+                self.assertIn('immutable', response['Cache-Control'])
+                image = Image.open(BytesIO(b''.join(response.streaming_content)))
+                self.assertEqual(image.format, format.upper())
+                # conserva la proporción 3:2 dentro del tamaño configurado
+                width, height = settings.PRODUCT_THUMBNAILS['SIZES'][size_name]
+                self.assertEqual(image.size, (width, round(width * 2 / 3)))
+        # la segunda vez el archivo ya existe
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(urls['small']['jpeg']).status_code, status.HTTP_200_OK)
+
+    def test_unknown_thumbnails(self):
+        base = '/media/thumbnails/'
+        for name in (f'{self.product.image_hash}-100x100.webp', f'{self.product.image_hash}-160x160.gif',
+                     f'{"0" * 64}-160x160.webp', 'tv.png'):
+            self.assertEqual(self.client.get(base + name).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_concurrent_requests_render_once(self):
+        import threading
+        from unittest import mock
+        from api import thumbnails
+        specs = [((160, 160), 'webp')]
+        with mock.patch('api.thumbnails.render', wraps=thumbnails.render) as render:
+            threads = [
+                threading.Thread(target=thumbnails.ensure_thumbnails, args=(self.product.image.name, self.product.image_hash, specs))
+                for _ in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(render.call_count, 1)
+
+    def test_upload_schedules_every_thumbnail(self):
+        from django.core.files.storage import default_storage
+        with override_settings(PRODUCT_THUMBNAILS={**settings.PRODUCT_THUMBNAILS, 'WORKERS': 1}):
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.product.image = self.upload(self.make_image('RGB', (640, 480)))
+                self.product.save()
+            # el callback de schedule_thumbnails devuelve su Future, el de la versión del catálogo None
+            futures = [future for future in (callback() for callback in callbacks) if future is not None]
+            self.assertEqual(len(futures), 1)
+            names = futures[0].result()
+        self.assertEqual(len(names), 4)
+        self.assertTrue(all(default_storage.exists(name) for name in names))
@@ -0,0 +1,152 @@
+import hashlib
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+logger = logging.getLogger('api.thumbnails')
+
+# miniaturas de Product.image con los tamaños y formatos de PRODUCT_THUMBNAILS
+# cada archivo se llama thumbnails/<sha256 de la imagen original>-<ancho>x<alto>.<ext>, el nombre cambia con el
+# contenido y con el tamaño, así se sirven con Cache-Control de un año (immutable) sin tener que invalidar nada
+# se generan en un pool de hilos al guardar un producto con una imagen nueva y, si todavía no existen,
+# en la primera request que las pide (api.views.product_thumbnail)
+THUMBNAILS_DIR = 'thumbnails'
+# formato: (extensión, formato de Pillow, content type)
+FORMATS = {
+    'webp': ('webp', 'WEBP', 'image/webp'),
+    'jpeg': ('jpg', 'JPEG', 'image/jpeg'),
+}
+_NAME = re.compile(r'(?P<digest>[0-9a-f]{64})-(?P<width>\d+)x(?P<height>\d+)\.(?P<extension>[a-z]+)')
+
+# varias requests que piden la misma miniatura al mismo tiempo: una la genera y las demás esperan el lock y usan
+# el archivo; los locks se reparten por nombre, son una cantidad fija y no hace falta limpiarlos
+_locks = [threading.Lock() for _ in range(64)]
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def image_digest(file):
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_name(digest, size, format):
+    width, height = size
+    return f'{digest}-{width}x{height}.{FORMATS[format][0]}'
+
+
+def thumbnail_name(digest, size, format):
+    return f'{THUMBNAILS_DIR}/{file_name(digest, size, format)}'
+
+
+def configured_specs():
+    config = settings.PRODUCT_THUMBNAILS
+    sizes = dict.fromkeys(tuple(size) for size in config['SIZES'].values())
+    return [(size, format) for size in sizes for format in config['FORMATS']]
+
+
+# (digest, tamaño, formato) de un nombre de archivo, None si no es el de una miniatura configurada
+def parse_name(name):
+    match = _NAME.fullmatch(name)
+    if match is None:
+        return None
+    size = (int(match['width']), int(match['height']))
+    for spec_size, format in configured_specs():
+        if spec_size == size and FORMATS[format][0] == match['extension']:
+            return match['digest'], size, format
+    return None
+
+
+# {'small': {'webp': url, 'jpeg': url}, ...} o None si el producto no tiene imagen
+# los listados lo llaman por cada producto, la URL base se arma una sola vez
+def thumbnail_urls(digest):
+    if not digest:
+        return None
+    config = settings.PRODUCT_THUMBNAILS
+    base_url = default_storage.url(f'{THUMBNAILS_DIR}/')
+    return {
+        name: {format: base_url + file_name(digest, size, format) for format in config['FORMATS']}
+        for name, size in config['SIZES'].items()
+    }
+
+
+def open_source(name):
+    with default_storage.open(name) as file:
+        image = Image.open(file)
+        image.load()
+    # las fotos de los celulares guardan la rotación en EXIF
+    return ImageOps.exif_transpose(image)
+
+
+def render(image, size, format):
+    thumbnail = image.copy()
+    thumbnail.thumbnail(size, Image.Resampling.LANCZOS)
+    has_alpha = thumbnail.mode in ('RGBA', 'LA') or 'transparency' in thumbnail.info
+    if format == 'jpeg' and has_alpha:
+        # JPEG no tiene transparencia, la imagen se pega sobre un fondo blanco
+        rgba = thumbnail.convert('RGBA')
+        thumbnail = Image.new('RGB', rgba.size, 'white')
+        thumbnail.paste(rgba, mask=rgba.getchannel('A'))
+    else:
+        thumbnail = thumbnail.convert('RGBA' if has_alpha else 'RGB')
+    buffer = BytesIO()
+    thumbnail.save(buffer, FORMATS[format][1], quality=settings.PRODUCT_THUMBNAILS['QUALITY'])
+    return buffer.getvalue()
+
+
+# genera las miniaturas de specs [(tamaño, formato)] de la imagen source que todavía no existen
+# la imagen original se abre una sola vez y solo si falta alguna
+def ensure_thumbnails(source, digest, specs):
+    image = None
+    names = []
+    for size, format in specs:
+        name = thumbnail_name(digest, size, format)
+        names.append(name)
+        if default_storage.exists(name):
+            continue
+        with _locks[hash(name) % len(_locks)]:
+            # otro hilo pudo generarla mientras esperábamos el lock
+            if default_storage.exists(name):
+                continue
+            if image is None:
+                image = open_source(source)
+            saved = default_storage.save(name, ContentFile(render(image, size, format)))
+            # otro proceso la guardó primero y el storage eligió otro nombre, el contenido es el mismo
+            if saved != name:
+                default_storage.delete(saved)
+    return names
+
+
+def generate_thumbnails(source, digest):
+    try:
+        return ensure_thumbnails(source, digest, configured_specs())
+    except Exception:
+        # las que falten se vuelven a intentar en la primera request de cada una
+        logger.exception('Could not generate the thumbnails of %s', source)
+        return None
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.PRODUCT_THUMBNAILS['WORKERS'], thread_name_prefix='thumbnails'
+            )
+        return _executor
+
+
+# todas las miniaturas de una imagen nueva en el pool, devuelve el Future o None con WORKERS en 0
+def schedule_thumbnails(source, digest):
+    if not settings.PRODUCT_THUMBNAILS['WORKERS']:
+        return None
+    return get_executor().submit(generate_thumbnails, source, digest)
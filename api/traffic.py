@@ -0,0 +1,270 @@
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+from urllib.parse import urlencode
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.urls import Resolver404, resolve
+
+# valor con el que se reemplazan los datos sensibles de los bodies capturados
+REDACTED = '***'
+
+_write_lock = threading.Lock()
+
+
+def sanitize(value, sensitive):
+    # reemplaza recursivamente los valores de las claves sensibles (password, tokens, ...)
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if key.lower() in sensitive else sanitize(item, sensitive)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [sanitize(item, sensitive) for item in value]
+    return value
+
+
+class TrafficCaptureMiddleware:
+    # agrega cada request a un archivo JSONL para reproducirla después con el comando replay_traffic
+    # no guarda headers, cookies ni tokens: la identidad es el id del usuario autenticado (por sesión o JWT)
+    # configuración en settings.TRAFFIC_CAPTURE, si no está habilitada Django no incluye el middleware
+    def __init__(self, get_response):
+        config = settings.TRAFFIC_CAPTURE
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.path = config['PATH']
+        self.sample_rate = config['SAMPLE_RATE']
+        self.max_body = config['MAX_BODY_BYTES']
+        self.exclude = tuple(config['EXCLUDE_PATHS'])
+        self.sensitive = {name.lower() for name in config['SENSITIVE_FIELDS']}
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if request.path.startswith(self.exclude) or random.random() >= self.sample_rate:
+            return self.get_response(request)
+        # el body se lee antes de la view; las views que leen request.stream siguen funcionando porque
+        # Django lo vuelve a exponer desde memoria, por eso solo se leen los bodies chicos
+        body = self.read_body(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self.capture(request, response, body, start)
+        return response
+
+    async def __acall__(self, request):
+        if request.path.startswith(self.exclude) or random.random() >= self.sample_rate:
+            return await self.get_response(request)
+        # con ASGI el body ya está en memoria (o en un archivo temporal si es grande)
+        body = self.read_body(request)
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        # request.user puede seguir siendo el lazy de la sesión (consulta la DB) y la escritura bloquea, van en un hilo
+        await sync_to_async(self.capture)(request, response, body, start)
+        return response
+
+    def capture(self, request, response, body, start):
+        duration = (time.perf_counter() - start) * 1000
+        # DRF asigna el usuario del JWT también a request.user, después de la view ya está autenticado
+        user = getattr(request, 'user', None)
+        self.write({
+            'ts': time.time(),
+            'method': request.method,
+            'host': request.META.get('HTTP_HOST'),
+            'path': request.path,
+            'query': request.META.get('QUERY_STRING', ''),
+            'content_type': request.content_type if body is not None else None,
+            'body': body,
+            'user': user.pk if user is not None and user.is_authenticated else None,
+            'status': response.status_code,
+            'ms': round(duration, 3),
+        })
+
+    def read_body(self, request):
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return None
+        if not length or length > self.max_body or request.content_type == 'multipart/form-data':
+            return None
+        try:
+            body = request.body.decode(request.encoding or 'utf-8')
+        except UnicodeDecodeError:
+            return None
+        if request.content_type == 'application/json':
+            try:
+                return json.dumps(sanitize(json.loads(body), self.sensitive))
+            except ValueError:
+                return body
+        if request.content_type == 'application/x-www-form-urlencoded':
+            return urlencode(
+                [(key, REDACTED if key.lower() in self.sensitive else value) for key, value in request.POST.items()]
+            )
+        return body
+
+    def write(self, record):
+        # una sola escritura por línea con el archivo en modo append, no se mezclan líneas entre hilos
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with _write_lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+
+def load_records(path, limit=None):
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                records.append(json.loads(line))
+            if limit and len(records) >= limit:
+                break
+    return records
+
+
+def route_name(path):
+    # agrupa las requests por el nombre de la ruta (product-detail) y no por url
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return path
+    return match.view_name or path
+
+
+def access_tokens(user_ids):
+    # el archivo no guarda tokens, para cada usuario capturado se emite uno nuevo con la clave local
+    from rest_framework_simplejwt.tokens import AccessToken
+    from api.models import User
+    tokens = {}
+    for user in User.objects.filter(pk__in=user_ids):
+        token = AccessToken.for_user(user)
+        # el token tiene que durar toda la reproducción, no los 5 minutos por defecto
+        token.set_exp(lifetime=timedelta(days=1))
+        tokens[user.pk] = str(token)
+    return tokens
+
+
+def default_host():
+    # si la request no tiene Host usamos uno que acepte ALLOWED_HOSTS, con DEBUG=False localhost no siempre está
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*' and not host.startswith('.'):
+            return host
+    return 'localhost'
+
+
+def build_environ(record, tokens):
+    body = (record.get('body') or '').encode('utf-8')
+    environ = {
+        'HTTP_HOST': record.get('host') or default_host(),
+        'REQUEST_METHOD': record['method'],
+        'PATH_INFO': record['path'],
+        'QUERY_STRING': record.get('query') or '',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        'CONTENT_LENGTH': str(len(body)),
+    }
+    if record.get('content_type'):
+        environ['CONTENT_TYPE'] = record['content_type']
+    token = tokens.get(record.get('user'))
+    if token:
+        environ['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+    return environ
+
+
+def replay_one(application, record, tokens):
+    status = []
+
+    def start_response(value, headers, exc_info=None):
+        status.append(int(value.split(' ', 1)[0]))
+
+    start = time.perf_counter()
+    result = application(build_environ(record, tokens), start_response)
+    try:
+        # se consume el body completo, las respuestas por partes se generan recién acá
+        for _ in result:
+            pass
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return route_name(record['path']), record['method'], status[0], (time.perf_counter() - start) * 1000
+
+
+def replay_batch(records, tokens, concurrency):
+    # reproduce las requests con un pool de hilos, cada hilo usa sus propias conexiones a la DB
+    from backend.wsgi import application
+
+    def run(record):
+        try:
+            return replay_one(application, record, tokens)
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(run, records))
+
+
+def init_worker():
+    import django
+    django.setup()
+
+
+def replay_process(task):
+    records, tokens = task
+    return replay_batch(records, tokens, 1)
+
+
+def replay(records, concurrency=1, mode='threads'):
+    # devuelve (route, method, status, ms) de cada request y los segundos totales
+    tokens = access_tokens({record['user'] for record in records if record.get('user') is not None})
+    start = time.perf_counter()
+    if mode == 'processes' and concurrency > 1:
+        # cada proceso reproduce una parte de las requests, en orden, con un solo hilo
+        tasks = [(records[number::concurrency], tokens) for number in range(concurrency)]
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=concurrency, initializer=init_worker) as executor:
+            results = [row for rows in executor.map(replay_process, tasks) for row in rows]
+    else:
+        results = replay_batch(records, tokens, concurrency)
+    return results, time.perf_counter() - start
+
+
+def summarize(results, elapsed):
+    from api.endpoint_benchmarks import percentile
+    groups = {}
+    for route, method, status, ms in results:
+        groups.setdefault(f'{method} {route}', []).append((status, ms))
+    groups = {'ALL': [(status, ms) for _, _, status, ms in results], **dict(sorted(groups.items()))}
+    summary = {'requests': len(results), 'seconds': round(elapsed, 3), 'routes': {}}
+    summary['throughput'] = round(len(results) / elapsed, 1) if elapsed else 0
+    for name, rows in groups.items():
+        timings = [ms for _, ms in rows]
+        statuses = {}
+        for status, _ in rows:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        summary['routes'][name] = {
+            'count': len(rows),
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'p99_ms': round(percentile(timings, 99), 3),
+            'max_ms': round(max(timings), 3),
+            'statuses': statuses,
+        }
+    return summary
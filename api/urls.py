@@ -1,13 +1,19 @@
+from django.conf import settings
 from django.urls import path
 from . import views
+from .thumbnails import THUMBNAILS_DIR
 from rest_framework.routers import DefaultRouter
 
 
 urlpatterns = [
-    path('products/', views.ProductListCreateAPIView.as_view()),
+    path('products/', views.ProductListCreateAPIView.as_view(), name='product-list'),
     # path('products/create/', views.ProductCreateAPIView.as_view()),
-    path('products/info/', views.ProductInfoAPIView.as_view()),
-    path('products/<int:product_id>/', views.ProductDetailAPIView.as_view()),    
+    path('products/import/', views.ProductImportAPIView.as_view(), name='product-import'),
+    path('products/info/', views.ProductInfoAPIView.as_view(), name='product-info'),
+    path('products/info/summary/', views.ProductSummaryAPIView.as_view(), name='product-summary'),
+    path('products/<int:product_id>/', views.ProductDetailAPIView.as_view(), name='product-detail'),    
+    # MEDIA_URL es /media/ (Django le agrega el prefijo del script), las URLs de thumbnail_urls apuntan acá
+    path(f'{settings.MEDIA_URL.lstrip("/")}{THUMBNAILS_DIR}/<str:name>', views.product_thumbnail, name='product-thumbnail'),
     # path('orders/', views.OrderListAPIView.as_view()),
     # path('user-orders/', views.UserOrderListAPIView.as_view(), name='user-orders'),
 ]
@@ -1,27 +1,83 @@
-from django.db.models import Max
+import csv
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count, Max
+from django.http import FileResponse, Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_header_parameters
+from django.views.decorators.http import require_safe
+from PIL import Image
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import filters, generics, viewsets
+from rest_framework import filters, generics, serializers, viewsets
 from rest_framework.decorators import api_view, action
-from rest_framework.pagination import (LimitOffsetPagination,
-                                       PageNumberPagination)
+from rest_framework.exceptions import ParseError, UnsupportedMediaType
 from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.views import APIView
 
-from api.filters import InStockFilterBackend, OrderFilter, ProductFilter
+from api.cache import CatalogCacheMixin, cached_for_catalog_version, get_catalog_version
+from api.conditional import ConditionalGetMixin
+from api.filters import (FullTextSearchFilter, InStockFilterBackend, OrderFilter,
+                         ProductFilter, SearchRankOrderingFilter)
+from api.metrics import ORDER_CREATE_FAILURES, ORDERS_CREATED
 from api.models import Order, OrderItem, Product
+from api.pagination import OrderPagination, ProductPagination
+from api.sparse import SparseFieldsMixin
+from api.thumbnails import FORMATS, ensure_thumbnails, parse_name, thumbnail_name
+from api.renderers import CSVRenderer, NDJSONRenderer
 from api.serializers import (OrderItemSerializer, OrderSerializer,
-                             ProductInfoSerializer, ProductSerializer,
-                             OrderCreateSerializer)
+                             ProductImportSerializer, ProductInfoSerializer, ProductSerializer,
+                             ProductSummarySerializer,
+                             OrderCreateSerializer, fast_orders, fast_products)
+
+
+# validadores de las respuestas que dependen de todo el catálogo
+# la versión cambia con cualquier escritura de Product, incluso al borrar, y no consulta la DB
+# Last-Modified es el último updated_at: un borrado no lo cambia, por eso los clientes deberían enviar If-None-Match
+def catalog_validators():
+    return get_catalog_version(), Product.objects.aggregate(last_modified=Max('updated_at'))['last_modified']
+
+
+# con FAST_SERIALIZATION los listados en JSON se arman con fast_serializer desde filas de .values() con las columnas
+# de los fields pedidos (ver fast_products y fast_orders), la API navegable y los demás formatos usan serializer_class
+class FastListMixin:
+    fast_serializer = None
 
+    def list(self, request, *args, **kwargs):
+        if not settings.FAST_SERIALIZATION or request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+        fields = getattr(self, 'sparse_fields', None)
+        queryset = self.get_fast_queryset()
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(self.fast_serializer(queryset, fields))
+        return self.get_paginated_response(self.fast_serializer(page, fields))
 
-class ProductListCreateAPIView(generics.ListCreateAPIView):
+    def get_fast_queryset(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        # pk, los campos de ordering y las anotaciones (search_rank) quedan en las filas para los cursores de la paginación
+        columns = self.get_serializer_class().get_columns(getattr(self, 'sparse_fields', None))
+        return queryset.prefetch_related(None).values(
+            *dict.fromkeys(['pk', *columns, *self.ordering_fields, *queryset.query.annotations])
+        )
+
+
+# ?fields=name,price,stock: solo esos fields en la respuesta y esas columnas en el SELECT (ver api/sparse.py)
+class ProductListCreateAPIView(ConditionalGetMixin, CatalogCacheMixin, SparseFieldsMixin, FastListMixin,
+                               generics.ListCreateAPIView):
     queryset = Product.objects.order_by('pk')
     serializer_class = ProductSerializer
-    pagination_class = LimitOffsetPagination
-    pagination_class.limit_query_param = 'number'
-    pagination_class.max_limit = 5
+    fast_serializer = staticmethod(fast_products)
+    # queries por request con un usuario logueado por sesión (sesión y usuario incluidos), ver api/querybudget.py
+    query_budget = {'get': 4, 'post': 4}
+    # paginación por keyset, las páginas profundas no usan OFFSET ni hacen COUNT(*)
+    pagination_class = ProductPagination
 
     # pagination_class.page_size = 3
     # pagination_class.page_size_query_param = 'size'
@@ -30,14 +86,18 @@ class ProductListCreateAPIView(generics.ListCreateAPIView):
     filterset_class = ProductFilter
     filter_backends = [
         DjangoFilterBackend, 
-        filters.SearchFilter,
-        filters.OrderingFilter,
+        # search usa el índice FTS5 de name y description, ordenado por relevancia
+        FullTextSearchFilter,
+        SearchRankOrderingFilter,
         InStockFilterBackend
         ]
     # =name: las búsquedas que hagamos tiene que coincidir exacto con el valor de name
+    # solo se usa si la base no es SQLite, FullTextSearchFilter delega en SearchFilter
     search_fields = ['=name', 'description']
     # indicamos los fields sobre los cuales podemos ordenar los datos devueltos
     ordering_fields = ['name', 'price', 'stock']
+    # orden por defecto cuando no se envía el parámetro ordering
+    ordering = ['pk']
 
     # get_permissions: permite modificar el atributo permission_classes de forma dinámica
     def get_permissions(self):
@@ -48,12 +108,87 @@ class ProductListCreateAPIView(generics.ListCreateAPIView):
             self.permission_classes = [IsAdminUser]
         return super().get_permissions()
 
+    def get_validators(self, request):
+        return catalog_validators()
+
+
+# importación masiva de productos para administradores, el body es NDJSON o CSV según el Content-Type
+# se lee por líneas sin cargar el archivo completo, cada fila se valida como en ProductSerializer
+# y las válidas se guardan con upsert por nombre en lotes de PRODUCT_IMPORT_BATCH_SIZE
+# las filas inválidas se devuelven con su número y no cancelan el resto de la importación
+class ProductImportAPIView(APIView):
+    permission_classes = [IsAdminUser]
+    # un INSERT ... ON CONFLICT por cada lote de PRODUCT_IMPORT_BATCH_SIZE filas
+    query_budget = 3
+
+    def post(self, request):
+        serializer = ProductImportSerializer()
+        batch_size = settings.PRODUCT_IMPORT_BATCH_SIZE
+        imported = 0
+        errors = []
+        # los nombres repetidos dentro de un lote se unen, queda la última fila
+        batch = {}
+        for number, row in enumerate(self.read_rows(request), start=1):
+            try:
+                data = serializer.run_validation(row)
+            except serializers.ValidationError as exc:
+                errors.append({'row': number, 'errors': exc.detail})
+                continue
+            batch[data['name']] = Product(**data)
+            if len(batch) >= batch_size:
+                imported += self.save_batch(batch)
+        imported += self.save_batch(batch)
+        return Response({'imported': imported, 'errors': errors})
+
+    @staticmethod
+    def save_batch(batch):
+        if not batch:
+            return 0
+        with transaction.atomic():
+            Product.objects.upsert_by_name(list(batch.values()))
+        count = len(batch)
+        batch.clear()
+        return count
+
+    # devuelve las filas del body de a una, dicts o la línea tal cual si no es JSON válido (la validación la rechaza)
+    def read_rows(self, request):
+        if request.stream is None:
+            return
+        # el Content-Type puede traer parámetros (text/csv; charset=utf-8), comparamos solo el tipo
+        media_type, params = parse_header_parameters(request.content_type)
+        if params.get('charset', 'utf-8').lower() not in ('utf-8', 'utf8'):
+            raise UnsupportedMediaType(request.content_type)
+        lines = self.decode_lines(request.stream)
+        if media_type == NDJSONRenderer.media_type:
+            for line in lines:
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield line
+        elif media_type == CSVRenderer.media_type:
+            yield from csv.DictReader(lines)
+        else:
+            raise UnsupportedMediaType(request.content_type)
+
+    @staticmethod
+    def decode_lines(stream):
+        try:
+            for number, line in enumerate(stream):
+                # Excel agrega un BOM al principio de los CSV en UTF-8
+                yield line.decode('utf-8-sig' if number == 0 else 'utf-8')
+        except UnicodeDecodeError:
+            raise ParseError('El archivo tiene que estar en UTF-8')
+
 
 # Podemos actualizar el nombre de la clase para dejarlo con la convención ProductRetrieveUpdateDestroyAPIView
-class ProductDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
+class ProductDetailAPIView(ConditionalGetMixin, CatalogCacheMixin, SparseFieldsMixin,
+                          generics.RetrieveUpdateDestroyAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     lookup_url_kwarg = 'product_id'
+    query_budget = {'get': 4, 'put': 5, 'patch': 5, 'delete': 5}
 
     # agregamos el mismo tipo de autenticación que utilizamos para el alta de productos
     def get_permissions(self):
@@ -62,14 +197,51 @@ class ProductDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
             self.permission_classes = [IsAdminUser]
         return super().get_permissions()
 
+    # solo leemos updated_at del producto, si no existe dejamos que retrieve devuelva el 404
+    def get_validators(self, request):
+        updated_at = self.get_queryset().filter(pk=self.kwargs[self.lookup_url_kwarg]).values_list(
+            'updated_at', flat=True
+        ).first()
+        if updated_at is None:
+            return None
+        return updated_at, updated_at
+
 
-class OrderViewSet(viewsets.ModelViewSet):
+# columnas del CSV de /orders/export/, las de la orden y luego las del item
+ORDER_EXPORT_COLUMNS = [
+    'order_id', 'created_at', 'user', 'status', 'total_price', 'item_count',
+    'product_name', 'product_price', 'quantity', 'item_subtotal',
+]
+
+
+# list y retrieve aceptan ?fields=order_id,status,items.product_name, los items solo se traen si se piden
+class OrderViewSet(ConditionalGetMixin, SparseFieldsMixin, FastListMixin, viewsets.ModelViewSet):
     queryset = Order.objects.prefetch_related('items__product')
     serializer_class = OrderSerializer
+    fast_serializer = staticmethod(fast_orders)
     permission_classes = [IsAuthenticated]
-    pagination_class = None
+    # antes no había paginación y un admin recibía todas las ordenes de la tabla en una sola respuesta
+    pagination_class = OrderPagination
     filterset_class = OrderFilter
-    filter_backends = [DjangoFilterBackend]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    ordering_fields = ['created_at', 'total_price']
+    ordering = ['-created_at']
+    # constantes sin importar la cantidad de ordenes de la página ni de items de cada orden
+    # update: como máximo un bulk_update, un bulk_create y un delete de items
+    # update y destroy vuelven a leer la orden bloqueada dentro de la transacción (Order.lock_for_update)
+    query_budget = {
+        'list': 5, 'retrieve': 6, 'create': 7, 'update': 12, 'partial_update': 12, 'destroy': 8, 'export': 5,
+    }
+
+    def create(self, request, *args, **kwargs):
+        try:
+            response = super().create(request, *args, **kwargs)
+        except Exception as exc:
+            # ValidationError incluye la falta de stock, los demás son errores inesperados
+            ORDER_CREATE_FAILURES.labels(type(exc).__name__).inc()
+            raise
+        ORDERS_CREATED.inc()
+        return response
 
     # perform_create: indicamos realizar algo cuando create se ejecute
     def perform_create(self, serializer):
@@ -77,9 +249,17 @@ class OrderViewSet(viewsets.ModelViewSet):
         # el user con el que se va a guardar en el serializer va a ser el de la request (logueado)
         serializer.save(user=self.request.user)
 
+    # al borrar una orden que no estaba cancelada devolvemos su stock a los productos
+    # el status y los items se vuelven a leer dentro de la transacción, como en OrderCreateSerializer.update
+    def perform_destroy(self, instance):
+        try:
+            instance.delete_releasing_stock()
+        except Order.DoesNotExist:
+            raise Http404
+
     def get_serializer_class(self):
-        # indicamos el cambio de serializer para create o update
-        if self.action == 'create' or self.action == 'update':
+        # indicamos el cambio de serializer para create, update o partial_update (PATCH)
+        if self.action in ('create', 'update', 'partial_update'):
             return OrderCreateSerializer
         return super().get_serializer_class()
 
@@ -87,13 +267,64 @@ class OrderViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         # traemos todos los datos que devuelve queryset de arriba
         qs = super().get_queryset()
+        # al modificar o borrar una orden los items se leen dentro de la transacción (Order.lock_for_update)
+        if self.action in ('update', 'partial_update', 'destroy'):
+            qs = qs.prefetch_related(None)
         # si el user que logueado no pertenece al staff, es decir, no es administrador
         if not self.request.user.is_staff:
             # filtramos los elementos para solo devolver los del usuario logueado
-            qs = qs.filter(user=self.request.user)
+            # por id, así también funciona con el TokenUser de ReadOnlyClaimsJWTAuthentication
+            qs = qs.filter(user_id=self.request.user.pk)
         return qs
 
-    # no necesitamos este endpoint ya que por defecto muestra solo ordenes de usuarios
+    # el listado cambia cuando se crea, modifica o borra alguna orden del usuario (MAX(updated_at) y COUNT)
+    # las ordenes muestran el nombre actual de los productos, por eso sumamos la versión del catálogo
+    def get_validators(self, request):
+        qs = self.filter_queryset(self.get_queryset())
+        if self.action == 'retrieve':
+            try:
+                updated_at = qs.filter(pk=self.kwargs[self.lookup_field]).values_list('updated_at', flat=True).first()
+            except (TypeError, ValueError, ValidationError):
+                # un order_id que no es un UUID, retrieve devuelve el 404
+                return None
+            if updated_at is None:
+                return None
+            return (request.user.pk, updated_at, get_catalog_version()), updated_at
+        if self.action != 'list':
+            return None
+        totals = qs.aggregate(last_modified=Max('updated_at'), count=Count('pk'))
+        return (request.user.pk, totals['count'], totals['last_modified'], get_catalog_version()), totals['last_modified']
+
+    # exporta las ordenes en NDJSON (?format=ndjson, por defecto) o CSV (?format=csv) enviando la respuesta por partes
+    # usa los mismos filtros, orden y permisos que el listado, pero sin paginar
+    # iterator lee las ordenes de a ORDER_EXPORT_CHUNK_SIZE (con un cursor del lado del servidor si la base lo permite)
+    # y hace el prefetch de items__product por cada lote, la memoria depende del lote y no de la cantidad de ordenes
+    @action(detail=False, methods=['get'], url_path='export', renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request):
+        orders = self.filter_queryset(self.get_queryset()).iterator(chunk_size=settings.ORDER_EXPORT_CHUNK_SIZE)
+        # un único serializer para todas las ordenes, no uno por orden
+        serializer = self.get_serializer()
+        rows = (serializer.to_representation(order) for order in orders)
+        renderer = request.accepted_renderer
+        if renderer.format == 'csv':
+            content = CSVRenderer.lines(ORDER_EXPORT_COLUMNS, self.export_csv_rows(rows))
+        else:
+            content = NDJSONRenderer.lines(rows)
+        response = StreamingHttpResponse(content, content_type=f'{renderer.media_type}; charset={renderer.charset}')
+        response['Content-Disposition'] = f'attachment; filename="orders.{renderer.format}"'
+        return response
+
+    # en el CSV cada item es una fila con los datos de su orden, una orden sin items ocupa una fila sin datos de item
+    @staticmethod
+    def export_csv_rows(rows):
+        for row in rows:
+            items = row.pop('items')
+            if not items:
+                yield row
+            for item in items:
+                yield {**row, **item}
+
+
     # # detail: es True si vamos a mostrar solo un elemento, False para una lista de elementos
     # # url_path: la url a la que responde esta consulta GET
     # @action(
@@ -111,19 +342,96 @@ class OrderViewSet(viewsets.ModelViewSet):
     #     return Response(serializer.data)
 
 
+# resumen del catálogo, cacheado por versión del catálogo aparte de la lista de productos
+def get_catalog_summary():
+    return cached_for_catalog_version('summary', Product.objects.summary)
+
+
+# solo el resumen del catálogo, sin los productos
+class ProductSummaryAPIView(ConditionalGetMixin, CatalogCacheMixin, APIView):
+    serializer_class = ProductSummarySerializer
+    query_budget = 3
+
+    def get_validators(self, request):
+        return catalog_validators()
+
+    def get(self, request):
+        return Response(ProductSummarySerializer(get_catalog_summary()).data)
+
+
 # def get(): definimos el método get para métodos HTTP GET
-class ProductInfoAPIView(APIView):
+class ProductInfoAPIView(ConditionalGetMixin, CatalogCacheMixin, APIView):
+    # solo describe el formato de la respuesta en el schema
+    serializer_class = ProductInfoSerializer
+    # una query más por cada PRODUCT_INFO_CHUNK_SIZE productos
+    query_budget = 5
+
+    def get_validators(self, request):
+        return catalog_validators()
+
+    # antes traía todos los productos a memoria, los contaba con len y serializaba el catálogo completo en una respuesta
+    # ahora el resumen sale de un único aggregate y los productos se envían por partes,
+    # la memoria usada depende de PRODUCT_INFO_CHUNK_SIZE y no del tamaño del catálogo
+    # la respuesta completa no se guarda en el cache de respuestas, solo el resumen
     def get(self, request):
-        products = Product.objects.all()
-            # pasamos al serializer genérico ProductInfoSerializer los datos con los que debe generar su respuesta
-        serializer = ProductInfoSerializer({
-            # mediante products indicamos crear el serializer anidado 
-            'products': products,
-            # len cuenta la cantidad de objetos product que trae el query Product.objects.all()
-            'count': len(products),
-            # aggregate: agrega el campo que componemos dentro del paréntesis a los objetos en products
-            # max_price=Max('price'): Max devuelve el valor máximo de la columna price de la DB y lo asigna a max_price
-            # ['max_price']: el nombre que va a tener el campo que agregamos, no tiene que coincidir con max_price=Max...
-            'max_price': products.aggregate(max_price=Max('price'))['max_price']
-        })
-        return Response(serializer.data)
\ No newline at end of file
+        summary = ProductSummarySerializer(get_catalog_summary()).data
+        return StreamingHttpResponse(self.stream(summary), content_type='application/json')
+
+    # genera {"count": ..., "max_price": ..., "min_price": ..., "avg_price": ..., "products": [...]} de a partes
+    @classmethod
+    def stream(cls, summary):
+        yield cls.stream_start(summary)
+        last_pk = None
+        separator = ''
+        while True:
+            products = list(cls.chunk_queryset(last_pk))
+            if not products:
+                break
+            last_pk = products[-1].pk
+            yield separator + cls.render_chunk(products)
+            separator = ', '
+            # un lote incompleto es el último, no hace falta otra consulta
+            if len(products) < settings.PRODUCT_INFO_CHUNK_SIZE:
+                break
+        yield ']}'
+
+    @staticmethod
+    def stream_start(summary):
+        return json.dumps(summary, cls=JSONEncoder)[:-1] + ', "products": ['
+
+    @staticmethod
+    def chunk_queryset(last_pk):
+        # recorremos por pk en lotes (keyset) en lugar de cargar toda la tabla
+        qs = Product.objects.order_by('pk')
+        if last_pk is not None:
+            qs = qs.filter(pk__gt=last_pk)
+        return qs[:settings.PRODUCT_INFO_CHUNK_SIZE]
+
+    @staticmethod
+    def render_chunk(products):
+        # serializamos el lote como lista y quitamos los corchetes para seguir la lista anterior
+        return json.dumps(ProductSerializer(products, many=True).data, cls=JSONEncoder)[1:-1]
+
+
+# miniaturas de Product.image (ver api/thumbnails.py), en la misma ruta que tendrían dentro de MEDIA_URL
+# en producción el servidor web sirve las que ya existen en MEDIA_ROOT y solo pasa a esta view las que faltan
+# una miniatura que todavía no existe se genera acá, en la primera request que la pide
+@require_safe
+def product_thumbnail(request, name):
+    parsed = parse_name(name)
+    if parsed is None:
+        raise Http404
+    digest, size, format = parsed
+    path = thumbnail_name(digest, size, format)
+    if not default_storage.exists(path):
+        source = Product.objects.filter(image_hash=digest).exclude(image='').values_list('image', flat=True).first()
+        if source is None:
+            raise Http404
+        try:
+            ensure_thumbnails(source, digest, [(size, format)])
+        except (OSError, Image.DecompressionBombError) as exc:
+            # la imagen original no existe o Pillow no la puede leer
+            raise Http404 from exc
+    response = FileResponse(default_storage.open(path), content_type=FORMATS[format][2])
+    patch_cache_control(response, public=True, max_age=settings.PRODUCT_THUMBNAILS['MAX_AGE'], immutable=True)
+    return response
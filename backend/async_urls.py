@@ -0,0 +1,14 @@
+"""
+URL configuration for backend project served with ASGI (backend.asgi).
+
+Same routes as backend.urls, but the read endpoints of products and orders use the async views of api.async_views.
+"""
+from django.urls import include, path
+
+from backend.urls import urlpatterns as sync_urlpatterns
+
+
+urlpatterns = [
+    path('', include('api.async_urls')),
+    *sync_urlpatterns,
+]
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -39,12 +40,24 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'rest_framework',
     'api',
-    'silk',
     'drf_spectacular',
     'django_filters',
 ]
 
+# perfilado de requests, se elige por entorno con DJANGO_PROFILING sin cambiar el código:
+# off: sin perfilado
+# sampling: SamplingProfilerMiddleware, mide una muestra en memoria y la escribe cada tanto en PROFILING['PATH']
+# silk: silk graba cada request y sus queries en la misma base de datos, solo para investigar en desarrollo
+PROFILING_MODE = os.environ.get('DJANGO_PROFILING', 'sampling')
+
+if PROFILING_MODE == 'silk':
+    INSTALLED_APPS.append('silk')
+
 MIDDLEWARE = [
+    # van primero para que el tiempo medido incluya a los demás middlewares
+    'api.metrics.MetricsMiddleware',
+    'api.profiling.SamplingProfilerMiddleware',
+    'api.querybudget.QueryInspectorMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,10 +65,19 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'silk.middleware.SilkyMiddleware',
+    # va después de AuthenticationMiddleware para registrar el usuario, solo se usa si TRAFFIC_CAPTURE está habilitado
+    'api.traffic.TrafficCaptureMiddleware',
 ]
 
-ROOT_URLCONF = 'backend.urls'
+if PROFILING_MODE == 'silk':
+    MIDDLEWARE.append('silk.middleware.SilkyMiddleware')
+
+# con DJANGO_ASYNC_VIEWS=1 (el valor por defecto de backend.asgi) los GET de productos y ordenes usan las views async
+# de api/async_views.py; con WSGI (runserver, backend.wsgi) conviene dejarlas apagadas, cada request async
+# correría en su propio event loop
+ASYNC_VIEWS = os.environ.get('DJANGO_ASYNC_VIEWS') == '1'
+
+ROOT_URLCONF = 'backend.async_urls' if ASYNC_VIEWS else 'backend.urls'
 
 TEMPLATES = [
     {
@@ -83,7 +105,60 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # la base de tests es un archivo y no una base en memoria, así los tests concurrentes
+        # usan conexiones independientes con el mismo bloqueo que SQLite tiene en producción
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    }
+}
+
+# production (por defecto): WAL, los pragmas de SQLITE_PRAGMAS, conexiones persistentes y la réplica de lectura
+# default: la configuración de SQLite que trae Django, para comparar con DJANGO_DATABASE_PROFILE=default
+DATABASE_PROFILE = os.environ.get('DJANGO_DATABASE_PROFILE', 'production')
+
+# se ejecutan al abrir cada conexión
+# journal_mode=WAL: las lecturas no esperan a las escrituras ni las escrituras a las lecturas
+# synchronous=NORMAL: con WAL la base sigue siendo consistente, un corte de luz solo pierde las últimas transacciones
+# mmap_size y cache_size: 256 MB del archivo mapeados en memoria y 64 MB de cache de páginas por conexión
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+if DATABASE_PROFILE == 'production':
+    DATABASES['default'].update({
+        # con ASGI cada request corre en otro hilo y una conexión persistente no se vuelve a usar
+        'CONN_MAX_AGE': 0 if ASYNC_VIEWS else 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': ';'.join(f'PRAGMA {name} = {value}' for name, value in SQLITE_PRAGMAS.items()),
+            # segundos que se espera el bloqueo de escritura antes de fallar con "database is locked"
+            'timeout': 20,
+            # transaction.atomic() toma el bloqueo de escritura al empezar, una transacción que leyó y después escribe
+            # no falla con "database is locked" sin esperar el timeout
+            'transaction_mode': 'IMMEDIATE',
+        },
+    })
+    # otra conexión al mismo archivo solo para lecturas (query_only), las usa READ_REPLICA con api.routers
+    # en los tests es un mirror de default
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'OPTIONS': {
+            'init_command': DATABASES['default']['OPTIONS']['init_command'] + ';PRAGMA query_only = ON',
+            'timeout': 20,
+        },
+        'TEST': {'MIRROR': 'default'},
     }
+    DATABASE_ROUTERS = ['api.routers.ReadReplicaRouter']
+
+# las lecturas de estos modelos (las views de productos y ordenes) van a ALIAS, salvo dentro de transaction.atomic()
+READ_REPLICA = {
+    'ALIAS': 'replica',
+    'MODELS': ['api.product', 'api.order', 'api.orderitem'],
 }
 
 
@@ -123,6 +198,10 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# archivos subidos (Product.image) y las miniaturas que se generan de ellos (ver api/thumbnails.py)
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -136,13 +215,24 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         #'rest_framework.authentication.BasicAuthentication',
         # Quitamos BasicAuthentication para trabajar en su lugar con JWTAuthentication
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # CachedJWTAuthentication: JWTAuthentication sin el SELECT del usuario en cada request (ver JWT_USER_CACHE)
+        'api.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 5,
+    # ORJSONRenderer genera los mismos bytes que JSONRenderer, la API navegable sigue disponible
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+SIMPLE_JWT = {
+    # agrega is_staff a los tokens, lo usa ReadOnlyClaimsJWTAuthentication
+    'TOKEN_OBTAIN_SERIALIZER': 'api.authentication.TokenObtainPairSerializer',
 }
 
 SPECTACULAR_SETTINGS = {
@@ -151,4 +241,144 @@ SPECTACULAR_SETTINGS = {
     'VERSION': '1.0.0',
     'SERVE_INCLUDE_SCHEMA': False,
     # OTHER SETTINGS
-}
\ No newline at end of file
+}
+# cantidad de OrderItem que se insertan por cada INSERT al crear o actualizar una orden
+ORDER_ITEMS_BATCH_SIZE = 500
+
+# cantidad de productos que se leen y serializan por vez al enviar /products/info/
+PRODUCT_INFO_CHUNK_SIZE = 1000
+
+# productos por cada INSERT ... ON CONFLICT de la importación masiva (/products/import/)
+PRODUCT_IMPORT_BATCH_SIZE = 1000
+
+# cantidad de ordenes que se leen por vez (con el prefetch de sus items) al exportar /orders/export/
+ORDER_EXPORT_CHUNK_SIZE = 1000
+
+# los listados de productos y ordenes en JSON se arman desde filas de .values() sin pasar por los serializers
+# (api.serializers.fast_products y fast_orders), la respuesta es la misma
+FAST_SERIALIZATION = True
+
+# cache de respuestas de los GET de productos
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # versiones del catálogo (CATALOG_CACHE) y de los usuarios de JWT_USER_CACHE: las tienen que ver todos los workers,
+    # si no un worker sigue usando un usuario desactivado o un listado viejo hasta que vence su TIMEOUT
+    # (lo controla el check api.E001)
+    # un cache en archivos alcanza con todos los workers en un mismo servidor (como el perfil SQLite),
+    # con varios servidores hay que usar redis o memcached
+    # las entradas se leen con pickle, el directorio tiene que ser solo del usuario del servidor (no uno en /tmp)
+    'versions': {
+        'BACKEND': 'api.cache.VersionFileCache',
+        'LOCATION': os.environ.get('DJANGO_VERSIONS_CACHE_DIR', BASE_DIR / 'cache' / 'versions'),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            # una entrada por usuario y una del catálogo, sin límite para no listar el directorio en cada set
+            'MAX_ENTRIES': 0,
+        },
+    },
+    # usuarios de los JWT, uno por usuario y token
+    'auth': {
+        'BACKEND': 'api.cache.LRUCache',
+        'LOCATION': 'auth',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    # cache LRU en memoria limitado por cantidad de entradas y por tamaño total
+    'catalog': {
+        'BACKEND': 'api.cache.LRUCache',
+        # LocMemCache comparte el almacenamiento entre caches con el mismo LOCATION, sin esto limpiar
+        # las respuestas también borraba la versión guardada en default
+        'LOCATION': 'catalog',
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+            'MAX_BYTES': 50 * 1024 * 1024,
+        },
+    },
+}
+
+JWT_USER_CACHE = {
+    'ENABLED': True,
+    # alias de CACHES donde se guardan los usuarios
+    'USERS': 'auth',
+    # alias de CACHES con la versión de cada usuario, tiene que ser compartido por todos los procesos
+    'VERSION': 'versions',
+    # segundos que se usa un usuario guardado, límite para los cambios que no pasan por User.save (queryset.update)
+    'TIMEOUT': 300,
+}
+
+CATALOG_CACHE = {
+    'ENABLED': True,
+    # alias de CACHES donde se guardan las respuestas
+    'RESPONSES': 'catalog',
+    # alias de CACHES donde se guarda la versión del catálogo, compartido por todos los procesos (check api.E001)
+    # con un cache por proceso cada worker tendría su propia versión, seguiría sirviendo listados viejos
+    # y armaría otros ETags
+    'VERSION': 'versions',
+    # segundos que se guarda cada respuesta, la versión ya las invalida cuando cambia un producto
+    'TIMEOUT': 300,
+}
+
+# captura de requests para reproducirlas con el comando replay_traffic
+TRAFFIC_CAPTURE = {
+    'ENABLED': False,
+    # archivo JSONL al que se agregan las requests, una por línea
+    'PATH': BASE_DIR / 'traffic.jsonl',
+    # fracción de las requests que se guardan (1.0 = todas)
+    'SAMPLE_RATE': 1.0,
+    # los bodies más grandes (por ejemplo una importación masiva) se guardan sin body
+    'MAX_BODY_BYTES': 64 * 1024,
+    'EXCLUDE_PATHS': ['/silk/', '/admin/', '/api/token/', '/static/', '/metrics'],
+    # claves de los bodies JSON y de formularios que se reemplazan por ***
+    'SENSITIVE_FIELDS': ['password', 'token', 'access', 'refresh', 'secret'],
+}
+
+PROFILING = {
+    # fracción de las requests que se miden con sus queries (0.01 = 1%)
+    'SAMPLE_RATE': float(os.environ.get('DJANGO_PROFILING_SAMPLE_RATE', '0.01')),
+    # las requests que tardan más de estos ms se registran aunque no estén en la muestra, 0 para no registrarlas
+    'SLOW_MS': float(os.environ.get('DJANGO_PROFILING_SLOW_MS', '500')),
+    # segundos entre cada escritura de lo acumulado en memoria
+    'FLUSH_INTERVAL': 60,
+    # archivo JSONL con una línea por view y ventana de tiempo
+    'PATH': os.environ.get('DJANGO_PROFILING_PATH', BASE_DIR / 'profile.jsonl'),
+}
+
+# métricas en formato Prometheus en /metrics, con varios workers definir PROMETHEUS_MULTIPROC_DIR (ver api/metrics.py)
+METRICS = {
+    'ENABLED': os.environ.get('DJANGO_METRICS', '1') != '0',
+    # requests que no se miden, incluido el propio scrape
+    'EXCLUDE_PATHS': ['/metrics', '/static/'],
+    # quién puede leer /metrics (ver api.metrics.metrics_allowed): IPs o redes separadas por coma, por defecto
+    # solo el propio servidor; detrás de un proxy REMOTE_ADDR es la IP del proxy, conviene usar el token
+    'ALLOWED_IPS': [
+        network.strip()
+        for network in os.environ.get('DJANGO_METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if network.strip()
+    ],
+    # token que Prometheus envía como Authorization: Bearer <token> (authorization en scrape_configs), vacío lo desactiva
+    'TOKEN': os.environ.get('DJANGO_METRICS_TOKEN', ''),
+}
+
+# detección de N+1 y de views que superan su query_budget (ver api/querybudget.py)
+QUERY_INSPECTOR = {
+    # registra los problemas en el logger api.queries; None: solo con DEBUG (el test runner lo desactiva)
+    # en los tests se usa QueryBudgetTestMixin
+    'ENABLED': None,
+    # cantidad de queries con la misma forma en una request a partir de la cual se considera un N+1
+    'REPEATED_THRESHOLD': 3,
+}
+
+# miniaturas de Product.image (ver api/thumbnails.py)
+PRODUCT_THUMBNAILS = {
+    # nombre: (ancho, alto) máximos, la imagen conserva su proporción y nunca se agranda
+    'SIZES': {'small': (160, 160), 'medium': (480, 480)},
+    # formatos que se generan de cada tamaño, WebP para los navegadores que lo aceptan y JPEG para el resto
+    'FORMATS': ['webp', 'jpeg'],
+    'QUALITY': 80,
+    # hilos que generan todas las miniaturas al subir una imagen, 0 para generarlas solo al pedirlas
+    'WORKERS': 2,
+    # los nombres cambian con el contenido de la imagen y el tamaño, el navegador las guarda por un año
+    'MAX_AGE': 365 * 24 * 60 * 60,
+}
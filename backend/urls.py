@@ -14,6 +14,7 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework_simplejwt.views import (
@@ -22,12 +23,13 @@ from rest_framework_simplejwt.views import (
 )
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
 
+from api.metrics import metrics_view
+
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('api.urls')),
-    path('silk/', include('silk.urls', namespace='silk')),
     # rutas para obtener el token de autenticación y para hacer el refresh del mismo
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
@@ -38,4 +40,10 @@ urlpatterns = [
     # Optional UI:
     path('api/schema/swagger-ui/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
     path('api/schema/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
+    # métricas para Prometheus, en la ruta que usa por defecto
+    path('metrics', metrics_view, name='metrics'),
 ]
+
+# la interfaz de silk solo existe con DJANGO_PROFILING=silk
+if 'silk' in settings.INSTALLED_APPS:
+    urlpatterns.append(path('silk/', include('silk.urls', namespace='silk')))